@@ -0,0 +1 @@
+__all__ = ["detector_benchmark", "pipeline_benchmark", "sessions_benchmark", "yuv_benchmark"]
@@ -0,0 +1,98 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from trap.workflow.ncnn_detector import NcnnDetector
+from trap.workflow.detections import Detections
+
+MODELS = [
+    "./models/insects_320_ncnn_model",
+    "./models/insects_640_ncnn_model"
+]
+LORES_SIZE = (320, 320)
+
+
+# ==========================================================================================
+# Compare the native NCNN detector with the ultralytics predictor on the bundled models
+#
+#   python -m benchmarks.detector_benchmark [--images DIR] [--iterations N] [--output FILE]
+#
+# Frames are read from a directory of images (resized to the lores size) or, if none is
+# given, generated as noise. The results are printed and optionally written as JSON
+# ==========================================================================================
+def load_frames(images, count):
+    if images is not None:
+        files = sorted(glob.glob(os.path.join(images, "*.jpg")) + glob.glob(os.path.join(images, "*.png")))
+        frames = [cv2.resize(cv2.imread(f), LORES_SIZE) for f in files[:count]]
+        if frames:
+            return frames
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 255, (LORES_SIZE[1], LORES_SIZE[0], 3), np.uint8) for _ in range(count)]
+
+
+def time_engine(detect, frames, iterations, warmup):
+    for i in range(warmup):
+        detect(frames[i % len(frames)])
+    latencies = []
+    detections = 0
+    for i in range(iterations):
+        start = time.perf_counter()
+        result = detect(frames[i % len(frames)])
+        latencies.append(time.perf_counter() - start)
+        detections += len(result)
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies.mean()),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "fps": float(1000 / latencies.mean()),
+        "detections": detections
+    }
+
+
+def benchmark_model(model, frames, iterations, warmup):
+    results = {}
+
+    detector = NcnnDetector(model)
+    results["ncnn"] = time_engine(detector.detect, frames, iterations, warmup)
+
+    try:
+        from ultralytics import YOLO
+    except ImportError:
+        return results
+
+    yolo = YOLO(model, task="detect")
+    def detect_ultralytics(frame):
+        return Detections.from_ultralytics(yolo.predict(frame, verbose=False)[0])
+    results["ultralytics"] = time_engine(detect_ultralytics, frames, iterations, warmup)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NCNN detector against ultralytics")
+    parser.add_argument("--images", default=None)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    frames = load_frames(args.images, 50)
+    report = {}
+    for model in MODELS:
+        report[os.path.basename(model)] = benchmark_model(model, frames, args.iterations, args.warmup)
+        for engine, result in report[os.path.basename(model)].items():
+            print(f"{os.path.basename(model):28} {engine:12} {result['mean_ms']:7.1f} ms "
+                  f"p95 {result['p95_ms']:7.1f} ms {result['fps']:6.1f} fps")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+from trap.app_root.app_root import Configuration
+from trap.channels.channels_service import ChannelsService
+from trap.executors.executors_service import ExecutorsService
+from trap.metrics.loop_monitor import LoopMonitor
+from trap.sessions.sessions_cache import SessionsCache, SessionState
+from trap.settings.settings_database import SettingsDatabase
+from trap.websocket.websocket_service import WebsocketServer
+from trap.workflow.camera_workflow import CameraWorkflow, NCNN_MODEL
+
+# frames kept per stage for the latency percentiles, enough for a whole run
+LATENCY_HISTORY = 1000000
+
+
+# ==========================================================================================
+# Replay recorded (or generated) frames through the whole detection pipeline at maximum
+# speed : capture, gating, inference, tracking, encoding and persistence by the
+# SessionsCache into a temporary sessions directory
+#
+#   python -m benchmarks.pipeline_benchmark --source images --path DIR [--output FILE]
+#   python -m benchmarks.pipeline_benchmark --source synthetic --frames 500 --detector ncnn
+#
+# The fps, the p50/p95/p99 latency of each stage, the event loop lag, the peak RSS and the
+# bytes written are printed and optionally written as JSON, with the commit and the
+# settings of the run, so that runs can be compared across commits, models and settings
+# ==========================================================================================
+def commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def directory_bytes(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            total += os.path.getsize(os.path.join(root, file))
+    return total
+
+
+def io_write_bytes():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_kb():
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return own, children
+
+
+def configuration(args, directory):
+    settings_path = os.path.join(directory, "configuration")
+    sessions_path = os.path.join(directory, "sessions")
+    os.makedirs(settings_path)
+    os.makedirs(sessions_path)
+    return Configuration(
+        "BENCHMARK", "replay", settings_path, sessions_path, 0, None,
+        pipeline_depth=args.pipeline_depth,
+        buffer_mode=args.buffer_mode,
+        detector=args.detector,
+        detector_model=args.model,
+        tracker=args.tracker,
+        detect_interval=args.detect_interval,
+        gate=args.gate,
+        tiling=args.tiling,
+        inference_workers=args.inference_workers,
+        inference_threads=args.inference_threads,
+        encode_workers=args.encode_workers,
+        io_workers=args.io_workers,
+        metadata_store=args.metadata_store,
+        image_store=args.image_store,
+        write_behind_interval=args.write_behind_interval,
+        fsync=args.fsync,
+        main_format=args.main_format,
+        source=args.source,
+        source_path=args.path,
+        source_count=args.frames,
+        latency_history=LATENCY_HISTORY
+    )
+
+
+async def drained(workflow):
+    while not workflow.source_done.is_set():
+        await asyncio.sleep(0.05)
+    stages = workflow.pipeline.stages
+    while (stages["encode"].frames + workflow.inference_queue.dropped + workflow.encode_queue.dropped
+           < workflow.sequence or not workflow.persist_queue.empty()):
+        await asyncio.sleep(0.05)
+    # let the persist stage finish the last batch
+    await asyncio.sleep(0.2)
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory(prefix="trap-benchmark-") as directory:
+        config = configuration(args, directory)
+        channels = ChannelsService()
+        websocket = WebsocketServer(config, channels)
+        executors = ExecutorsService(config)
+        settings = SettingsDatabase(config, channels, websocket, executors)
+        settings.settings.min_score = args.min_score
+        sessions = SessionsCache(config, channels, settings, websocket, executors)
+        workflow = CameraWorkflow(config, channels, settings, websocket, executors)
+
+        session = datetime.now().strftime("%Y%m%d%H%M%S")
+        await sessions.session(SessionState(state=True, session=session))
+        workflow.current_session = session
+        workflow.detection_state = True
+
+        monitor = LoopMonitor(args.loop_lag_threshold)
+        written = io_write_bytes()
+        start = time.perf_counter()
+        tasks = asyncio.gather(workflow.workflow_task(), sessions.run_cache_task(), monitor.run_monitor_task())
+        try:
+            await drained(workflow)
+            # writes what is waiting
+            await sessions.session(SessionState(state=False, session=session))
+        finally:
+            elapsed = time.perf_counter() - start
+            tasks.cancel()
+            try:
+                await tasks
+            except asyncio.CancelledError:
+                pass
+            executors.shutdown()
+
+        rss, children_rss = peak_rss_kb()
+        end_written = io_write_bytes()
+        stats = workflow.pipeline.stats()
+        return {
+            "commit": commit(),
+            "label": args.label,
+            "settings": {key: value for key, value in vars(args).items() if key not in ("output", "label")},
+            "frames": workflow.sequence,
+            "elapsed_s": elapsed,
+            "fps": workflow.sequence / elapsed if elapsed > 0 else 0.0,
+            "dropped": workflow.inference_queue.dropped + workflow.encode_queue.dropped,
+            "stages": {
+                name: {
+                    "frames": s["frames"],
+                    "fps": s["frames"] / elapsed if elapsed > 0 else 0.0,
+                    "mean_ms": s["latency_ms"],
+                    "p50_ms": s["p50_ms"],
+                    "p95_ms": s["p95_ms"],
+                    "p99_ms": s["p99_ms"]
+                }
+                for name, s in stats.items()
+            },
+            "detections": sessions.sessions[session].detections,
+            "persist": sessions.writes.stats(),
+            "loop": monitor.stats(),
+            "peak_rss_kb": rss,
+            "peak_rss_children_kb": children_rss,
+            "session_bytes": directory_bytes(config.sessions_path),
+            "io_write_bytes": None if written is None or end_written is None else end_written - written
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay frames through the detection pipeline")
+    parser.add_argument("--source", default="synthetic", choices=["images", "video", "synthetic"])
+    parser.add_argument("--path", default=None, help="image directory or video file")
+    parser.add_argument("--frames", type=int, default=300, help="number of synthetic frames")
+    parser.add_argument("--detector", default="ncnn")
+    parser.add_argument("--model", default=NCNN_MODEL)
+    parser.add_argument("--tracker", default="builtin")
+    parser.add_argument("--detect-interval", type=int, default=1)
+    parser.add_argument("--gate", action="store_true")
+    parser.add_argument("--tiling", default="off")
+    parser.add_argument("--inference-workers", type=int, default=0)
+    parser.add_argument("--inference-threads", type=int, default=1)
+    parser.add_argument("--encode-workers", type=int, default=None)
+    parser.add_argument("--io-workers", type=int, default=2)
+    parser.add_argument("--metadata-store", default="json", choices=["json", "sqlite"])
+    parser.add_argument("--image-store", default="files", choices=["files", "pack"])
+    parser.add_argument("--write-behind-interval", type=float, default=1.0)
+    parser.add_argument("--fsync", action="store_true")
+    parser.add_argument("--main-format", default="RGB888")
+    parser.add_argument("--buffer-mode", default="copy")
+    parser.add_argument("--pipeline-depth", type=int, default=2)
+    parser.add_argument("--min-score", type=float, default=0.5)
+    parser.add_argument("--loop-lag-threshold", type=float, default=0.1)
+    parser.add_argument("--label", default=None)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"{report['frames']} frames in {report['elapsed_s']:.1f} s, {report['fps']:.1f} fps, "
+          f"{report['dropped']} dropped, {report['detections']} detections")
+    for name, stage in report["stages"].items():
+        print(f"  {name:10} {stage['fps']:7.1f} fps  p50 {stage['p50_ms']:7.1f} ms  "
+              f"p95 {stage['p95_ms']:7.1f} ms  p99 {stage['p99_ms']:7.1f} ms")
+    persist = report["persist"]
+    print(f"persist {persist['writes']}/{persist['updates']} metadata and "
+          f"{persist['image_writes']}/{persist['image_updates']} images written")
+    print(f"loop max lag {report['loop']['max_lag_ms']:.1f} ms, {report['loop']['stalls']} stalls")
+    print(f"peak rss {report['peak_rss_kb'] / 1024:.1f} MiB, "
+          f"written {report['session_bytes'] / 1024:.1f} KiB to the session")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
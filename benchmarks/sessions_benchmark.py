@@ -0,0 +1,178 @@
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from strong_typing.serialization import json_to_object, object_to_json
+
+from trap.app_root.app_root import Configuration
+from trap.channels.channels_service import ChannelsService
+from trap.executors.executors_service import ExecutorsService, EXECUTOR_IO
+from trap.sessions.detection_metadata import DetectionMetadata
+from trap.sessions.pack_image_store import PackFile
+from trap.sessions.sessions_cache import SessionsCache
+from trap.settings.settings_database import SettingsDatabase
+from trap.websocket.websocket_service import WebsocketServer
+
+
+# ==========================================================================================
+# Measure the cold start of the SessionsCache on generated sessions
+#
+#   python -m benchmarks.sessions_benchmark [--sessions N] [--detections N] [--drop-caches]
+#                                           [--metadata-store json|sqlite] [--image-store files|pack]
+#
+# The sessions are written without manifests, as recorded before there were any, then :
+#  - scan      : every metadata file is read, as the cache used to do at startup
+#  - upgrade   : the first start, which rebuilds the manifests (json) or imports the
+#                sessions into the database (sqlite)
+#  - start     : a start from the manifests
+#  - first     : the first load of the detections of a session
+#  - resident  : a load of the detections of a session that is already resident
+#  - top       : the 10 best detections of a session, from the metadata store
+#  - images    : all the images of a session, as sent to the app
+#  - delete    : the deletion of a session
+# With --drop-caches (as root) the page cache is dropped before each step, otherwise the
+# files are read from the page cache and only the CPU cost is measured
+# ==========================================================================================
+def drop_caches(enabled):
+    if not enabled:
+        return
+    os.sync()
+    with open("/proc/sys/vm/drop_caches", "w") as f:
+        f.write("3\n")
+
+
+def make_sessions(path, sessions, detections, image_bytes, image_store):
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 255, image_bytes, np.uint8).tobytes()
+    created = int(time.time() * 1000)
+    for s in range(sessions):
+        session = f"20240101{s:06d}"
+        os.makedirs(f"{path}/{session}/metadata")
+        pack = None
+        if image_store == "pack":
+            pack = PackFile(f"{path}/{session}")
+        else:
+            os.makedirs(f"{path}/{session}/images")
+        for d in range(detections):
+            metadata = DetectionMetadata(session, d, created, created + 1000, float(rng.random()), 0, 200, 200)
+            with open(f"{path}/{session}/metadata/{d}.json", "w") as f:
+                f.write(json.dumps(object_to_json(metadata)))
+            if pack is not None:
+                pack.append(d, image)
+            else:
+                with open(f"{path}/{session}/images/{d}.jpg", "wb") as f:
+                    f.write(image)
+        if pack is not None:
+            pack.close()
+
+
+# what the cache used to do at startup, read the metadata of every detection
+def scan_metadata(path):
+    detections = 0
+    for session in sorted(os.listdir(path)):
+        metadata_path = f"{path}/{session}/metadata"
+        for file in sorted(os.listdir(metadata_path)):
+            with open(f"{metadata_path}/{file}", "rb") as f:
+                json_to_object(DetectionMetadata, json.loads(f.read().decode("utf-8")))
+            detections += 1
+    return detections
+
+
+async def timed(step, enabled):
+    drop_caches(enabled)
+    start = time.perf_counter()
+    result = await step()
+    return time.perf_counter() - start, result
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory(prefix="trap-sessions-benchmark-") as directory:
+        settings_path = os.path.join(directory, "configuration")
+        sessions_path = os.path.join(directory, "sessions")
+        os.makedirs(settings_path)
+        os.makedirs(sessions_path)
+        make_sessions(sessions_path, args.sessions, args.detections, args.image_bytes, args.image_store)
+
+        config = Configuration("BENCHMARK", "replay", settings_path, sessions_path, 0, None,
+                               resident_sessions=args.resident, metadata_store=args.metadata_store,
+                               image_store=args.image_store)
+        channels = ChannelsService()
+        executors = ExecutorsService(config)
+        websocket = WebsocketServer(config, channels)
+        settings = SettingsDatabase(config, channels, websocket, executors)
+
+        async def start():
+            cache = SessionsCache(config, channels, settings, websocket, executors)
+            await cache.init_task
+            return cache
+
+        async def scan():
+            return await executors.run(EXECUTOR_IO, scan_metadata, sessions_path)
+
+        scan_time, _ = await timed(scan, args.drop_caches)
+        upgrade_time, _ = await timed(start, args.drop_caches)
+        start_time, cache = await timed(start, args.drop_caches)
+
+        session = sorted(cache.sessions)[0]
+        first_time, _ = await timed(lambda: cache._resident(session), args.drop_caches)
+        resident_time, _ = await timed(lambda: cache._resident(session), False)
+        top_time, _ = await timed(lambda: executors.run(EXECUTOR_IO, cache.store.top_detections, session, 10),
+                                  args.drop_caches)
+
+        async def images():
+            detections = list((await cache._resident(session)).values())
+            return [det.to_proto() async for det in cache._stream_detections(session, detections)]
+
+        images_time, _ = await timed(images, args.drop_caches)
+        delete_time, _ = await timed(lambda: executors.run(EXECUTOR_IO, cache._delete_session_directory, session),
+                                     args.drop_caches)
+        cache.store.close()
+        cache.images.close()
+        executors.shutdown()
+
+        return {
+            "metadata_store": args.metadata_store,
+            "image_store": args.image_store,
+            "sessions": args.sessions,
+            "detections_per_session": args.detections,
+            "page_cache_dropped": args.drop_caches,
+            "scan_ms": 1000 * scan_time,
+            "upgrade_ms": 1000 * upgrade_time,
+            "start_ms": 1000 * start_time,
+            "first_load_ms": 1000 * first_time,
+            "resident_load_ms": 1000 * resident_time,
+            "top_ms": 1000 * top_time,
+            "images_ms": 1000 * images_time,
+            "delete_ms": 1000 * delete_time
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold start of the sessions cache")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--detections", type=int, default=250)
+    parser.add_argument("--image-bytes", type=int, default=20000)
+    parser.add_argument("--resident", type=int, default=4)
+    parser.add_argument("--drop-caches", action="store_true")
+    parser.add_argument("--metadata-store", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--image-store", choices=["files", "pack"], default="files")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"{report['sessions']} sessions of {report['detections_per_session']} detections, "
+          f"{report['metadata_store']} metadata store, {report['image_store']} image store")
+    for name in ("scan", "upgrade", "start", "first_load", "resident_load", "top", "images", "delete"):
+        print(f"  {name:14} {report[name + '_ms']:9.1f} ms")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
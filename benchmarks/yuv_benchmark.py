@@ -0,0 +1,118 @@
+import argparse
+import json
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from trap.executors.executors_service import NamedExecutor, EXECUTOR_ENCODE
+from trap.workflow.jpeg_encoder import JpegEncoder, EncodeProfile
+from trap.workflow.yuv import Yuv420Image
+
+MAIN_SIZE = (2028, 1520)
+STRIDE = 2048
+
+
+# ==========================================================================================
+# Compare an RGB888 main stream with a YUV420 one on synthetic frames
+#
+#   python -m benchmarks.yuv_benchmark [--frames N] [--crops N] [--crop-size PX] [--output FILE]
+#
+# Each frame is handled as in copy mode while detecting : the main buffer is copied out
+# of the (simulated) camera buffer and the crops of the detections are encoded, from
+# the RGB array or from the YUV planes. The time per frame, the size of the buffers and
+# the peak memory allocated while handling a frame are reported
+# ==========================================================================================
+def synthetic_frames(count):
+    rng = np.random.default_rng(0)
+    width, height = MAIN_SIZE
+    frames = []
+    for _ in range(count):
+        bgr = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), np.uint8), (9, 9), 3)
+        i420 = cv2.cvtColor(bgr, cv2.COLOR_BGR2YUV_I420).reshape(-1)
+
+        # lay the planes out with the row stride of the camera buffers
+        yuv = np.zeros((height * 3 // 2, STRIDE), np.uint8)
+        n = width * height
+        yuv[:height, :width] = i420[:n].reshape(height, width)
+        quarter = height // 4
+        yuv[height:height + quarter].reshape(height // 2, STRIDE // 2)[:, :width // 2] = \
+            i420[n:n + n // 4].reshape(height // 2, width // 2)
+        yuv[height + quarter:].reshape(height // 2, STRIDE // 2)[:, :width // 2] = \
+            i420[n + n // 4:].reshape(height // 2, width // 2)
+        frames.append((bgr, yuv))
+    return frames
+
+
+def crop_boxes(count, size, seed):
+    rng = np.random.default_rng(seed)
+    width, height = MAIN_SIZE
+    x = rng.integers(0, width - size, count)
+    y = rng.integers(0, height - size, count)
+    return [(int(x0), int(y0), int(x0) + size, int(y0) + size) for x0, y0 in zip(x, y)]
+
+
+def handle_rgb(encoder, profile, camera_buffer, buffer, boxes):
+    np.copyto(buffer, camera_buffer)
+    return sum(len(encoder.encode_sync(buffer[y0:y1, x0:x1], profile)) for x0, y0, x1, y1 in boxes)
+
+
+def handle_yuv(encoder, profile, camera_buffer, buffer, boxes):
+    np.copyto(buffer, camera_buffer)
+    image = Yuv420Image(buffer, *MAIN_SIZE)
+    return sum(len(encoder.encode_planes_sync(image.planes(*box), profile)) for box in boxes)
+
+
+def run(handle, frames, index, crops, crop_size):
+    encoder = JpegEncoder(NamedExecutor(EXECUTOR_ENCODE, 1))
+    profile = EncodeProfile("archive", 92)
+    buffer = np.empty_like(frames[0][index])
+
+    latencies = []
+    peaks = []
+    encoded = 0
+    for i, frame in enumerate(frames):
+        boxes = crop_boxes(crops, crop_size, i)
+        tracemalloc.start()
+        start = time.perf_counter()
+        encoded += handle(encoder, profile, frame[index], buffer, boxes)
+        latencies.append(time.perf_counter() - start)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean_ms": float(latencies.mean()),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "buffer_bytes": int(buffer.nbytes),
+        "peak_alloc_bytes": int(max(peaks)),
+        "jpeg_bytes_per_frame": encoded // len(frames)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark an RGB888 against a YUV420 main stream")
+    parser.add_argument("--frames", type=int, default=30)
+    parser.add_argument("--crops", type=int, default=4)
+    parser.add_argument("--crop-size", type=int, default=200)
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    frames = synthetic_frames(args.frames)
+    report = {
+        "rgb888": run(handle_rgb, frames, 0, args.crops, args.crop_size),
+        "yuv420": run(handle_yuv, frames, 1, args.crops, args.crop_size)
+    }
+    for name, result in report.items():
+        print(f"{name:8} {result['mean_ms']:7.2f} ms p95 {result['p95_ms']:7.2f} ms "
+              f"buffer {result['buffer_bytes'] / 2 ** 20:5.1f} MiB "
+              f"peak alloc {result['peak_alloc_bytes'] / 2 ** 10:7.1f} KiB")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,13 +6,16 @@ import os
 from datetime import datetime
 
 from trap.channels.channels_service import ChannelsService
+from trap.executors.executors_service import ExecutorsService
+from trap.metrics.loop_monitor import LoopMonitor
+from trap.metrics.metrics_service import MetricsService
 from trap.network.network_manager import NetworkManager
 from trap.sessions.sessions_cache import SessionsCache
 from trap.bluetooth.bluetooth_service import BluetoothService
 from trap.settings.settings_database import SettingsDatabase
 from trap.webdav.webdav_server import WebDavServer
 from trap.websocket.websocket_service import WebsocketServer
-from trap.workflow.camera_workflow import CameraWorkflow
+from trap.workflow.camera_workflow import CameraWorkflow, NCNN_MODEL, MODELS, create_batch_detector
 
 SESSIONS_DIRECTORY = "./sessions"
 CONFIG_FILE = "configuration/config.ini"
@@ -22,35 +25,113 @@ def session_to_datetime(session) :
     return datetime.strptime(session,session_format)
 
 class Configuration :
-    def __init__(self, node_name, camera_type, settings_path, sessions_path, websocket_port, bluetooth_service ):
+    def __init__(self, node_name, camera_type, settings_path, sessions_path, websocket_port, bluetooth_service,
+                 pipeline_depth=2, buffer_mode="mapped", buffer_pool_size=8,
+                 detector="ultralytics", detector_model=NCNN_MODEL, tracker="ultralytics", detect_interval=1,
+                 gate=False, gate_motion_threshold=0.5, gate_min_sharpness=15.0, gate_max_skip=30,
+                 tiling="off", tile_model=None, tile_max=6, tile_workers=2,
+                 model_selection=False, models=(), target_fps=5.0, max_temperature=75.0,
+                 encode_workers=None, preview_quality=70, preview_max_dimension=None,
+                 archive_quality=92, archive_max_dimension=None, overlay="metadata",
+                 inference_workers=0, worker_cpus=None, camera_numbers=(0,), batch_window=0.02,
+                 main_format="RGB888", source="picamera2", source_path=None, source_fps=0.0,
+                 source_loop=False, source_count=None, latency_history=512,
+                 metrics_host="127.0.0.1", metrics_port=9464,
+                 inference_threads=1, inference_cpus=None, encode_cpus=None, io_workers=2, io_cpus=None,
+                 loop_lag_threshold=0.1, resident_sessions=4, metadata_store="json",
+                 metadata_database=None, image_store="files", write_behind_interval=1.0,
+                 write_behind_max_entries=256, write_behind_max_bytes=4194304, fsync=False):
         self.node_name = node_name
         self.camera_type = camera_type
         self.settings_path = settings_path
         self.sessions_path = sessions_path
         self.websocket_port = websocket_port
         self.bluetooth_service = bluetooth_service
+        self.pipeline_depth = pipeline_depth
+        self.buffer_mode = buffer_mode
+        self.buffer_pool_size = buffer_pool_size
+        self.detector = detector
+        self.detector_model = detector_model
+        self.tracker = tracker
+        self.detect_interval = detect_interval
+        self.gate = gate
+        self.gate_motion_threshold = gate_motion_threshold
+        self.gate_min_sharpness = gate_min_sharpness
+        self.gate_max_skip = gate_max_skip
+        self.tiling = tiling
+        self.tile_model = tile_model
+        self.tile_max = tile_max
+        self.tile_workers = tile_workers
+        self.model_selection = model_selection
+        self.models = models
+        self.target_fps = target_fps
+        self.max_temperature = max_temperature
+        self.encode_workers = encode_workers
+        self.preview_quality = preview_quality
+        self.preview_max_dimension = preview_max_dimension
+        self.archive_quality = archive_quality
+        self.archive_max_dimension = archive_max_dimension
+        self.overlay = overlay
+        self.inference_workers = inference_workers
+        self.worker_cpus = worker_cpus
+        self.camera_numbers = camera_numbers
+        self.batch_window = batch_window
+        self.main_format = main_format
+        self.source = source
+        self.source_path = source_path
+        self.source_fps = source_fps
+        self.source_loop = source_loop
+        self.source_count = source_count
+        self.latency_history = latency_history
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self.inference_threads = inference_threads
+        self.inference_cpus = inference_cpus
+        self.encode_cpus = encode_cpus
+        self.io_workers = io_workers
+        self.io_cpus = io_cpus
+        self.loop_lag_threshold = loop_lag_threshold
+        self.resident_sessions = resident_sessions
+        self.metadata_store = metadata_store
+        self.metadata_database = metadata_database
+        self.image_store = image_store
+        self.write_behind_interval = write_behind_interval
+        self.write_behind_max_entries = write_behind_max_entries
+        self.write_behind_max_bytes = write_behind_max_bytes
+        self.fsync = fsync
 
 class ConfigFile :
 
     def __init__(self):
         self.config = configparser.ConfigParser()
         self.file_exists = False
-        if os.path.exists('CONFIG_FILE'):
-            self.config.read('CONFIG_FILE')
+        if os.path.exists(CONFIG_FILE):
+            self.config.read(CONFIG_FILE)
             self.file_exists = True
 
     def read_value(self, name, default):
         if self.file_exists:
-            value = self.config["trap"][name]
-            if value is not None:
-                return value
+            return self.config.get("trap", name, fallback=default)
         return default
 
     def read_int_value(self, name, default):
         if self.file_exists:
-            value = self.config.getint("trap", name)
-            if value is None:
-                return value
+            return self.config.getint("trap", name, fallback=default)
+        return default
+
+    def read_float_value(self, name, default):
+        if self.file_exists:
+            return self.config.getfloat("trap", name, fallback=default)
+        return default
+
+    def read_list_value(self, name, default):
+        if self.file_exists and self.config.has_option("trap", name):
+            return [v.strip() for v in self.config.get("trap", name).split(",") if v.strip()]
+        return default
+
+    def read_bool_value(self, name, default):
+        if self.file_exists:
+            return self.config.getboolean("trap", name, fallback=default)
         return default
 
 class AppRoot:
@@ -66,27 +147,107 @@ class AppRoot:
             self.config_file.read_value("sessionsPath", "./sessions"),
             self.config_file.read_int_value("websocket", 8096),
             self.config_file.read_value("bluetoothService", "213e313b-d0df-4350-8e5d-ae657962bb56"),
+            pipeline_depth=self.config_file.read_int_value("pipelineDepth", 2),
+            buffer_mode=self.config_file.read_value("bufferMode", "mapped"),
+            buffer_pool_size=self.config_file.read_int_value("bufferPoolSize", 8),
+            detector=self.config_file.read_value("detector", "ultralytics"),
+            detector_model=self.config_file.read_value("detectorModel", NCNN_MODEL),
+            tracker=self.config_file.read_value("tracker", "ultralytics"),
+            detect_interval=self.config_file.read_int_value("detectInterval", 1),
+            gate=self.config_file.read_bool_value("gate", False),
+            gate_motion_threshold=self.config_file.read_float_value("gateMotionThreshold", 0.5),
+            gate_min_sharpness=self.config_file.read_float_value("gateMinSharpness", 15.0),
+            gate_max_skip=self.config_file.read_int_value("gateMaxSkip", 30),
+            tiling=self.config_file.read_value("tiling", "off"),
+            tile_model=self.config_file.read_value("tileModel", None),
+            tile_max=self.config_file.read_int_value("tileMax", 6),
+            tile_workers=self.config_file.read_int_value("tileWorkers", 2),
+            model_selection=self.config_file.read_bool_value("modelSelection", False),
+            models=self.config_file.read_list_value("models", MODELS),
+            target_fps=self.config_file.read_float_value("targetFps", 5.0),
+            max_temperature=self.config_file.read_float_value("maxTemperature", 75.0),
+            encode_workers=self.config_file.read_int_value("encodeWorkers", None),
+            preview_quality=self.config_file.read_int_value("previewQuality", 70),
+            preview_max_dimension=self.config_file.read_int_value("previewMaxDimension", None),
+            archive_quality=self.config_file.read_int_value("archiveQuality", 92),
+            archive_max_dimension=self.config_file.read_int_value("archiveMaxDimension", None),
+            overlay=self.config_file.read_value("overlay", "metadata"),
+            inference_workers=self.config_file.read_int_value("inferenceWorkers", 0),
+            worker_cpus=self.config_file.read_value("workerCpus", None),
+            camera_numbers=[int(n) for n in self.config_file.read_list_value("cameraNumbers", ["0"])],
+            batch_window=self.config_file.read_float_value("batchWindow", 0.02),
+            main_format=self.config_file.read_value("mainFormat", "RGB888"),
+            source=self.config_file.read_value("source", "picamera2"),
+            source_path=self.config_file.read_value("sourcePath", None),
+            source_fps=self.config_file.read_float_value("sourceFps", 0.0),
+            source_loop=self.config_file.read_bool_value("sourceLoop", False),
+            source_count=self.config_file.read_int_value("sourceCount", None),
+            latency_history=self.config_file.read_int_value("latencyHistory", 512),
+            metrics_host=self.config_file.read_value("metricsHost", "127.0.0.1"),
+            metrics_port=self.config_file.read_int_value("metricsPort", 9464),
+            inference_threads=self.config_file.read_int_value("inferenceThreads", 1),
+            inference_cpus=self.config_file.read_value("inferenceCpus", None),
+            encode_cpus=self.config_file.read_value("encodeCpus", None),
+            io_workers=self.config_file.read_int_value("ioWorkers", 2),
+            io_cpus=self.config_file.read_value("ioCpus", None),
+            loop_lag_threshold=self.config_file.read_float_value("loopLagThreshold", 0.1),
+            resident_sessions=self.config_file.read_int_value("residentSessions", 4),
+            metadata_store=self.config_file.read_value("metadataStore", "json"),
+            metadata_database=self.config_file.read_value("metadataDatabase", None),
+            image_store=self.config_file.read_value("imageStore", "files"),
+            write_behind_interval=self.config_file.read_float_value("writeBehindInterval", 1.0),
+            write_behind_max_entries=self.config_file.read_int_value("writeBehindMaxEntries", 256),
+            write_behind_max_bytes=self.config_file.read_int_value("writeBehindMaxBytes", 4194304),
+            fsync=self.config_file.read_bool_value("fsync", False),
         )
 
         self.channels  = ChannelsService()
+        self.executors = ExecutorsService(self.configuration)
         #self.webdav = WebDavServer()
         self.bluetooth = BluetoothService(self.configuration, self.channels) #config
         #self.network   = NetworkManager(self.configuration, self.channels)
         self.websocket = WebsocketServer(self.configuration, self.channels) #config, channels
-        self.settings  = SettingsDatabase(self.configuration, self.channels, self.websocket) #channel,websocket,config
-        self.sessions  = SessionsCache(self.configuration, self.channels, self.settings, self.websocket) #config settings websocket
-        self.workflow  = CameraWorkflow(self.configuration, self.channels, self.settings, self.websocket)
+        self.settings  = SettingsDatabase(self.configuration, self.channels, self.websocket, self.executors) #channel,websocket,config
+        self.sessions  = SessionsCache(self.configuration, self.channels, self.settings, self.websocket, self.executors) #config settings websocket
+
+        # with several cameras each has its own workflow and they share one
+        # batched detector
+        self.batch_detector = None
+        if len(self.configuration.camera_numbers) > 1:
+            self.batch_detector = create_batch_detector(self.configuration, self.executors)
+        self.workflows = [
+            CameraWorkflow(self.configuration, self.channels, self.settings, self.websocket, self.executors,
+                           camera_num=camera_num, batch_detector=self.batch_detector)
+            for camera_num in self.configuration.camera_numbers
+        ]
+        self.workflow = self.workflows[0]
+
+        self.network = NetworkManager(self.configuration, self.channels, self.executors)
+        self.metrics = MetricsService(self.configuration, self.channels, self.websocket)
+        self.workflow.pipeline.add_reporter(self.sessions.writes)
 
-        self.network = NetworkManager(self.configuration, self.channels)
+        # warns of anything that blocks the event loop for longer than the threshold,
+        # a threshold of 0 turns the monitor off
+        self.loop_monitor = None
+        if self.configuration.loop_lag_threshold > 0:
+            self.loop_monitor = LoopMonitor(self.configuration.loop_lag_threshold)
+            self.workflow.pipeline.add_reporter(self.loop_monitor)
 
     async def run_trap(self):
         logging.debug("AppRoot :: Run trap...")
+        tasks = [workflow.run_workflow_task() for workflow in self.workflows]
+        if self.batch_detector is not None:
+            tasks.append(self.batch_detector.run_task())
+        if self.loop_monitor is not None:
+            tasks.append(self.loop_monitor.run_monitor_task())
         await asyncio.gather(
             self.bluetooth.run_bluetooth_task(),
             self.websocket.run_websocket_task(),
-            self.workflow.run_workflow_task(),
+            *tasks,
             self.sessions.run_cache_task(),
             self.settings.run_settings_task(),
+            self.metrics.run_metrics_task(),
+            self.network.init_task,
             #self.webdav.run_webdav_task()
         )
 
@@ -21,12 +21,13 @@ class CameraAhq(Camera) :
     def setup(self, picam2, camera_config):
         pass
 
-    async def process_frame(self, metadata, frame):
+    async def process_frame(self, metadata, frame, sequence=0, trace=None):
         self.logger.debug(metadata)
 
-        msg = ahqcam_pb2.Frame()
+        msg = ahqcam_pb2.AhqCamFrame()
         msg.frame = frame
-        await self.publish_proto("ahqcam.frame", msg)
+        msg.sequence = sequence
+        await self.publish_proto("ahqcam.frame", msg, trace)
 
 
 
@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12proto/ahqcam.proto\"\x1c\n\x0b\x41hqCamFrame\x12\r\n\x05\x66rame\x18\x01 \x01(\x0c\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x12proto/ahqcam.proto\".\n\x0b\x41hqCamFrame\x12\r\n\x05\x66rame\x18\x01 \x01(\x0c\x12\x10\n\x08sequence\x18\x02 \x01(\rb\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'proto.ahqcam_pb2', globals())
@@ -21,5 +21,5 @@ if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
   _AHQCAMFRAME._serialized_start=22
-  _AHQCAMFRAME._serialized_end=50
+  _AHQCAMFRAME._serialized_end=68
 # @@protoc_insertion_point(module_scope)
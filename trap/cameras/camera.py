@@ -26,6 +26,8 @@ class Camera(ProtocolComponent) :
     def control_camera(self) :
         pass
 
+    # sequence identifies the frame so that the app can pair it with its overlay, trace
+    # is its TraceContext, passed on with the message to measure its age when sent
     @abstractmethod
-    def process_frame(self, metadata, frame):
+    def process_frame(self, metadata, frame, sequence=0, trace=None):
         pass
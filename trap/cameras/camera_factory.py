@@ -1,14 +1,17 @@
-from trap.cameras.ahqcam.camera_ahq import CameraAhq
-from trap.cameras.picam3.camera_picam3 import CameraPicam3
-
-
 class CameraFactory():
 
+    # the cameras are only imported when used, so that libcamera is only needed
+    # for the sensors
     @staticmethod
     def instantiate_camera(name, channels, websocket):
-        if name is "picamera3" :
+        if name == "picamera3" :
+            from trap.cameras.picam3.camera_picam3 import CameraPicam3
             return CameraPicam3(channels, websocket)
-        elif name is "ahqcamera" :
+        elif name == "ahqcamera" :
+            from trap.cameras.ahqcam.camera_ahq import CameraAhq
             return CameraAhq(channels, websocket)
+        elif name == "replay" :
+            from trap.cameras.replay.camera_replay import CameraReplay
+            return CameraReplay(channels, websocket)
         else :
             return ""
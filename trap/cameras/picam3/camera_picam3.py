@@ -101,7 +101,7 @@ class CameraPicam3(Camera) :
 
             self.command_queue.clear()
 
-    async def process_frame(self, metadata, frame):
+    async def process_frame(self, metadata, frame, sequence=0, trace=None):
         self.logger.debug(metadata)
 
         af_state = metadata["AfState"]
@@ -111,6 +111,7 @@ class CameraPicam3(Camera) :
         metadata = picam3_pb2.FrameMetadata()
         metadata.afState = self.af_states.inverse[controls.AfStateEnum(af_state)]
         metadata.position = lens_position
+        metadata.sequence = sequence
         msg.metadata.CopyFrom(metadata)
         msg.frame = frame
-        await self.publish_proto("picam3.frame", msg)
+        await self.publish_proto("picam3.frame", msg, trace)
@@ -0,0 +1,34 @@
+import logging
+
+from trap.cameras.ahqcam.proto import ahqcam_pb2
+from trap.cameras.camera import Camera
+
+
+# ==========================================================================================
+# CameraReplay
+# The camera for frames that do not come from a sensor (see trap.cameras.sources), it
+# has no controls and streams the preview as a plain frame
+# ==========================================================================================
+class CameraReplay(Camera) :
+
+    def __init__(self, channels, websocket):
+        super().__init__(channels, websocket)
+        self.logger = logging.getLogger(name=__name__)
+
+    async def run_tasks(self):
+        pass
+
+    async def control_camera(self):
+        pass
+
+    async def websocket_listener_task(self):
+        pass
+
+    def setup(self, picam2, camera_config):
+        pass
+
+    async def process_frame(self, metadata, frame, sequence=0, trace=None):
+        msg = ahqcam_pb2.AhqCamFrame()
+        msg.frame = frame
+        msg.sequence = sequence
+        await self.publish_proto("ahqcam.frame", msg, trace)
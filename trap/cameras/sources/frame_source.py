@@ -0,0 +1,126 @@
+import asyncio
+import time
+from abc import ABC, abstractmethod
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from trap.metrics.trace import sensor_clock_ns
+
+# Metadata of frames that do not come from the sensor. AfState 2 is focused, as in
+# libcamera's AfStateEnum
+AF_STATE_FOCUSED = 2
+
+
+# ==========================================================================================
+# CapturedFrame
+# A frame delivered by a FrameSource, with the same interface as the parts of a
+# picamera2 CompletedRequest that the workflow uses : the metadata, a mapping of the
+# main and lores streams and release()
+# ==========================================================================================
+class CapturedFrame(ABC) :
+
+    @abstractmethod
+    def get_metadata(self) -> dict:
+        pass
+
+    # a context manager whose value has the stream as .array
+    @abstractmethod
+    def map(self, stream):
+        pass
+
+    @abstractmethod
+    def release(self):
+        pass
+
+
+# ==========================================================================================
+# FrameSource
+# Where the frames of the workflow come from. capture() returns the next frame or None
+# when the source has run out of frames
+# ==========================================================================================
+class FrameSource(ABC) :
+
+    @abstractmethod
+    async def capture(self) -> Optional[CapturedFrame]:
+        pass
+
+    def close(self):
+        pass
+
+
+class MappedStream :
+    def __init__(self, array):
+        self.array = array
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class ArrayFrame(CapturedFrame) :
+    def __init__(self, streams, metadata):
+        self.streams = streams
+        self.metadata = metadata
+
+    def get_metadata(self) -> dict:
+        return self.metadata
+
+    def map(self, stream):
+        return MappedStream(self.streams[stream])
+
+    def release(self):
+        self.streams = None
+
+
+# ==========================================================================================
+# ImageSource
+# Base of the sources that read or generate BGR images. Each image is scaled to the
+# main and lores sizes (and the main stream converted to YUV420 when that is the main
+# format) off the event loop, and given metadata like the sensor's. With fps 0 the
+# frames are delivered as fast as they can be made, otherwise at the given rate
+# ==========================================================================================
+class ImageSource(FrameSource) :
+    def __init__(self, main_size, lores_size, yuv=False, fps=0.0):
+        self.loop = asyncio.get_running_loop()
+        self.main_size = main_size
+        self.lores_size = lores_size
+        self.yuv = yuv
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.next_due = time.monotonic()
+        self.frames = 0
+
+    # the next BGR image, or None at the end of the source
+    @abstractmethod
+    def next_image(self) -> Optional[np.ndarray]:
+        pass
+
+    def make_frame(self):
+        image = self.next_image()
+        if image is None:
+            return None
+        main = cv2.resize(image, self.main_size, interpolation=cv2.INTER_AREA)
+        lores = cv2.resize(image, self.lores_size, interpolation=cv2.INTER_AREA)
+        if self.yuv:
+            main = cv2.cvtColor(main, cv2.COLOR_BGR2YUV_I420)
+
+        self.frames += 1
+        metadata = {
+            "SensorTimestamp": sensor_clock_ns(),
+            "FrameDuration": int(1000000 * self.interval),
+            "AfState": AF_STATE_FOCUSED,
+            "LensPosition": 0.0,
+            "FrameNumber": self.frames
+        }
+        return ArrayFrame({"main": main, "lores": lores}, metadata)
+
+    async def capture(self) -> Optional[CapturedFrame]:
+        if self.interval > 0:
+            delay = self.next_due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_due = max(self.next_due, time.monotonic()) + self.interval
+        return await self.loop.run_in_executor(None, self.make_frame)
@@ -0,0 +1,32 @@
+from trap.cameras.sources.frame_source import FrameSource
+
+# The frame sources, a camera sensor or recorded or generated frames
+SOURCE_PICAMERA2 = "picamera2"
+SOURCE_IMAGES = "images"
+SOURCE_VIDEO = "video"
+SOURCE_SYNTHETIC = "synthetic"
+
+
+class FrameSourceFactory():
+
+    # the sources are only imported when used, so that picamera2 and libcamera are
+    # only needed on a Pi
+    @staticmethod
+    def instantiate_source(configuration, camera, camera_num, main_size, lores_size, yuv, buffer_count) -> FrameSource:
+        name = configuration.source
+        if name == SOURCE_PICAMERA2:
+            from trap.cameras.sources.picamera2_source import Picamera2Source
+            return Picamera2Source(camera, camera_num, main_size, lores_size, configuration.main_format, buffer_count)
+        elif name == SOURCE_IMAGES:
+            from trap.cameras.sources.image_directory_source import ImageDirectorySource
+            return ImageDirectorySource(configuration.source_path, main_size, lores_size, yuv,
+                                        configuration.source_fps, configuration.source_loop)
+        elif name == SOURCE_VIDEO:
+            from trap.cameras.sources.video_source import VideoSource
+            return VideoSource(configuration.source_path, main_size, lores_size, yuv,
+                               configuration.source_fps, configuration.source_loop)
+        elif name == SOURCE_SYNTHETIC:
+            from trap.cameras.sources.synthetic_source import SyntheticSource
+            return SyntheticSource(main_size, lores_size, yuv, configuration.source_fps, configuration.source_count)
+        else :
+            raise ValueError(f"Unknown frame source {name}")
@@ -0,0 +1,43 @@
+import glob
+import logging
+import os
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from trap.cameras.sources.frame_source import ImageSource
+
+IMAGE_PATTERNS = ("*.jpg", "*.jpeg", "*.png")
+
+
+# ==========================================================================================
+# ImageDirectorySource
+# The images of a directory, in name order, optionally repeated
+# ==========================================================================================
+class ImageDirectorySource(ImageSource) :
+    def __init__(self, path, main_size, lores_size, yuv=False, fps=0.0, loop=False):
+        super().__init__(main_size, lores_size, yuv, fps)
+        self.logger = logging.getLogger(name=__name__)
+        self.files = sorted(f for pattern in IMAGE_PATTERNS for f in glob.glob(os.path.join(path, pattern)))
+        self.repeat = loop
+        self.index = 0
+        if not self.files:
+            self.logger.warning(f"No images found in {path}")
+
+    # None at the end of the images, or when a whole pass over them read none
+    def next_image(self) -> Optional[np.ndarray]:
+        for _ in range(len(self.files)):
+            if self.index >= len(self.files):
+                break
+            file = self.files[self.index]
+            self.index += 1
+            if self.repeat and self.index == len(self.files):
+                self.index = 0
+            image = cv2.imread(file)
+            if image is not None:
+                return image
+            self.logger.warning(f"Failed to read {file}")
+        if self.repeat and self.files:
+            self.logger.error("None of the images could be read")
+        return None
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Optional
+
+from trap.cameras.sources.frame_source import FrameSource, CapturedFrame
+
+
+class PicameraFrame(CapturedFrame) :
+    def __init__(self, request):
+        self.request = request
+
+    def get_metadata(self) -> dict:
+        return self.request.get_metadata()
+
+    def map(self, stream):
+        from picamera2 import MappedArray
+        return MappedArray(self.request, stream)
+
+    def release(self):
+        self.request.release()
+
+
+# ==========================================================================================
+# Picamera2Source
+# Frames from a camera sensor. The camera is configured with a main and a lores stream
+# and handed to the Camera (which applies its controls) to be started
+# ==========================================================================================
+class Picamera2Source(FrameSource) :
+    def __init__(self, camera, camera_num, main_size, lores_size, main_format, buffer_count):
+        from picamera2 import Picamera2
+
+        self.logger = logging.getLogger(name=__name__)
+        self.loop = asyncio.get_running_loop()
+        self.camera = camera
+        self.picam2 = Picamera2(camera_num)
+        camera_config = self.picam2.create_preview_configuration(
+            main={'format': main_format, 'size': main_size},
+            lores={'format': 'RGB888', 'size': lores_size},
+            buffer_count=buffer_count
+        )
+        self.camera.setup(self.picam2, camera_config)
+
+    async def capture(self) -> Optional[CapturedFrame]:
+        logging.debug("Get image")
+        future = self.loop.create_future()
+
+        def job_done_callback(job):
+            try:
+                result = job.get_result()
+            except Exception as e:
+                self.loop.call_soon_threadsafe(future.set_exception, e)
+            else:
+                self.loop.call_soon_threadsafe(future.set_result, result)
+
+        self.camera.picam2.capture_request(signal_function=job_done_callback)
+        return PicameraFrame(await future)
+
+    def close(self):
+        self.picam2.stop()
+        self.picam2.close()
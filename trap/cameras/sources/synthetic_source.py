@@ -0,0 +1,41 @@
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from trap.cameras.sources.frame_source import ImageSource
+
+
+# ==========================================================================================
+# SyntheticSource
+# A static textured background with dark elliptical "insects" that wander across it,
+# generated from a fixed seed so that runs are repeatable. count limits the number of
+# frames, None generates them forever
+# ==========================================================================================
+class SyntheticSource(ImageSource) :
+    def __init__(self, main_size, lores_size, yuv=False, fps=0.0, count=None, insects=5, seed=0):
+        super().__init__(main_size, lores_size, yuv, fps)
+        self.count = count
+        self.rng = np.random.default_rng(seed)
+
+        width, height = main_size
+        noise = self.rng.integers(150, 230, (height // 8, width // 8, 3), np.uint8)
+        self.background = cv2.resize(noise, main_size, interpolation=cv2.INTER_CUBIC)
+        self.positions = self.rng.uniform((0, 0), (width, height), (insects, 2))
+        self.velocities = self.rng.normal(0, 8, (insects, 2))
+        self.sizes = self.rng.uniform(15, 60, insects)
+
+    def next_image(self) -> Optional[np.ndarray]:
+        if self.count is not None and self.frames >= self.count:
+            return None
+
+        width, height = self.main_size
+        self.velocities += self.rng.normal(0, 1, self.velocities.shape)
+        self.positions += self.velocities
+        self.positions %= (width, height)
+
+        image = self.background.copy()
+        for (x, y), size, (vx, vy) in zip(self.positions, self.sizes, self.velocities):
+            angle = float(np.degrees(np.arctan2(vy, vx)))
+            cv2.ellipse(image, (int(x), int(y)), (int(size), int(size / 3)), angle, 0, 360, (30, 35, 40), -1)
+        return image
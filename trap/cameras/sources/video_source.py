@@ -0,0 +1,31 @@
+import logging
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from trap.cameras.sources.frame_source import ImageSource
+
+
+# ==========================================================================================
+# VideoSource
+# The frames of a video file decoded by OpenCV, optionally repeated
+# ==========================================================================================
+class VideoSource(ImageSource) :
+    def __init__(self, path, main_size, lores_size, yuv=False, fps=0.0, loop=False):
+        super().__init__(main_size, lores_size, yuv, fps)
+        self.logger = logging.getLogger(name=__name__)
+        self.capture_device = cv2.VideoCapture(path)
+        self.repeat = loop
+        if not self.capture_device.isOpened():
+            self.logger.warning(f"Failed to open video {path}")
+
+    def next_image(self) -> Optional[np.ndarray]:
+        ok, image = self.capture_device.read()
+        if not ok and self.repeat and self.frames > 0:
+            self.capture_device.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, image = self.capture_device.read()
+        return image if ok else None
+
+    def close(self):
+        self.capture_device.release()
@@ -1,14 +1,22 @@
 import logging
+import time
 
 from aioreactive import AsyncSubject, AsyncAnonymousObserver
 
+from trap.metrics.metrics_registry import REGISTRY
+
 class Channel :
-    def __init__(self):
+    def __init__(self, name="message"):
         self.logger = logging.getLogger(__name__)
         self.async_subject = AsyncSubject()
+        self.publish_time = REGISTRY.histogram(
+            "trap_channel_publish_seconds", "Time to publish to a channel, including its subscribers",
+            {"channel": name})
 
     async def publish(self, object):
+        start = time.perf_counter()
         await self.async_subject.asend(object)
+        self.publish_time.observe_since(start)
 
     async def subscribe(self, on_message):
         logging.debug(f"subscribe() to channel")
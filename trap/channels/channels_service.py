@@ -14,7 +14,7 @@ class ChannelsService :
         if channel_name in self.channels:
             return self.channels[channel_name]
         else:
-            channel = Channel()
+            channel = Channel(channel_name)
             self.channels[channel_name] = channel
             return channel
 
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from trap.metrics.metrics_registry import REGISTRY
+
+# The classes of blocking work, each with its own threads so that a slow SD card never
+# holds up inference and inference never holds up the writes
+EXECUTOR_INFERENCE = "inference"
+EXECUTOR_ENCODE = "encode"
+EXECUTOR_IO = "io"
+
+
+# a list of CPUs "2,3" as a set, None for no affinity
+def parse_cpus(value):
+    if not value:
+        return None
+    return {int(c) for c in value.split(",") if c.strip()} or None
+
+
+# ==========================================================================================
+# NamedExecutor
+# A thread pool for one class of work. The threads are optionally pinned to a set of
+# CPUs. The number of tasks waiting for a thread and running are exported as gauges and
+# the time the tasks wait and run as histograms, all labelled with the executor name
+# ==========================================================================================
+class NamedExecutor(ThreadPoolExecutor) :
+    def __init__(self, name, workers, cpus=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.name = name
+        self.workers = max(1, workers)
+        self.cpus = cpus
+        super().__init__(max_workers=self.workers, thread_name_prefix=name,
+                         initializer=self._pin if cpus else None)
+
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+
+        labels = {"executor": name}
+        REGISTRY.gauge("trap_executor_queue_depth", "Tasks waiting for a thread of an executor", labels,
+                       function=lambda: self.queued)
+        REGISTRY.gauge("trap_executor_active_threads", "Threads of an executor running a task", labels,
+                       function=lambda: self.active)
+        REGISTRY.gauge("trap_executor_workers", "Threads of an executor", labels).set(self.workers)
+        self.wait_time = REGISTRY.histogram(
+            "trap_executor_wait_seconds", "Time a task waits for a thread of an executor", labels)
+        self.run_time = REGISTRY.histogram(
+            "trap_executor_run_seconds", "Time a task runs on an executor", labels)
+
+    def _pin(self):
+        try:
+            os.sched_setaffinity(0, self.cpus)
+        except (AttributeError, OSError) as e:
+            self.logger.warning(f"Failed to pin {self.name} thread to CPUs {self.cpus}: {e}")
+
+    def submit(self, fn, /, *args, **kwargs):
+        submitted = time.perf_counter()
+
+        def run():
+            started = time.perf_counter()
+            with self.lock:
+                self.queued -= 1
+                self.active += 1
+            self.wait_time.observe(started - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.run_time.observe_since(started)
+                with self.lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        with self.lock:
+            self.queued += 1
+        try:
+            future = super().submit(run)
+        except Exception:
+            self._unqueue()
+            raise
+        future.add_done_callback(lambda f: f.cancelled() and self._unqueue())
+        return future
+
+    def _unqueue(self):
+        with self.lock:
+            self.queued -= 1
+
+    async def run(self, fn, *args):
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def __str__(self):
+        return f"{self.name}: {self.active}/{self.workers} busy, {self.queued} queued, {self.completed} done"
+
+
+# ==========================================================================================
+# ExecutorsService
+# The executors of the trap by name, sized and pinned from the configuration :
+#  - inference : the detector when it runs in a thread
+#  - encode    : JPEG encoding of the preview and the crops
+#  - io        : session and settings files, and nmcli
+# ==========================================================================================
+class ExecutorsService :
+    def __init__(self, config):
+        self.logger = logging.getLogger(name=__name__)
+        self.executors = {
+            EXECUTOR_INFERENCE: NamedExecutor(
+                EXECUTOR_INFERENCE, config.inference_threads, parse_cpus(config.inference_cpus)),
+            EXECUTOR_ENCODE: NamedExecutor(
+                EXECUTOR_ENCODE, config.encode_workers or os.cpu_count() or 4, parse_cpus(config.encode_cpus)),
+            EXECUTOR_IO: NamedExecutor(
+                EXECUTOR_IO, config.io_workers, parse_cpus(config.io_cpus))
+        }
+
+    def get_executor(self, name) -> NamedExecutor:
+        return self.executors[name]
+
+    async def run(self, name, fn, *args):
+        return await self.executors[name].run(fn, *args)
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __str__(self):
+        return "executors: " + " | ".join(str(e) for e in self.executors.values())
@@ -0,0 +1 @@
+__all__ = ["loop_monitor", "metrics_registry", "metrics_service", "trace"]
@@ -0,0 +1,168 @@
+import asyncio
+import heapq
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from typing import Optional
+
+from trap.metrics.metrics_registry import REGISTRY
+
+# innermost frames kept of the stack of a stall
+STACK_DEPTH = 20
+ASYNCIO_DIRECTORY = os.path.dirname(asyncio.__file__)
+
+
+# the stack of a frame from the callback that the loop is running, without the frames of
+# the loop itself
+def format_stack(frame):
+    stack = traceback.extract_stack(frame)
+    start = 0
+    for index, entry in enumerate(stack):
+        if entry.filename.startswith(ASYNCIO_DIRECTORY):
+            start = index + 1
+    return "".join(traceback.format_list(stack[start:][-STACK_DEPTH:]))
+
+
+# ==========================================================================================
+# Stall
+# A time the event loop was blocked for longer than the threshold, with the task that
+# was running and the stack of the loop thread while it was blocked, if the watchdog
+# caught it
+# ==========================================================================================
+@dataclass(order=True)
+class Stall :
+    duration : float
+    time : float = field(compare=False)
+    task : Optional[str] = field(default=None, compare=False)
+    stack : Optional[str] = field(default=None, compare=False)
+
+
+# ==========================================================================================
+# LoopMonitor
+# Measures how late the event loop runs a callback scheduled every interval seconds,
+# which is the time any callback or coroutine step (a file write, a subprocess, a model
+# call made on the loop) kept it from running the others, the camera included. A
+# watchdog thread checks that the callback keeps coming and, when the loop has been
+# blocked for longer than the threshold, takes the stack of the loop thread so that the
+# blocking call can be found. Stalls above the threshold are counted, logged as warnings
+# with their stack and the slowest are kept
+# ==========================================================================================
+class LoopMonitor :
+    def __init__(self, threshold=0.1, interval=0.05, keep=10):
+        self.logger = logging.getLogger(name=__name__)
+        self.threshold = threshold
+        self.interval = interval
+        self.keep = keep
+
+        self.loop = None
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.beat = time.monotonic()
+        self.captured = None
+
+        self.stalls = []
+        self.stall_count = 0
+        self.max_lag = 0.0
+
+        self.lag = REGISTRY.histogram(
+            "trap_loop_lag_seconds", "Delay of the event loop in running a scheduled callback")
+        self.stall_counter = REGISTRY.counter(
+            "trap_loop_stalls_total", "Times the event loop was blocked for longer than the threshold")
+        REGISTRY.gauge("trap_loop_max_lag_seconds", "Longest delay of the event loop",
+                       function=lambda: self.max_lag)
+
+    async def run_monitor_task(self):
+        self.logger.debug("Starting loop monitor task....")
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        self.stopped.clear()
+        watchdog = threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                beat = time.monotonic()
+                self.beat = beat
+                await asyncio.sleep(self.interval)
+                self._record(max(0.0, time.monotonic() - beat - self.interval), beat)
+        finally:
+            self.stopped.set()
+
+    def _record(self, lag, beat):
+        self.lag.observe(lag)
+        self.max_lag = max(self.max_lag, lag)
+        if lag < self.threshold:
+            return
+
+        with self.lock:
+            captured, self.captured = self.captured, None
+        task, stack = captured[1:] if captured is not None and captured[0] == beat else (None, None)
+
+        stall = Stall(lag, time.time(), task, stack)
+        self.stall_count += 1
+        self.stall_counter.inc()
+        if len(self.stalls) < self.keep:
+            heapq.heappush(self.stalls, stall)
+        else:
+            heapq.heappushpop(self.stalls, stall)
+
+        message = f"Event loop blocked for {1000 * lag:.0f} ms"
+        if task is not None:
+            message += f" in task {task}"
+        if stack is not None:
+            message += f"\n{stack}"
+        self.logger.warning(message)
+
+    # ------------------------------------------------------------------------------
+    # Runs on its own thread. The stack of the loop thread is taken once per stall,
+    # as soon as the loop has been blocked for longer than the threshold
+    # ------------------------------------------------------------------------------
+    def _watchdog(self):
+        period = min(self.interval, self.threshold) / 2
+        last = None
+        while not self.stopped.wait(period):
+            beat = self.beat
+            if beat == last or time.monotonic() - beat - self.interval < self.threshold:
+                continue
+            last = beat
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = format_stack(frame)
+            with self.lock:
+                self.captured = (beat, self._task_name(), stack)
+
+    def _task_name(self):
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            return None
+        if task is None:
+            return None
+        name = task.get_name()
+        coroutine = getattr(task.get_coro(), "__qualname__", None)
+        return name if coroutine in (None, name) else f"{name} ({coroutine})"
+
+    # the slowest stalls, slowest first
+    def slowest(self):
+        return sorted(self.stalls, reverse=True)
+
+    def stats(self):
+        return {
+            "stalls": self.stall_count,
+            "max_lag_ms": 1000 * self.max_lag,
+            "slowest": [
+                {"duration_ms": 1000 * s.duration, "time": s.time, "task": s.task, "stack": s.stack}
+                for s in self.slowest()
+            ]
+        }
+
+    def __str__(self):
+        slowest = self.slowest()
+        worst = f", slowest {1000 * slowest[0].duration:.0f} ms in {slowest[0].task}" if slowest else ""
+        return f"loop: max lag {1000 * self.max_lag:.1f} ms, {self.stall_count} stalls over " \
+               f"{1000 * self.threshold:.0f} ms{worst}"
@@ -0,0 +1,172 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+# Bucket upper bounds (seconds) for the latencies of the hot paths, from the sub
+# millisecond work on the event loop up to inference on the larger models
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+TYPE_COUNTER = "counter"
+TYPE_GAUGE = "gauge"
+TYPE_HISTOGRAM = "histogram"
+
+
+# ==========================================================================================
+# Metric
+# The base of the metrics, a name, a help text and a fixed set of labels
+# ==========================================================================================
+class Metric :
+    type = None
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.lock = threading.Lock()
+
+
+class Counter(Metric) :
+    type = TYPE_COUNTER
+
+    def __init__(self, name, help, labels):
+        super().__init__(name, help, labels)
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+# ==========================================================================================
+# Gauge
+# A value that is set, or read from function when the metrics are collected
+# ==========================================================================================
+class Gauge(Metric) :
+    type = TYPE_GAUGE
+
+    def __init__(self, name, help, labels, function=None):
+        super().__init__(name, help, labels)
+        self.function = function
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def get(self):
+        if self.function is not None:
+            return float(self.function())
+        return self.value
+
+
+# ==========================================================================================
+# Histogram
+# Counts of observations per fixed bucket, plus their sum and count. The counts are
+# held in a preallocated array and an observation only increments a slot, so nothing
+# is allocated per sample. The buckets are not cumulative until they are exported
+# ==========================================================================================
+class Histogram(Metric) :
+    type = TYPE_HISTOGRAM
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.bounds = tuple(buckets)
+        # one extra slot for the observations above the last bound (+Inf)
+        self.counts = array("q", [0] * (len(self.bounds) + 1))
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    # observe the time since start, a time.perf_counter() value
+    def observe_since(self, start):
+        self.observe(time.perf_counter() - start)
+
+    def cumulative(self):
+        with self.lock:
+            counts = self.counts.tolist()
+        total = 0
+        for i, count in enumerate(counts):
+            total += count
+            counts[i] = total
+        return counts
+
+
+# ==========================================================================================
+# MetricsRegistry
+# The metrics of the trap, created on first use and identified by their name and
+# labels. The hot paths create their metrics once and keep them
+# ==========================================================================================
+class MetricsRegistry :
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, help, labels, **kwargs):
+        labels = tuple(sorted((labels or {}).items()))
+        key = (name, labels)
+        with self.lock:
+            metric = self.metrics.get(key)
+            if metric is None:
+                metric = cls(name, help, labels, **kwargs)
+                self.metrics[key] = metric
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type}")
+            return metric
+
+    def counter(self, name, help, labels=None) -> Counter:
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help, labels=None, function=None) -> Gauge:
+        gauge = self._get(Gauge, name, help, labels)
+        if function is not None:
+            gauge.function = function
+        return gauge
+
+    def histogram(self, name, help, labels=None, buckets=LATENCY_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, labels, buckets=buckets)
+
+    def collect(self, prefix=""):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return sorted((m for m in metrics if m.name.startswith(prefix)), key=lambda m: (m.name, m.labels))
+
+    # ------------------------------------------------------------------------------
+    # The Prometheus text exposition format (version 0.0.4)
+    # ------------------------------------------------------------------------------
+    def to_prometheus(self):
+        lines = []
+        name = None
+        for metric in self.collect():
+            if metric.name != name:
+                name = metric.name
+                lines.append(f"# HELP {name} {metric.help}")
+                lines.append(f"# TYPE {name} {metric.type}")
+            if metric.type == TYPE_HISTOGRAM:
+                counts = metric.cumulative()
+                for bound, count in zip(metric.bounds + (float("inf"),), counts):
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{format_labels(metric.labels + (('le', le),))} {count}")
+                lines.append(f"{name}_sum{format_labels(metric.labels)} {metric.sum}")
+                lines.append(f"{name}_count{format_labels(metric.labels)} {counts[-1]}")
+            elif metric.type == TYPE_GAUGE:
+                lines.append(f"{name}{format_labels(metric.labels)} {metric.get()}")
+            else:
+                lines.append(f"{name}{format_labels(metric.labels)} {metric.value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f"{k}=\"{v}\"" for (k, _), v in zip(labels, escaped)) + "}"
+
+
+# The registry shared by all the components
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+from trap.metrics.metrics_registry import REGISTRY, TYPE_HISTOGRAM, TYPE_GAUGE
+from trap.metrics.proto import metrics_pb2
+from trap.websocket.protocol_component import ProtocolComponent
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics_to_proto(registry, prefix=""):
+    msg = metrics_pb2.Metrics()
+    msg.timestamp = int(time.time() * 1000)
+    for metric in registry.collect(prefix):
+        m = msg.metrics.add()
+        m.name = metric.name
+        m.type = metric.type
+        for name, value in metric.labels:
+            label = m.labels.add()
+            label.name = name
+            label.value = str(value)
+        if metric.type == TYPE_HISTOGRAM:
+            counts = metric.cumulative()
+            m.histogram.bounds.extend(metric.bounds)
+            m.histogram.counts.extend(counts)
+            m.histogram.sum = metric.sum
+            m.histogram.count = counts[-1]
+        elif metric.type == TYPE_GAUGE:
+            m.value = metric.get()
+        else:
+            m.value = metric.value
+    return msg
+
+
+# ==========================================================================================
+# MetricsService
+# Serves the metrics registry to the app, as the reply to a metrics.get message, and to
+# Prometheus (or curl) as text on http://<host>:<port>/metrics. A port of 0 disables the
+# HTTP endpoint
+# ==========================================================================================
+class MetricsService(ProtocolComponent) :
+    def __init__(self, config, channels, websocket, registry=REGISTRY):
+        super().__init__(channels)
+        self.logger = logging.getLogger(name=__name__)
+        self.websocket = websocket
+        self.registry = registry
+        self.host = config.metrics_host
+        self.port = config.metrics_port
+
+    async def run_metrics_task(self):
+        self.logger.debug("Starting metrics task....")
+        tasks = [self.websocket_listener_task()]
+        if self.port:
+            tasks.append(self.http_task())
+        await asyncio.gather(*tasks)
+
+    async def websocket_listener_task(self):
+        in_channel = self.websocket.subscribe_many_messages("metrics.get")
+        await in_channel.subscribe(self.handle_message)
+
+    async def handle_message(self, message):
+        if message.identifier == "metrics.get":
+            query = metrics_pb2.MetricsQuery()
+            query.ParseFromString(message.protobuf)
+            await self.publish_proto("metrics", metrics_to_proto(self.registry, query.prefix))
+
+    async def http_task(self):
+        server = await asyncio.start_server(self.handle_http, self.host, self.port)
+        self.logger.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    async def handle_http(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # skip the headers
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] in ("/", "/metrics"):
+                status, body = "200 OK", self.registry.to_prometheus().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {PROMETHEUS_CONTENT_TYPE}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+            )
+            await writer.drain()
+        except Exception as e:
+            self.logger.debug(f"Metrics request failed {e}")
+        finally:
+            writer.close()
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: proto/metrics.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x13proto/metrics.proto\"\x1e\n\x0cMetricsQuery\x12\x0e\n\x06prefix\x18\x01 \x01(\t\"$\n\x05Label\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\t\"G\n\tHistogram\x12\x0e\n\x06\x62ounds\x18\x01 \x03(\x01\x12\x0e\n\x06\x63ounts\x18\x02 \x03(\x04\x12\x0b\n\x03sum\x18\x03 \x01(\x01\x12\r\n\x05\x63ount\x18\x04 \x01(\x04\"j\n\x06Metric\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04type\x18\x02 \x01(\t\x12\x16\n\x06labels\x18\x03 \x03(\x0b\x32\x06.Label\x12\r\n\x05value\x18\x04 \x01(\x01\x12\x1d\n\thistogram\x18\x05 \x01(\x0b\x32\n.Histogram\"6\n\x07Metrics\x12\x11\n\ttimestamp\x18\x01 \x01(\x04\x12\x18\n\x07metrics\x18\x02 \x03(\x0b\x32\x07.Metricb\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'proto.metrics_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _METRICSQUERY._serialized_start=23
+  _METRICSQUERY._serialized_end=53
+  _LABEL._serialized_start=55
+  _LABEL._serialized_end=91
+  _HISTOGRAM._serialized_start=93
+  _HISTOGRAM._serialized_end=164
+  _METRIC._serialized_start=166
+  _METRIC._serialized_end=272
+  _METRICS._serialized_start=274
+  _METRICS._serialized_end=328
+# @@protoc_insertion_point(module_scope)
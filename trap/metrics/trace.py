@@ -0,0 +1,115 @@
+import logging
+import time
+from dataclasses import dataclass
+
+from trap.metrics.metrics_registry import REGISTRY
+
+# The clock of the sensor timestamps. libcamera stamps the frames with CLOCK_BOOTTIME,
+# which is CLOCK_MONOTONIC plus any time spent suspended
+SENSOR_CLOCK = getattr(time, "CLOCK_BOOTTIME", time.CLOCK_MONOTONIC)
+
+# Bucket upper bounds (seconds) for the age of a frame, from the sensor to the disk or
+# the app, which includes the queueing in the pipeline
+AGE_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+GLASS_TO_DISK = REGISTRY.histogram(
+    "trap_glass_to_disk_seconds", "Age of a frame when its detection is written to the session",
+    buckets=AGE_BUCKETS)
+
+
+def sensor_clock_ns():
+    return time.clock_gettime_ns(SENSOR_CLOCK)
+
+
+def glass_to_client(identifier):
+    return REGISTRY.histogram(
+        "trap_glass_to_client_seconds", "Age of a frame when a message made from it is sent to the app",
+        {"identifier": identifier}, buckets=AGE_BUCKETS)
+
+
+# ==========================================================================================
+# TraceContext
+# Identifies the frame that a detection or a message was made from : the sensor
+# timestamp (in nanoseconds on the sensor clock) and the sequence number given to
+# the frame by the workflow. It travels with the frame through the pipeline, the
+# detection_channel and the publish_message channel so that the age of the frame can
+# be measured wherever it ends up
+# ==========================================================================================
+@dataclass(frozen=True)
+class TraceContext :
+    timestamp : int
+    sequence : int
+
+    @staticmethod
+    def from_metadata(metadata, sequence):
+        timestamp = metadata.get("SensorTimestamp")
+        return TraceContext(timestamp if timestamp else sensor_clock_ns(), sequence)
+
+    # seconds since the frame was exposed
+    def age(self):
+        return (sensor_clock_ns() - self.timestamp) / 1e9
+
+    # the wall clock time of the exposure in milliseconds, for the app
+    def captured_ms(self):
+        return int(time.time() * 1000 - 1000 * self.age())
+
+    def observe(self, histogram):
+        histogram.observe(self.age())
+
+
+# ==========================================================================================
+# SequenceGaps
+# Counts the frames missing from a sequence of frame numbers, either numbers given by
+# the source or the workflow sequence numbers of the frames that reached a stage.
+# Without frame numbers the gaps are estimated from the sensor timestamps and the
+# frame duration
+# ==========================================================================================
+class SequenceGaps :
+    def __init__(self, name, labels=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.name = name
+        labels = dict(labels or {}, stage=name)
+        self.gap_counter = REGISTRY.counter(
+            "trap_frame_gaps_total", "Gaps in the sequence of frames reaching a stage", labels)
+        self.lost_counter = REGISTRY.counter(
+            "trap_frames_lost_total", "Frames missing from the sequence of frames reaching a stage", labels)
+        self.last = None
+        self.last_timestamp = None
+        self.gaps = 0
+        self.lost = 0
+
+    # returns the number of frames missing before this one
+    def observe(self, sequence):
+        lost = 0 if self.last is None else sequence - self.last - 1
+        self.last = sequence
+        if lost > 0:
+            self._gap(sequence, lost)
+        return max(lost, 0)
+
+    def observe_metadata(self, metadata):
+        if "FrameNumber" in metadata:
+            return self.observe(metadata["FrameNumber"])
+
+        timestamp = metadata.get("SensorTimestamp")
+        duration = metadata.get("FrameDuration")
+        lost = 0
+        if timestamp and duration and self.last_timestamp is not None:
+            lost = round((timestamp - self.last_timestamp) / (1000 * duration)) - 1
+            if lost > 0:
+                self._gap(timestamp, lost)
+        self.last_timestamp = timestamp
+        return max(lost, 0)
+
+    def reset(self):
+        self.last = None
+        self.last_timestamp = None
+
+    def _gap(self, at, lost):
+        self.gaps += 1
+        self.lost += lost
+        self.gap_counter.inc()
+        self.lost_counter.inc(lost)
+        self.logger.debug(f"{self.name}: {lost} frames missing before {at}")
+
+    def __str__(self):
+        return f"{self.name} gaps: {self.gaps} gaps, {self.lost} frames missing"
@@ -1,15 +1,29 @@
+import asyncio
 import logging
 
+from trap.executors.executors_service import EXECUTOR_IO
 from trap.network.network_api import NetworkApi
 
 
+# NetworkApi runs nmcli, which blocks for as long as NetworkManager takes to answer, so
+# it is only called on the io executor. The wifi configurations are read by init()
 class NetworkManager() :
-    def __init__(self, config, channels):
+    def __init__(self, config, channels, executors):
         self.config = config
         self.channels = channels
-        self.wifi_cfg = NetworkApi.list_wifi_configurations()
+        self.io = executors.get_executor(EXECUTOR_IO)
         self.logger = logging.getLogger(__name__)
 
+        self.wifi_cfg = {}
+        self.wifi_network = None
+        self.hotspot = None
+
+        # read the wifi configurations asynchronously
+        self.init_task = asyncio.create_task(self.init())
+
+    async def init(self):
+        self.wifi_cfg = await self.io.run(NetworkApi.list_wifi_configurations)
+
         self.wifi_network =  self.wifi_cfg.get("preconfigured")
         self.hotspot = self.wifi_cfg.get("preconfigured")
         #if self.hotspot is None :
@@ -70,18 +84,3 @@ class NetworkManager() :
         #                logging.error("No wifi connected. Cannot initialise the network settings")
         #        else :
         #            logging.error("Wifi is off. Cannot initialise the network settings")
-
-    def start_hotspot(self):
-        NetworkApi.configuration_up(self.settings.hotspot_uuid)
-
-    def stop_hotspot(self):
-        NetworkApi.configuratiom_down(self.settings.hotspot_uuid)
-
-    def start_network(self):
-        NetworkApi.configuration_up(self.settings.network_uuid)
-
-    def stop_network(self):
-        NetworkApi.configuratiom_down(self.settings.network_uuid)
-
-
-
@@ -1,15 +1,19 @@
 from dataclasses import dataclass
+from typing import Optional, Union
 
-from mpmath.libmp import to_int
-
+from trap.metrics.trace import TraceContext
 from trap.sessions.proto import sessions_pb2
 from trap.sessions.detection_metadata import DetectionMetadata
 
 
+# the image is None for metadata-only updates of an existing detection, and may be a
+# memoryview of the image store when read back from the session, the trace
+# identifies the frame it was detected in (None when read back from the session)
 @dataclass
 class DetectionMetaDataWithImage :
     metadata : DetectionMetadata
-    image : bytes
+    image : Optional[Union[bytes, memoryview]]
+    trace : Optional[TraceContext] = None
 
     def to_proto(self) :
         msg = sessions_pb2.Detection()
@@ -21,5 +25,6 @@ class DetectionMetaDataWithImage :
         msg.clazz = self.metadata.clazz
         msg.width =  self.metadata.width
         msg.height = self.metadata.height
-        msg.image = self.image
+        if self.image is not None:
+            msg.image = bytes(self.image)
         return msg
\ No newline at end of file
@@ -0,0 +1,48 @@
+import logging
+import os
+
+from trap.sessions.image_store import ImageStore
+from trap.sessions.metadata_store import write_file
+
+
+# ==========================================================================================
+# FileImageStore
+# Every image in its own file, images/<detection>.jpg in the session directory,
+# replaced by renaming when the score of the detection improves, and optionally synced
+# ==========================================================================================
+class FileImageStore(ImageStore) :
+    def __init__(self, sessions_path, fsync=False):
+        self.logger = logging.getLogger(name=__name__)
+        self.sessions_directory = sessions_path
+        self.fsync = fsync
+
+    def _image_path(self, session, detection):
+        return f"{self.sessions_directory}/{session}/images/{detection}.jpg"
+
+    def create_session(self, session):
+        os.mkdir(f"{self.sessions_directory}/{session}/images")
+
+    def write_image(self, session, detection, image):
+        write_file(self._image_path(session, detection), image, self.fsync)
+
+    def read_image(self, session, detection):
+        try:
+            with open(self._image_path(session, detection), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def delete_session(self, session):
+        dir_path = f"{self.sessions_directory}/{session}/images"
+        if not os.path.exists(dir_path):
+            self.logger.debug(f"Directory not found: {dir_path}")
+            return
+
+        for filename in os.listdir(dir_path):
+            file_path = os.path.join(dir_path, filename)
+            try:
+                self.logger.debug(f"Deleting file {file_path}")
+                os.remove(file_path)
+            except Exception as e:
+                self.logger.debug(f"Error deleting {file_path}: {e}")
+        os.rmdir(dir_path)
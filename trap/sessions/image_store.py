@@ -0,0 +1,39 @@
+from abc import ABC, abstractmethod
+
+
+# ==========================================================================================
+# ImageStore
+# Where the JPEG crops of the detections are kept, in the session directories. The
+# methods block and are run on the io executor, possibly from several of its threads
+# ==========================================================================================
+class ImageStore(ABC) :
+
+    @abstractmethod
+    def create_session(self, session):
+        pass
+
+    # the image of a detection, replacing the previous one
+    @abstractmethod
+    def write_image(self, session, detection, image):
+        pass
+
+    # the images of several detections, (session, detection, image)
+    def write_images(self, images):
+        for session, detection, image in images:
+            self.write_image(session, detection, image)
+
+    # bytes or a read-only memoryview of the image, None if there is none
+    @abstractmethod
+    def read_image(self, session, detection):
+        pass
+
+    # no more images will be written to the session
+    def end_session(self, session):
+        pass
+
+    @abstractmethod
+    def delete_session(self, session):
+        pass
+
+    def close(self):
+        pass
@@ -0,0 +1,23 @@
+from trap.sessions.image_store import ImageStore
+
+# Where the images of the detections are kept, a JPEG file per detection or a pack file
+# per session
+IMAGE_STORE_FILES = "files"
+IMAGE_STORE_PACK = "pack"
+
+
+class ImageStoreFactory():
+
+    @staticmethod
+    def instantiate_store(configuration) -> ImageStore:
+        name = configuration.image_store
+        if name == IMAGE_STORE_FILES:
+            from trap.sessions.file_image_store import FileImageStore
+            return FileImageStore(configuration.sessions_path, configuration.fsync)
+        elif name == IMAGE_STORE_PACK:
+            from trap.sessions.pack_image_store import PackImageStore
+            # as many packs open as sessions resident in the cache, and the one being recorded
+            return PackImageStore(configuration.sessions_path, configuration.resident_sessions + 1,
+                                  configuration.fsync)
+        else :
+            raise ValueError(f"Unknown image store {name}")
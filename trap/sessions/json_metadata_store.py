@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+
+from strong_typing.serialization import json_to_object, object_to_json
+
+from trap.sessions.detection_metadata import DetectionMetadata
+from trap.sessions.metadata_store import MetadataStore, write_file, TEMPORARY_SUFFIX
+from trap.sessions.session_manifest import SessionManifest, MANIFEST_FILE
+
+
+# ==========================================================================================
+# JsonMetadataStore
+# The metadata of every detection in its own file, metadata/<detection>.json in the
+# session directory, rewritten in full on every update, and the manifest of the session
+# in manifest.json. The files are replaced by renaming, and optionally synced
+# ==========================================================================================
+class JsonMetadataStore(MetadataStore) :
+    def __init__(self, sessions_path, fsync=False):
+        self.logger = logging.getLogger(name=__name__)
+        self.sessions_directory = sessions_path
+        self.fsync = fsync
+
+    def read_manifests(self, sessions):
+        return [self._read_manifest(session) for session in sessions]
+
+    # ------------------------------------------------------------------------------------------
+    # The manifest of a session. It is rebuilt from the metadata files when it is missing
+    # (sessions recorded before there were manifests) or older than the newest detection
+    # (the trap stopped before the session ended)
+    # ------------------------------------------------------------------------------------------
+    def _read_manifest(self, session):
+        session_dir = f"{self.sessions_directory}/{session}"
+        manifest_path = f"{session_dir}/{MANIFEST_FILE}"
+        try:
+            if os.stat(manifest_path).st_mtime_ns >= os.stat(f"{session_dir}/metadata").st_mtime_ns:
+                with open(manifest_path) as file:
+                    return json_to_object(SessionManifest, json.load(file))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            self.logger.error(f"Error reading manifest {manifest_path}: {e}")
+
+        self.logger.info(f"Rebuilding the manifest of session {session}")
+        try:
+            manifest = SessionManifest.from_detections(session, self.read_detections(session))
+            self.write_manifest(manifest)
+            return manifest
+        except Exception as e:
+            self.logger.error(f"Error rebuilding manifest {manifest_path}: {e}")
+            return SessionManifest(session)
+
+    def read_detections(self, session):
+        metadata_list = []
+        metadata_path = f"{self.sessions_directory}/{session}/metadata"
+        # not the files of a write that was cut short
+        files = sorted(f for f in os.listdir(metadata_path) if f.endswith(".json"))
+        for file in files:
+            file_path = f"{metadata_path}/{file}"
+            try :
+                with open(file_path, "rb") as m_file:
+                    json_str = m_file.read().decode("utf-8")
+                metadata_list.append(json_to_object(DetectionMetadata, json.loads(json_str)))
+            except Exception as e :
+                self.logger.error(f"Error reading metadate file {file_path}: {e}")
+
+        return metadata_list
+
+    def create_session(self, session):
+        os.mkdir(f"{self.sessions_directory}/{session}/metadata")
+
+    def write_detections(self, detections):
+        for metadata in detections:
+            write_file(f"{self.sessions_directory}/{metadata.session}/metadata/{metadata.detection}.json",
+                       json.dumps(object_to_json(metadata)), self.fsync)
+
+    def write_manifest(self, manifest):
+        write_file(f"{self.sessions_directory}/{manifest.session}/{MANIFEST_FILE}",
+                   json.dumps(object_to_json(manifest)), self.fsync)
+
+    def delete_session(self, session):
+        session_dir = f"{self.sessions_directory}/{session}"
+        metadata_path = f"{session_dir}/metadata"
+        if os.path.exists(metadata_path):
+            for filename in os.listdir(metadata_path):
+                try:
+                    os.remove(f"{metadata_path}/{filename}")
+                except Exception as e:
+                    self.logger.debug(f"Error deleting {metadata_path}/{filename}: {e}")
+            os.rmdir(metadata_path)
+        for manifest_file in (MANIFEST_FILE, MANIFEST_FILE + TEMPORARY_SUFFIX):
+            if os.path.exists(f"{session_dir}/{manifest_file}"):
+                os.remove(f"{session_dir}/{manifest_file}")
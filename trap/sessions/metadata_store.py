@@ -0,0 +1,74 @@
+import os
+import time
+from abc import ABC, abstractmethod
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.sessions.detection_metadata import DetectionMetadata
+from trap.sessions.session_manifest import SessionManifest
+
+DISK_WRITE_TIME = REGISTRY.histogram("trap_disk_write_seconds", "Time to write a session file")
+DISK_WRITE_BYTES = REGISTRY.counter("trap_disk_write_bytes_total", "Bytes written to session files")
+
+TEMPORARY_SUFFIX = ".tmp"
+
+
+# the file is written next to the path and renamed over it, so that a file is either the
+# old or the new version even if the trap stops while it is written. With fsync the data
+# is on the card before the rename
+def write_file(path, data, fsync=False):
+    start = time.perf_counter()
+    temporary = path + TEMPORARY_SUFFIX
+    with open(temporary, 'wb' if isinstance(data, bytes) else 'w') as file:
+        file.write(data)
+        if fsync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(temporary, path)
+    DISK_WRITE_TIME.observe_since(start)
+    DISK_WRITE_BYTES.inc(len(data))
+
+
+# ==========================================================================================
+# MetadataStore
+# Where the metadata of the sessions and their detections is kept, the images stay in
+# the session directories. The methods block and are run on the io executor, possibly
+# from several of its threads
+# ==========================================================================================
+class MetadataStore(ABC) :
+
+    # the manifests of the sessions with a directory, in the same order
+    @abstractmethod
+    def read_manifests(self, sessions) -> list[SessionManifest]:
+        pass
+
+    @abstractmethod
+    def read_detections(self, session) -> list[DetectionMetadata]:
+        pass
+
+    @abstractmethod
+    def create_session(self, session):
+        pass
+
+    # new and updated detections, in one go
+    @abstractmethod
+    def write_detections(self, detections):
+        pass
+
+    @abstractmethod
+    def write_manifest(self, manifest):
+        pass
+
+    @abstractmethod
+    def delete_session(self, session):
+        pass
+
+    # the n best detections of a session, best first
+    def top_detections(self, session, n) -> list[DetectionMetadata]:
+        return sorted(self.read_detections(session), key=lambda d: d.score, reverse=True)[:n]
+
+    # the detections of a session updated after a time (ms), oldest update first
+    def updated_since(self, session, updated) -> list[DetectionMetadata]:
+        return sorted((d for d in self.read_detections(session) if d.updated > updated), key=lambda d: d.updated)
+
+    def close(self):
+        pass
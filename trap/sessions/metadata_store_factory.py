@@ -0,0 +1,31 @@
+import os
+
+from trap.sessions.metadata_store import MetadataStore
+
+# Where the metadata of the detections is kept, a JSON file per detection or a SQLite
+# database
+METADATA_STORE_JSON = "json"
+METADATA_STORE_SQLITE = "sqlite"
+
+
+# the database next to the sessions directory, not in it where it would be taken for a session
+def metadata_database_path(sessions_path, database=None):
+    if database:
+        return database
+    return os.path.normpath(sessions_path) + ".db"
+
+
+class MetadataStoreFactory():
+
+    @staticmethod
+    def instantiate_store(configuration) -> MetadataStore:
+        name = configuration.metadata_store
+        if name == METADATA_STORE_JSON:
+            from trap.sessions.json_metadata_store import JsonMetadataStore
+            return JsonMetadataStore(configuration.sessions_path, configuration.fsync)
+        elif name == METADATA_STORE_SQLITE:
+            from trap.sessions.sqlite_metadata_store import SqliteMetadataStore
+            database = metadata_database_path(configuration.sessions_path, configuration.metadata_database)
+            return SqliteMetadataStore(configuration.sessions_path, database, configuration.fsync)
+        else :
+            raise ValueError(f"Unknown metadata store {name}")
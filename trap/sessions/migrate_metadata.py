@@ -0,0 +1,46 @@
+import argparse
+import logging
+import os
+import time
+
+from trap.sessions.metadata_store_factory import metadata_database_path
+from trap.sessions.sqlite_metadata_store import SqliteMetadataStore
+
+
+# ==========================================================================================
+# Import the metadata files of the session directories into a SQLite metadata store
+#
+#   python -m trap.sessions.migrate_metadata [--sessions ./sessions] [--database ./sessions.db]
+#
+# Sessions already in the database are re-imported, so that detections recorded with the
+# JSON store since an earlier import are added. The metadata files are left in place, the
+# trap can be switched back to the JSON store. Stop the trap first
+# ==========================================================================================
+def migrate(sessions_path, database_path):
+    store = SqliteMetadataStore(sessions_path, database_path)
+    sessions = sorted(s for s in os.listdir(sessions_path) if os.path.isdir(f"{sessions_path}/{s}"))
+    detections = 0
+    for session in sessions:
+        manifest = store.import_session(session)
+        detections += manifest.detections
+        print(f"  {session} {manifest.detections:6} detections, best score {manifest.best_score:.2f}")
+    store.close()
+    return len(sessions), detections
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import the session metadata files into a SQLite database")
+    parser.add_argument("--sessions", default="./sessions")
+    parser.add_argument("--database", default=None, help="default: the sessions directory with .db")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    database = metadata_database_path(args.sessions, args.database)
+    start = time.perf_counter()
+    sessions, detections = migrate(args.sessions, database)
+    print(f"Imported {sessions} sessions, {detections} detections into {database} "
+          f"in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from trap.sessions.file_image_store import FileImageStore
+from trap.sessions.image_store import ImageStore
+from trap.sessions.metadata_store import DISK_WRITE_TIME, DISK_WRITE_BYTES
+
+PACK_FILE = "images.pack"
+INDEX_FILE = "images.idx"
+COMPACT_FILE = "images.pack.compact"
+
+# in the pack before every image : detection, length
+RECORD = struct.Struct("<qI")
+# in the index for every image written : detection, offset of the image in the pack, length
+INDEX_ENTRY = struct.Struct("<qQI")
+
+# a pack is compacted when its session ends if at least this part of it is superseded images
+COMPACT_RATIO = 0.2
+
+
+# ==========================================================================================
+# PackFile
+# The images of a session appended one after the other to a single file, each after a
+# record of its detection and length, and an index of where the latest image of every
+# detection is, appended with every image and read back whole when the pack is opened.
+# Only the latest image of a detection is kept in the index, the superseded images are
+# dropped when the pack is compacted. The images are read through an mmap of the pack,
+# as slices of it.
+#
+# The image is appended at the end of the pack, wherever it is, before its index entry.
+# If the trap stops in between, the
+# index no longer ends where the pack does and it is rebuilt from the records of the
+# pack, an image cut short is dropped
+# ==========================================================================================
+class PackFile :
+    def __init__(self, directory):
+        self.logger = logging.getLogger(name=__name__)
+        self.pack_path = f"{directory}/{PACK_FILE}"
+        self.index_path = f"{directory}/{INDEX_FILE}"
+        self.compact_path = f"{directory}/{COMPACT_FILE}"
+        self.lock = threading.Lock()
+
+        # detection : (offset, length) of its latest image
+        self.index = {}
+        self.size = 0
+        self.dead = 0
+        self.pack = None
+        self.index_file = None
+        self.map = None
+        self.deleted = False
+        # the operations of the store using it, it is not closed while there are any
+        self.users = 0
+        with self.lock:
+            self._open()
+
+    def _open(self):
+        if self.pack is not None:
+            return
+        if self.deleted:
+            raise FileNotFoundError(f"{self.pack_path} was deleted")
+        self.pack = open(self.pack_path, "a+b")
+        self._load()
+        self.index_file = open(self.index_path, "ab")
+
+    def _load(self):
+        pack_size = os.fstat(self.pack.fileno()).st_size
+        self.index = {}
+        self.size = 0
+        self.dead = 0
+        try:
+            with open(self.index_path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            data = None
+
+        if data is not None:
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for detection, offset, length in INDEX_ENTRY.iter_unpack(data[:usable]):
+                self._add(detection, offset, length)
+        if data is None or self.size != pack_size:
+            if pack_size > 0:
+                self.logger.info(f"Rebuilding the index of {self.pack_path}")
+            self._scan(pack_size)
+            self._write_index()
+
+    def _add(self, detection, offset, length):
+        previous = self.index.get(detection)
+        if previous is not None:
+            self.dead += RECORD.size + previous[1]
+        self.index[detection] = (offset, length)
+        self.size = max(self.size, offset + length)
+
+    def _scan(self, pack_size):
+        self.index = {}
+        self.size = 0
+        self.dead = 0
+        offset = 0
+        while offset + RECORD.size <= pack_size:
+            self.pack.seek(offset)
+            detection, length = RECORD.unpack(self.pack.read(RECORD.size))
+            if offset + RECORD.size + length > pack_size:
+                break
+            self._add(detection, offset + RECORD.size, length)
+            offset += RECORD.size + length
+        if offset < pack_size:
+            self.logger.warning(f"Dropping {pack_size - offset} bytes at the end of {self.pack_path}")
+            self.pack.truncate(offset)
+        self.size = offset
+
+    def _write_index(self):
+        with open(self.index_path, "wb") as file:
+            for detection, (offset, length) in sorted(self.index.items(), key=lambda e: e[1][0]):
+                file.write(INDEX_ENTRY.pack(detection, offset, length))
+
+    def append(self, detection, image):
+        with self.lock:
+            self._open()
+            start = time.perf_counter()
+            offset = self.pack.seek(0, os.SEEK_END) + RECORD.size
+            self.pack.write(RECORD.pack(detection, len(image)))
+            self.pack.write(image)
+            self.pack.flush()
+            self.index_file.write(INDEX_ENTRY.pack(detection, offset, len(image)))
+            self.index_file.flush()
+            self._add(detection, offset, len(image))
+            DISK_WRITE_TIME.observe_since(start)
+            DISK_WRITE_BYTES.inc(RECORD.size + len(image) + INDEX_ENTRY.size)
+
+    def sync(self):
+        with self.lock:
+            if self.pack is not None:
+                os.fsync(self.pack.fileno())
+                os.fsync(self.index_file.fileno())
+
+    def read(self, detection):
+        with self.lock:
+            self._open()
+            entry = self.index.get(detection)
+            if entry is None:
+                return None
+            return self._view(*entry)
+
+    # a slice of the map, which is remapped when the pack has grown past it. A map that
+    # is replaced stays valid as long as slices of it are in use
+    def _view(self, offset, length):
+        if self.map is None or len(self.map) < offset + length:
+            self.map = mmap.mmap(self.pack.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self.map)[offset:offset + length]
+
+    def garbage(self):
+        return self.dead / self.size if self.size > 0 else 0.0
+
+    # ------------------------------------------------------------------------------------------
+    # Rewrite the pack with only the latest image of every detection. The index is removed
+    # before the new pack replaces the old one, so that if the trap stops in between it is
+    # rebuilt from whichever pack is there
+    # ------------------------------------------------------------------------------------------
+    def compact(self):
+        with self.lock:
+            self._open()
+            index = {}
+            size = 0
+            with open(self.compact_path, "wb") as file:
+                for detection, (offset, length) in sorted(self.index.items(), key=lambda e: e[1][0]):
+                    file.write(RECORD.pack(detection, length))
+                    file.write(self._view(offset, length))
+                    index[detection] = (size + RECORD.size, length)
+                    size += RECORD.size + length
+                file.flush()
+                os.fsync(file.fileno())
+
+            reclaimed = self.size - size
+            self._close()
+            os.remove(self.index_path)
+            os.replace(self.compact_path, self.pack_path)
+            self.index = index
+            self.size = size
+            self.dead = 0
+            self._write_index()
+            return reclaimed
+
+    def _close(self):
+        if self.pack is None:
+            return
+        self.pack.close()
+        self.index_file.close()
+        self.pack = None
+        self.index_file = None
+        # not closed, slices of it may still be in use
+        self.map = None
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def delete(self):
+        with self.lock:
+            self._close()
+            self.deleted = True
+            delete_pack(self.pack_path, self.index_path, self.compact_path)
+
+
+def delete_pack(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+# ==========================================================================================
+# PackImageStore
+# The images of every session in a PackFile in the session directory, so that writing an
+# image is an append to a file that is already open and deleting a session is deleting
+# two files. The packs of the most recently used sessions are kept open, a pack is never
+# closed while it is in use or while its session is being recorded. With fsync the
+# packs written are synced once per batch of images. The images of sessions recorded with
+# the FileImageStore are still read from their files
+# ==========================================================================================
+class PackImageStore(ImageStore) :
+    def __init__(self, sessions_path, open_packs=4, fsync=False):
+        self.logger = logging.getLogger(name=__name__)
+        self.sessions_directory = sessions_path
+        self.fsync = fsync
+        self.files = FileImageStore(sessions_path)
+        self.open_packs = max(1, open_packs)
+        self.lock = threading.Lock()
+        self.packs = OrderedDict()
+        # the sessions being recorded, their packs stay open
+        self.recording = set()
+
+    # the pack of a session while it is used, None if it has none and create is False.
+    # There is only ever one PackFile for a session : the least recently used packs are
+    # closed once they are no longer used, and only if their session is not recorded
+    @contextmanager
+    def _pack(self, session, create=False):
+        with self.lock:
+            pack = self.packs.get(session)
+            if pack is None:
+                directory = f"{self.sessions_directory}/{session}"
+                if not create and not os.path.exists(f"{directory}/{PACK_FILE}"):
+                    pack = None
+                else:
+                    pack = PackFile(directory)
+                    self.packs[session] = pack
+            if pack is not None:
+                pack.users += 1
+                self.packs.move_to_end(session)
+        try:
+            yield pack
+        finally:
+            if pack is not None:
+                with self.lock:
+                    pack.users -= 1
+                    closed = self._evict()
+                for evicted in closed:
+                    evicted.close()
+
+    def _evict(self):
+        closed = []
+        for session, pack in list(self.packs.items()):
+            if len(self.packs) <= self.open_packs:
+                break
+            if pack.users == 0 and session not in self.recording:
+                closed.append(self.packs.pop(session))
+        return closed
+
+    def create_session(self, session):
+        with self.lock:
+            self.recording.add(session)
+        with self._pack(session, create=True):
+            pass
+
+    def write_image(self, session, detection, image):
+        self.write_images([(session, detection, image)])
+
+    def write_images(self, images):
+        sessions = OrderedDict()
+        for session, detection, image in images:
+            sessions.setdefault(session, []).append((detection, image))
+        for session, session_images in sessions.items():
+            with self._pack(session, create=True) as pack:
+                for detection, image in session_images:
+                    pack.append(detection, image)
+                if self.fsync:
+                    pack.sync()
+
+    # None if the image is missing, also when its session is deleted while it is read
+    def read_image(self, session, detection):
+        try:
+            with self._pack(session) as pack:
+                if pack is None:
+                    return self.files.read_image(session, detection)
+                return pack.read(detection)
+        except FileNotFoundError:
+            return None
+
+    def end_session(self, session):
+        with self.lock:
+            self.recording.discard(session)
+        with self._pack(session) as pack:
+            if pack is None or pack.garbage() < COMPACT_RATIO:
+                return
+            start = time.perf_counter()
+            reclaimed = pack.compact()
+        self.logger.info(f"Compacted the images of session {session}, reclaimed {reclaimed} bytes "
+                         f"in {1000 * (time.perf_counter() - start):.0f} ms")
+
+    # the files are removed under the lock, so that the pack is not opened again meanwhile
+    def delete_session(self, session):
+        with self.lock:
+            self.recording.discard(session)
+            pack = self.packs.pop(session, None)
+            if pack is not None:
+                pack.delete()
+            else:
+                directory = f"{self.sessions_directory}/{session}"
+                delete_pack(f"{directory}/{PACK_FILE}", f"{directory}/{INDEX_FILE}", f"{directory}/{COMPACT_FILE}")
+        # and the files of a session recorded with the FileImageStore
+        self.files.delete_session(session)
+
+    def close(self):
+        with self.lock:
+            packs = list(self.packs.values())
+            self.packs.clear()
+        for pack in packs:
+            pack.close()
@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x14proto/sessions.proto\"\x1a\n\x07Session\x12\x0f\n\x07session\x18\x01 \x01(\t\"5\n\x0eSessionDetails\x12\x0f\n\x07session\x18\x01 \x01(\t\x12\x12\n\ndetections\x18\x02 \x01(\x05\"\xac\x01\n\tDetection\x12\x0f\n\x07session\x18\x01 \x01(\t\x12\x11\n\tdetection\x18\x02 \x01(\x05\x12\x0f\n\x07\x63reated\x18\x03 \x01(\x03\x12\x0f\n\x07updated\x18\x04 \x01(\x03\x12\r\n\x05score\x18\x05 \x01(\x02\x12\r\n\x05\x63lazz\x18\x06 \x01(\x05\x12\r\n\x05width\x18\x07 \x01(\x05\x12\x0e\n\x06height\x18\x08 \x01(\x05\x12\x12\n\x05image\x18\t \x01(\x0cH\x00\x88\x01\x01\x42\x08\n\x06_imageb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x14proto/sessions.proto\"\x1a\n\x07Session\x12\x0f\n\x07session\x18\x01 \x01(\t\"5\n\x0eSessionDetails\x12\x0f\n\x07session\x18\x01 \x01(\t\x12\x12\n\ndetections\x18\x02 \x01(\x05\"\xac\x01\n\tDetection\x12\x0f\n\x07session\x18\x01 \x01(\t\x12\x11\n\tdetection\x18\x02 \x01(\x05\x12\x0f\n\x07\x63reated\x18\x03 \x01(\x03\x12\x0f\n\x07updated\x18\x04 \x01(\x03\x12\r\n\x05score\x18\x05 \x01(\x02\x12\r\n\x05\x63lazz\x18\x06 \x01(\x05\x12\r\n\x05width\x18\x07 \x01(\x05\x12\x0e\n\x06height\x18\x08 \x01(\x05\x12\x12\n\x05image\x18\t \x01(\x0cH\x00\x88\x01\x01\x42\x08\n\x06_image\"\xb6\x01\n\x0cSessionQuery\x12\x0f\n\x07session\x18\x01 \x01(\t\x12\x0e\n\x06offset\x18\x02 \x01(\r\x12\r\n\x05limit\x18\x03 \x01(\r\x12\"\n\x05order\x18\x04 \x01(\x0e\x32\x13.SessionQuery.Order\x12\x11\n\tascending\x18\x05 \x01(\x08\x12\x11\n\tmin_score\x18\x06 \x01(\x02\",\n\x05Order\x12\x0b\n\x07\x43REATED\x10\x00\x12\t\n\x05SCORE\x10\x01\x12\x0b\n\x07UPDATED\x10\x02\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'proto.sessions_pb2', globals())
@@ -26,4 +26,8 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _SESSIONDETAILS._serialized_end=105
   _DETECTION._serialized_start=108
   _DETECTION._serialized_end=280
+  _SESSIONQUERY._serialized_start=283
+  _SESSIONQUERY._serialized_end=465
+  _SESSIONQUERY_ORDER._serialized_start=421
+  _SESSIONQUERY_ORDER._serialized_end=465
 # @@protoc_insertion_point(module_scope)
@@ -0,0 +1,37 @@
+from dataclasses import dataclass
+
+from trap.sessions.detection_metadata import DetectionMetadata
+
+MANIFEST_FILE = "manifest.json"
+
+
+# ==========================================================================================
+# SessionManifest
+# A summary of a session, kept in its directory so that the sessions can be listed at
+# startup without reading the metadata of every detection : the number of detections,
+# the best score and the time range (ms) from the first created to the last updated
+# ==========================================================================================
+@dataclass
+class SessionManifest :
+    session : str
+    detections : int = 0
+    best_score : float = 0.0
+    created : int = 0
+    updated : int = 0
+
+    def add(self, metadata: DetectionMetadata):
+        self.detections += 1
+        if self.created == 0 or metadata.created < self.created:
+            self.created = metadata.created
+        self.update(metadata)
+
+    def update(self, metadata: DetectionMetadata):
+        self.best_score = max(self.best_score, metadata.score)
+        self.updated = max(self.updated, metadata.updated)
+
+    @staticmethod
+    def from_detections(session, detections):
+        manifest = SessionManifest(session)
+        for metadata in detections:
+            manifest.add(metadata)
+        return manifest
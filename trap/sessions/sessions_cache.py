@@ -1,15 +1,20 @@
 import asyncio
-import json
 import logging
 import os
+import time
+from collections import OrderedDict, deque
+from operator import attrgetter
 
 import cv2
 import numpy as np
-from strong_typing.serialization import json_to_object, object_to_json
 
+from trap.executors.executors_service import EXECUTOR_IO
 from trap.sessions.proto import sessions_pb2
-from trap.sessions.detection_metadata import DetectionMetadata
 from trap.sessions.detection_metadata_with_image import DetectionMetaDataWithImage
+from trap.sessions.image_store_factory import ImageStoreFactory
+from trap.sessions.metadata_store_factory import MetadataStoreFactory
+from trap.sessions.session_manifest import SessionManifest
+from trap.sessions.write_behind_queue import WriteBehindQueue
 from trap.websocket.protocol_component import ProtocolComponent
 
 
@@ -23,19 +28,45 @@ def session_from_proto(proto) -> str:
     sess.ParseFromString(proto)
     return sess.session
 
+def session_query_from_proto(proto):
+    query = sessions_pb2.SessionQuery()
+    query.ParseFromString(proto)
+    return query
+
 def session_details_to_proto(session, detections):
     proto = sessions_pb2.SessionDetails()
     proto.session = session
     proto.detections = detections
     return proto
 
+# the sort keys of a SessionQuery, ties are broken by detection
+ORDER_KEYS = {
+    sessions_pb2.SessionQuery.CREATED: attrgetter("created"),
+    sessions_pb2.SessionQuery.SCORE: attrgetter("score"),
+    sessions_pb2.SessionQuery.UPDATED: attrgetter("updated")
+}
+
+# images read ahead of the one being sent when the detections of a session are streamed
+STREAM_READ_AHEAD = 4
+
 class SessionState() :
-    def __init__(self, state, session):
+    def __init__(self, state, session, camera=0):
         self.state = state
         self.session = session
-
+        self.camera = camera
+
+# ==========================================================================================
+# SessionsCache
+# The sessions and the metadata of their detections, cached from the metadata store
+# (JSON files in the session directories or a SQLite database), the images are in the
+# image store (JPEG files or a pack file in the session directories). Every session is
+# listed from its manifest, the metadata of the detections of a session is only read
+# when it is first needed and at most resident_sessions sessions are kept, the least
+# recently used are dropped (the sessions being recorded are always kept). The detections
+# are written behind, in batches, and all the file system work runs on the io executor
+# ==========================================================================================
 class SessionsCache(ProtocolComponent):
-    def __init__(self, config, channels, settings, websocket):
+    def __init__(self, config, channels, settings, websocket, executors):
         super().__init__(channels)
         self.logger = logging.getLogger(name=__name__)
 
@@ -43,26 +74,35 @@ class SessionsCache(ProtocolComponent):
         self.channels = channels
         self.settings = settings
         self.websocket = websocket
-
+        self.io = executors.get_executor(EXECUTOR_IO)
+        self.store = MetadataStoreFactory.instantiate_store(config)
+        self.images = ImageStoreFactory.instantiate_store(config)
+        self.writes = WriteBehindQueue(self.images, self.store, self.io, config.write_behind_interval,
+                                       config.write_behind_max_entries, config.write_behind_max_bytes)
+
+        # the manifests of all the sessions, and the detections of the resident
+        # sessions, least recently used first
         self.sessions = {}
-        self.current_session = None
+        self.detections = OrderedDict()
+        self.resident_sessions = max(1, config.resident_sessions)
+        # camera : the session it is recording
+        self.current_sessions = {}
 
         # initialise rhe cache asynchronously
-        asyncio.create_task(self.init()) # run asynchronously
+        self.init_task = asyncio.create_task(self.init()) # run asynchronously
 
     # ------------------------------------------------------------------------------------------
-    # Initialise the cache from the metadata files in the session directories
+    # Initialise the cache from the manifests of the session directories
     # ------------------------------------------------------------------------------------------
     async def init(self):
-        self.logger.debug("Rebuilding sessions cache....")
-        sessions = sorted(os.listdir(self.sessions_directory))
-        for session in sessions:
-            self.logger.debug(f"Found {session}")
-            await self._new_session(session)
-            detections = self._get_detections_metadata_for_session(session)
-            for detection in detections:
-                self.logger.debug(f"detection image {detection.detection}")
-                await self._init_detection(session, detection)
+        self.logger.debug("Reading sessions manifests....")
+        start = time.perf_counter()
+        sessions = sorted(await self.io.run(os.listdir, self.sessions_directory))
+        manifests = await self.io.run(self.store.read_manifests, sessions)
+        for manifest in manifests:
+            self.logger.debug(f"Found {manifest.session}")
+            await self._new_session(manifest.session, manifest)
+        self.logger.info(f"Read {len(manifests)} sessions in {1000 * (time.perf_counter() - start):.0f} ms")
 
 
     async def run_cache_task(self):
@@ -71,7 +111,8 @@ class SessionsCache(ProtocolComponent):
         await asyncio.gather(
             self.session_listener_task(),
             self.detection_listener_task(),
-            self.websocket_listener_task()
+            self.websocket_listener_task(),
+            self.writes.run_flush_task()
         )
 
     # ==========================================================================================
@@ -94,62 +135,73 @@ class SessionsCache(ProtocolComponent):
         # Create the directories and an entry in the cache
         if session_state.state is True :
             session = session_state.session
-            self.current_session = session
+            self.current_sessions[session_state.camera] = session
 
-            session_dir = f"{self.sessions_directory}/{session}"
-            image_dir = f"{session_dir}/images"
-            metadata_dir = f"{session_dir}/metadata"
-
-            os.mkdir(session_dir)
-            os.mkdir(image_dir)
-            os.mkdir(metadata_dir)
+            await self.io.run(self._create_session, session)
 
             self.logger.debug("Created directories")
 
             await self._new_session(session)
+            self._make_resident(session, {})
             await self._clean_up_sessions()
 
+        # The manifest is kept up to date with the new detections, write what is
+        # waiting and store the latest scores and times when the session ends, and
+        # let the image store reclaim the images that were replaced
+        else :
+            if self.current_sessions.get(session_state.camera) == session_state.session:
+                del self.current_sessions[session_state.camera]
+            manifest = self.sessions.get(session_state.session)
+            if manifest is not None :
+                await self.writes.flush()
+                await self.io.run(self._end_session, manifest)
+
     async def detection(self, detection) :
         metadata = detection.metadata
         image = detection.image
 
-        session_dir = f"{self.sessions_directory}/{metadata.session}"
-        metadata_file = str(f"{session_dir}/metadata/{metadata.detection}.json")
-        image_file = str(f"{session_dir}/images/{metadata.detection}.jpg")
+        detections = await self._resident(metadata.session)
+        if detections is None:
+            self.logger.debug(f"Ignoring detection {metadata.detection} of unknown session {metadata.session}")
+            return
+        manifest = self.sessions[metadata.session]
 
-        meta = self._get_detection(metadata.session, metadata.detection)
+        meta = detections.get(metadata.detection)
         if meta is None:
-            # If there is no existing detection, simply create the metadata
-            # and image files and update the cache
-            with open(metadata_file, 'w') as file:
-                file.write(json.dumps(object_to_json(metadata)))
-            with open(image_file, 'wb') as file:
-                file.write(image)
+            if image is None:
+                self.logger.debug(f"Ignoring update of unknown detection {metadata.detection}")
+                return
+
+            # If there is no existing detection, simply queue the image and the
+            # metadata to be written and update the cache and the manifest
+            detections[metadata.detection] = metadata
+            manifest.add(metadata)
+            self.writes.add(metadata, image, detection.trace, manifest)
 
             await self._new_detection(detection)
         else :
 
             # Otherwise the action will depend on whether this detection has a higher score
-            # than the currently stored one
+            # than the currently stored one. Metadata-only updates just touch the updated time
             meta.updated = metadata.updated #
 
-            if metadata.score > meta.score :
+            better = image is not None and metadata.score > meta.score
+            if better :
                 meta.score = metadata.score
                 meta.width = metadata.width
                 meta.height = metadata.height
-                with open(image_file, 'wb') as file:
-                    file.write(image)
 
-            self._set_detection(self.current_session, meta)
-            with open(metadata_file, 'w') as file:
-                file.write(json.dumps(object_to_json(meta)))
+            manifest.update(meta)
+            self.writes.add(meta, image if better else None, detection.trace)
             #await self._new_detection(detection)
 
 
     # ==========================================================================================
     # Handle requests received from the app. There are two request types:
     #  - sessions : Return the list of sessions
-    #  - session.detections : Return the list of detections for a given session
+    #  - session.detections : Return the detections of a session, sorted, filtered and
+    #                         paged as requested by a SessionQuery (a Session is a query
+    #                         for all of them, newest first)
     # ==========================================================================================
 
     async def websocket_listener_task(self):
@@ -166,129 +218,152 @@ class SessionsCache(ProtocolComponent):
                 await self.publish_proto("session.details", session_details_to_proto(sess[0], sess[1]))
 
         elif message.identifier == "session.detections":
-            session = session_from_proto(message.protobuf)
-            for det in self._get_detections_for_session(session) :
-                await self.publish_proto("detection",DetectionMetaDataWithImage(det[0],det[1]).to_proto())
+            query = session_query_from_proto(message.protobuf)
+            detections = await self._resident(query.session)
+            if detections is None:
+                self.logger.debug(f"Unknown session {query.session}")
+                return
+
+            # the metadata is taken from the cache, the images are read as they are sent
+            det_list = self._query_detections(detections.values(), query)
+            async for det in self._stream_detections(query.session, det_list) :
+                await self.publish_proto("detection", det.to_proto())
 
     def _list_sessions(self):
-        return map(lambda session: (session, len(self.sessions[session])), sorted(self.sessions.keys()))
-
-    def _get_detections_for_session(self, session):
-        detections = []
-        det_list = list(self.sessions.get(session).values())
-        det_list.reverse()
-        for det in det_list:
-            img = self._get_image_data(session, det.detection)
-            detections.append((det, img))
-        return detections
+        return map(lambda session: (session, self.sessions[session].detections), sorted(self.sessions.keys()))
+
+    def _query_detections(self, detections, query):
+        selected = [det for det in detections if det.score >= query.min_score]
+        key = ORDER_KEYS.get(query.order, ORDER_KEYS[sessions_pb2.SessionQuery.CREATED])
+        selected.sort(key=lambda det: (key(det), det.detection), reverse=not query.ascending)
+        end = query.offset + query.limit if query.limit > 0 else None
+        return selected[query.offset:end]
+
+    # ------------------------------------------------------------------------------------------
+    # The detections with their images, each read on the io executor (or taken from the
+    # images waiting to be written) while the ones before it are sent, at most
+    # STREAM_READ_AHEAD ahead, so that the first is sent at once and a large session is
+    # never held in memory
+    # ------------------------------------------------------------------------------------------
+    async def _stream_detections(self, session, det_list):
+        remaining = iter(det_list)
+        reads = deque()
+
+        def read_next():
+            det = next(remaining, None)
+            if det is not None:
+                reads.append((det, asyncio.ensure_future(self._read_image(session, det.detection))))
+
+        for _ in range(STREAM_READ_AHEAD):
+            read_next()
+        try:
+            while reads:
+                det, read = reads.popleft()
+                image = await read
+                read_next()
+                yield DetectionMetaDataWithImage(det, image)
+        finally:
+            for _, read in reads:
+                read.cancel()
+
+    async def _read_image(self, session, detection):
+        image = self.writes.pending_image(session, detection)
+        if image is not None:
+            return image
+        return await self.io.run(self.images.read_image, session, detection)
 
     # ==========================================================================================
     #  Cache functions
     # ==========================================================================================
-    async def _new_session(self, session) :
-        self.sessions[session] = {}
+    async def _new_session(self, session, manifest=None) :
+        self.sessions[session] = manifest if manifest is not None else SessionManifest(session)
         await self.publish_proto("session.new", session_to_proto(session))
 
     async def _delete_session(self, session) :
-        del self.sessions[session]
+        # the directory may not have been a session of the cache
+        self.sessions.pop(session, None)
+        self.detections.pop(session, None)
         await self.publish_proto("session.delete", session_to_proto(session))
 
     async def _new_detection(self, meta_with_image) :
         metadata = meta_with_image.metadata
         session = metadata.session
 
-        sess = self.sessions[session]
-        if sess is not None :
-            sess[metadata.detection] = metadata
-            await self.publish_proto("detection", meta_with_image.to_proto())
+        manifest = self.sessions.get(session)
+        if manifest is not None :
+            await self.publish_proto("detection", meta_with_image.to_proto(), meta_with_image.trace)
             await self.publish_proto(
                 "session.details",
                 session_details_to_proto(
                     metadata.session,
-                    len(self.sessions.get(session)
-                    )
+                    manifest.detections
                 )
             )
 
-    async def _init_detection(self, session, detection_metadata) :
-       sess = self.sessions.get(session)
-       if sess is not None :
-            sess[detection_metadata.detection] = detection_metadata
-
-    def _count_detections(self, session) :
-        return len(self.sessions.get(session))
-
-    def _get_detection(self, session, detection):
-        sess = self.sessions.get(session)
-        if sess is not None :
-            meta = sess.get(detection)
-            if meta is not None :
-                return meta
-        return None
+    # ------------------------------------------------------------------------------------------
+    # The detections of a session, read from the metadata store (with the updates not
+    # written yet) if the session is not resident. None if there is no such session
+    # ------------------------------------------------------------------------------------------
+    async def _resident(self, session):
+        detections = self.detections.get(session)
+        if detections is not None:
+            self.detections.move_to_end(session)
+            return detections
+        if session not in self.sessions:
+            return None
+
+        metadata_list = await self.io.run(self.store.read_detections, session)
+        # it may have been loaded (or deleted) while it was being read
+        detections = self.detections.get(session)
+        if detections is None and session in self.sessions:
+            detections = {metadata.detection: metadata for metadata in metadata_list}
+            for metadata in self.writes.pending_metadata(session):
+                detections[metadata.detection] = metadata
+            self._make_resident(session, detections)
+        return detections
 
-    def _set_detection(self, session, metadata) :
-        sess = self.sessions.get(session)
-        if sess is not None:
-            sess[metadata.detection] = metadata
+    def _make_resident(self, session, detections):
+        self.detections[session] = detections
+        self.detections.move_to_end(session)
+        current = set(self.current_sessions.values())
+        for evicted in list(self.detections.keys()):
+            if len(self.detections) <= self.resident_sessions:
+                break
+            if evicted not in current:
+                self.logger.debug(f"Dropping the detections of session {evicted} from the cache")
+                del self.detections[evicted]
 
 
+    # delete the oldest sessions beyond max_sessions, never one that a camera is recording
     async def _clean_up_sessions(self):
         settings = self.settings.settings
         max_sessions = settings.max_sessions
-        session_files = os.listdir(self.sessions_directory)
-        sessions = sorted(session_files)
-        num_sessions = len(sessions)
+        session_files = await self.io.run(os.listdir, self.sessions_directory)
+        num_sessions = len(session_files)
+        current = set(self.current_sessions.values())
+        sessions = sorted(session for session in session_files if session not in current)
         self.logger.debug(f"num sessions {num_sessions} max sessions {max_sessions}")
         if num_sessions >= max_sessions:
             #for idx in range(0, num_sessions-self.max_sessions+1):
-            for idx in range(0, num_sessions - max_sessions):
-
-                sess_path = f"{self.sessions_directory}/{sessions[idx]}"
-                img_path = f"{sess_path}/images"
-                self._delete_session_files(img_path)
-                meta_path = f"{sess_path}/metadata"
-                self._delete_session_files(meta_path)
-                os.rmdir(sess_path)
+            for idx in range(0, min(num_sessions - max_sessions, len(sessions))):
+
+                await self.writes.discard(sessions[idx])
+                await self.io.run(self._delete_session_directory, sessions[idx])
                 await self._delete_session(sessions[idx])
 
                 #resp = SessionDeletedResponse(sessions[idx]).to_proto()
                 #await self.websocket_server.send_response(resp)
 
-    def _delete_session_files(self, dir_path):
-        print(dir_path)
-        if not os.path.exists(dir_path):
-            self.logger.debug(f"Directory not found: {dir_path}")
-            return
+    def _create_session(self, session):
+        os.mkdir(f"{self.sessions_directory}/{session}")
+        self.images.create_session(session)
+        self.store.create_session(session)
 
-        for filename in os.listdir(dir_path):
-            file_path = os.path.join(dir_path, filename)
-            try:
-                self.logger.debug(f"Deleting file {file_path}")
-                os.remove(file_path)
-            except Exception as e:
-                self.logger.debug(f"Error deleting {file_path}: {e}")
-        os.rmdir(dir_path)
-
-    def _get_detections_metadata_for_session(self, session) :
-        metadata_list = []
-        metadata_path = f"{self.sessions_directory}/{session}/metadata"
-        files = sorted(os.listdir(metadata_path))
-        for file in files:
-            file_path = f"{metadata_path}/{file}"
-            m_fd = os.open(file_path, os.O_RDONLY)
-            try :
-                json_str = os.read(m_fd, os.path.getsize(file_path)).decode("utf-8")
-                metadata_list.append(json_to_object(DetectionMetadata, json.loads(json_str)))
-            except Exception as e :
-                self.logger.error(f"Error reading metadate file {file_path}: {e}")
-
-        return metadata_list
-
-    def _get_image_data(self, session, detection):
-        image_path =   f"{self.sessions_directory}/{session}/images/{detection}.jpg"
-        assert(os.path.exists(image_path))
-
-        i_fd = os.open(image_path, os.O_RDONLY)
-        img = os.read(i_fd, os.path.getsize(image_path))
-        return img
+    def _end_session(self, manifest):
+        self.store.write_manifest(manifest)
+        self.images.end_session(manifest.session)
 
+    def _delete_session_directory(self, session):
+        self.images.delete_session(session)
+        self.store.delete_session(session)
+        os.rmdir(f"{self.sessions_directory}/{session}")
@@ -0,0 +1,175 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.sessions.detection_metadata import DetectionMetadata
+from trap.sessions.json_metadata_store import JsonMetadataStore
+from trap.sessions.metadata_store import MetadataStore
+from trap.sessions.session_manifest import SessionManifest
+
+# The manifest of a session is kept up to date by the triggers, in the same transaction
+# as the detections
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    detections INTEGER NOT NULL DEFAULT 0,
+    best_score REAL NOT NULL DEFAULT 0,
+    created INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS detections (
+    session TEXT NOT NULL,
+    detection INTEGER NOT NULL,
+    created INTEGER NOT NULL,
+    updated INTEGER NOT NULL,
+    score REAL NOT NULL,
+    clazz INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    PRIMARY KEY (session, detection)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS detections_score ON detections (session, score DESC);
+CREATE INDEX IF NOT EXISTS detections_updated ON detections (session, updated);
+CREATE TRIGGER IF NOT EXISTS detection_inserted AFTER INSERT ON detections BEGIN
+    UPDATE sessions SET
+        detections = detections + 1,
+        best_score = max(best_score, NEW.score),
+        created = CASE WHEN created = 0 THEN NEW.created ELSE min(created, NEW.created) END,
+        updated = max(updated, NEW.updated)
+    WHERE session = NEW.session;
+END;
+CREATE TRIGGER IF NOT EXISTS detection_updated AFTER UPDATE ON detections BEGIN
+    UPDATE sessions SET
+        best_score = max(best_score, NEW.score),
+        updated = max(updated, NEW.updated)
+    WHERE session = NEW.session;
+END;
+"""
+
+DETECTION_COLUMNS = "session, detection, created, updated, score, clazz, width, height"
+
+INSERT_SESSION = "INSERT OR IGNORE INTO sessions (session) VALUES (?)"
+UPSERT_DETECTION = f"""
+INSERT INTO detections ({DETECTION_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (session, detection) DO UPDATE SET
+    updated = excluded.updated, score = excluded.score, clazz = excluded.clazz,
+    width = excluded.width, height = excluded.height
+"""
+DELETE_DETECTIONS = "DELETE FROM detections WHERE session = ?"
+DELETE_SESSION = "DELETE FROM sessions WHERE session = ?"
+
+SELECT_SESSIONS = "SELECT session, detections, best_score, created, updated FROM sessions"
+SELECT_DETECTIONS = f"SELECT {DETECTION_COLUMNS} FROM detections WHERE session = ? ORDER BY detection"
+SELECT_TOP = f"SELECT {DETECTION_COLUMNS} FROM detections WHERE session = ? ORDER BY score DESC LIMIT ?"
+SELECT_UPDATED_SINCE = f"SELECT {DETECTION_COLUMNS} FROM detections WHERE session = ? AND updated > ? ORDER BY updated"
+
+
+def detection_row(metadata):
+    return (metadata.session, metadata.detection, metadata.created, metadata.updated,
+            metadata.score, metadata.clazz, metadata.width, metadata.height)
+
+
+# ==========================================================================================
+# SqliteMetadataStore
+# The metadata of the sessions and their detections in one SQLite database, in WAL mode
+# so that a write appends to the log instead of rewriting a file and the readers are not
+# blocked by it. The writes are upserts of statements prepared once (the sqlite3 module
+# caches them by their text), batched in one transaction per call, and the best or the
+# latest detections of a session are read from the indexes. Sessions with a directory
+# but not in the database, recorded with the JSON store, are imported when they are
+# first listed (see migrate_metadata to import them all at once)
+# ==========================================================================================
+class SqliteMetadataStore(MetadataStore) :
+    def __init__(self, sessions_path, database_path, fsync=False):
+        self.logger = logging.getLogger(name=__name__)
+        self.sessions_directory = sessions_path
+        self.database_path = database_path
+        self.json = JsonMetadataStore(sessions_path)
+
+        # one connection shared by the io threads, the writes are serialised anyway
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(database_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode a commit is durable at the next checkpoint, a power cut loses the
+        # last transactions but never corrupts the database. With fsync every commit is
+        # synced
+        self.connection.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        self.connection.executescript(SCHEMA)
+
+        self.transaction_time = REGISTRY.histogram(
+            "trap_metadata_transaction_seconds", "Time to commit a transaction of the metadata database")
+
+    def _transaction(self, statements):
+        start = time.perf_counter()
+        with self.lock, self.connection:
+            for sql, rows in statements:
+                self.connection.executemany(sql, rows)
+        self.transaction_time.observe_since(start)
+
+    def _query(self, sql, *parameters):
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def read_manifests(self, sessions):
+        manifests = {row[0]: SessionManifest(*row) for row in self._query(SELECT_SESSIONS)}
+
+        # sessions whose directory was deleted while the trap was stopped
+        listed = set(sessions)
+        for session in [s for s in manifests if s not in listed]:
+            self._transaction([(DELETE_DETECTIONS, [(session,)]), (DELETE_SESSION, [(session,)])])
+            del manifests[session]
+
+        for session in sessions:
+            if session not in manifests:
+                self.logger.info(f"Importing the metadata of session {session}")
+                manifests[session] = self.import_session(session)
+        return [manifests[session] for session in sessions]
+
+    # ------------------------------------------------------------------------------------------
+    # Import the metadata files of a session recorded with the JSON store, the files are
+    # left in place
+    # ------------------------------------------------------------------------------------------
+    def import_session(self, session):
+        detections = []
+        if os.path.isdir(f"{self.sessions_directory}/{session}/metadata"):
+            detections = self.json.read_detections(session)
+        self._transaction([
+            (INSERT_SESSION, [(session,)]),
+            (UPSERT_DETECTION, [detection_row(metadata) for metadata in detections])
+        ])
+        rows = self._query(SELECT_SESSIONS + " WHERE session = ?", session)
+        return SessionManifest(*rows[0])
+
+    def read_detections(self, session):
+        return [DetectionMetadata(*row) for row in self._query(SELECT_DETECTIONS, session)]
+
+    def create_session(self, session):
+        self._transaction([(INSERT_SESSION, [(session,)])])
+
+    def write_detections(self, detections):
+        self._transaction([
+            (INSERT_SESSION, {(metadata.session,) for metadata in detections}),
+            (UPSERT_DETECTION, [detection_row(metadata) for metadata in detections])
+        ])
+
+    # the manifests are maintained by the triggers
+    def write_manifest(self, manifest):
+        pass
+
+    def delete_session(self, session):
+        self._transaction([(DELETE_DETECTIONS, [(session,)]), (DELETE_SESSION, [(session,)])])
+        # and the files of a session that was imported
+        self.json.delete_session(session)
+
+    def top_detections(self, session, n):
+        return [DetectionMetadata(*row) for row in self._query(SELECT_TOP, session, n)]
+
+    def updated_since(self, session, updated):
+        return [DetectionMetadata(*row) for row in self._query(SELECT_UPDATED_SINCE, session, updated)]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,247 @@
+import asyncio
+import dataclasses
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.metrics.trace import TraceContext, GLASS_TO_DISK
+from trap.sessions.detection_metadata import DetectionMetadata
+
+# times a detection is tried before it is dropped when it keeps failing to be written
+MAX_ATTEMPTS = 3
+
+
+# ==========================================================================================
+# PendingWrite
+# The latest state of a detection that is not written yet : its metadata, its image if
+# it has a new one, the trace of the frame of that state and the failed attempts to
+# write it
+# ==========================================================================================
+@dataclass
+class PendingWrite :
+    metadata : DetectionMetadata
+    image : Optional[bytes] = None
+    trace : Optional[TraceContext] = None
+    attempts : int = 0
+
+
+# ==========================================================================================
+# WriteBehindQueue
+# Keeps the latest state of every detection (session, track) that changed and writes
+# them to the image and metadata stores in batches on the io executor : every interval
+# seconds, or as soon as there are max_entries detections or max_bytes of images waiting.
+# A track seen in every frame is then written once per batch instead of once per frame.
+# A new state of a detection replaces the one waiting, its image replaces the image only
+# if it has one. The manifests of the sessions are written after their detections.
+#
+# With an interval of 0 a batch is written as soon as the previous one is, what arrives
+# while a batch is written is coalesced. The updates that replaced one waiting and the
+# writes done are counted. When a batch cannot be written its detections are written one
+# by one, those that fail are put back and dropped after MAX_ATTEMPTS, so that one bad
+# detection never holds up the others
+# ==========================================================================================
+class WriteBehindQueue :
+    def __init__(self, images, store, io, interval=1.0, max_entries=256, max_bytes=4 * 1024 * 1024):
+        self.logger = logging.getLogger(name=__name__)
+        self.images = images
+        self.store = store
+        self.io = io
+        self.interval = interval
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+
+        # (session, detection) : PendingWrite, and session : manifest
+        self.dirty = OrderedDict()
+        self.dirty_bytes = 0
+        self.manifests = {}
+        # the batch being written, still served to the readers
+        self.writing = {}
+        self.lock = asyncio.Lock()
+        self.wake = asyncio.Event()
+
+        self.updates = REGISTRY.counter(
+            "trap_persist_updates_total", "Detection updates queued to be written", {"kind": "metadata"})
+        self.image_updates = REGISTRY.counter(
+            "trap_persist_updates_total", "Detection updates queued to be written", {"kind": "image"})
+        self.coalesced = REGISTRY.counter(
+            "trap_persist_coalesced_total", "Detection updates replaced before they were written", {"kind": "metadata"})
+        self.images_coalesced = REGISTRY.counter(
+            "trap_persist_coalesced_total", "Detection updates replaced before they were written", {"kind": "image"})
+        self.writes = REGISTRY.counter(
+            "trap_persist_writes_total", "Detection updates written", {"kind": "metadata"})
+        self.image_writes = REGISTRY.counter(
+            "trap_persist_writes_total", "Detection updates written", {"kind": "image"})
+        self.failures = REGISTRY.counter(
+            "trap_persist_failures_total", "Batches of detections that could not be written")
+        self.dropped = REGISTRY.counter(
+            "trap_persist_dropped_total", "Detection updates dropped after failing to be written")
+        self.flush_time = REGISTRY.histogram("trap_persist_flush_seconds", "Time to write a batch of detections")
+        REGISTRY.gauge("trap_persist_dirty_entries", "Detections waiting to be written",
+                       function=lambda: len(self.dirty))
+        REGISTRY.gauge("trap_persist_dirty_bytes", "Bytes of images waiting to be written",
+                       function=lambda: self.dirty_bytes)
+
+    def add(self, metadata, image=None, trace=None, manifest=None):
+        key = (metadata.session, metadata.detection)
+        # a copy, the cache keeps updating its own
+        pending = PendingWrite(dataclasses.replace(metadata), image, trace)
+        self.updates.inc()
+        if image is not None:
+            self.image_updates.inc()
+            self.dirty_bytes += len(image)
+
+        previous = self.dirty.pop(key, None)
+        if previous is not None:
+            pending.attempts = previous.attempts
+            self.coalesced.inc()
+            if previous.image is not None:
+                if image is None:
+                    pending.image = previous.image
+                else:
+                    self.images_coalesced.inc()
+                    self.dirty_bytes -= len(previous.image)
+        self.dirty[key] = pending
+        if manifest is not None:
+            self.manifests[manifest.session] = manifest
+
+        if self.interval <= 0 or len(self.dirty) >= self.max_entries or self.dirty_bytes >= self.max_bytes:
+            self.wake.set()
+
+    # the image of a detection that is not written yet, None if it is already
+    def pending_image(self, session, detection):
+        for batch in (self.dirty, self.writing):
+            pending = batch.get((session, detection))
+            if pending is not None and pending.image is not None:
+                return pending.image
+        return None
+
+    # the metadata of the detections of a session that are not written yet
+    def pending_metadata(self, session):
+        metadata = {}
+        for batch in (self.writing, self.dirty):
+            for (s, detection), pending in batch.items():
+                if s == session:
+                    metadata[detection] = pending.metadata
+        return list(metadata.values())
+
+    async def run_flush_task(self):
+        self.logger.debug("Starting write behind task....")
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(self.wake.wait(), self.interval if self.interval > 0 else None)
+                except asyncio.TimeoutError:
+                    pass
+                self.wake.clear()
+                await self.flush()
+        finally:
+            # write what is waiting when the trap stops
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.dirty and not self.manifests:
+                return
+            batch, self.dirty = self.dirty, OrderedDict()
+            manifests, self.manifests = list(self.manifests.values()), {}
+            self.dirty_bytes = 0
+            self.writing = batch
+
+            start = time.perf_counter()
+            try:
+                await self.io.run(self._write, list(batch.values()), manifests)
+                failed = {}
+            except Exception as e:
+                self.logger.error(f"Error writing {len(batch)} detections, writing them one by one: {e}")
+                self.failures.inc()
+                failed = await self.io.run(self._write_each, batch, manifests)
+                self._restore(failed)
+            finally:
+                self.writing = {}
+            self.flush_time.observe_since(start)
+
+            # the age of the frames the detections were made from, now that they are on disk
+            for key, pending in batch.items():
+                if pending.trace is not None and key not in failed:
+                    pending.trace.observe(GLASS_TO_DISK)
+
+    # write the detections of a batch that failed one at a time. Returns those that failed
+    # and are to be tried again, a detection (or a manifest) that fails too often is dropped
+    def _write_each(self, batch, manifests):
+        failed = OrderedDict()
+        for key, pending in batch.items():
+            try:
+                self._write([pending], [])
+            except Exception as e:
+                pending.attempts += 1
+                if pending.attempts < MAX_ATTEMPTS:
+                    failed[key] = pending
+                else:
+                    self.logger.error(f"Dropping detection {key[1]} of session {key[0]} after "
+                                      f"{pending.attempts} failed writes: {e}")
+                    self.dropped.inc()
+        for manifest in manifests:
+            try:
+                self.store.write_manifest(manifest)
+            except Exception as e:
+                self.logger.error(f"Failed to write the manifest of session {manifest.session}: {e}")
+        return failed
+
+    # put back the detections that could not be written, to be written with the next batch.
+    # What was added while they were written is newer and stays, it only keeps the image
+    # that failed if it has none
+    def _restore(self, failed):
+        dirty = OrderedDict()
+        for key, pending in failed.items():
+            newer = self.dirty.pop(key, None)
+            if newer is not None:
+                newer.attempts = pending.attempts
+                if newer.image is None and pending.image is not None:
+                    newer.image = pending.image
+                    self.dirty_bytes += len(pending.image)
+                pending = newer
+            elif pending.image is not None:
+                self.dirty_bytes += len(pending.image)
+            dirty[key] = pending
+        dirty.update(self.dirty)
+        self.dirty = dirty
+
+    # the images first, so that the metadata never refers to a missing image
+    def _write(self, batch, manifests):
+        images = [(p.metadata.session, p.metadata.detection, p.image) for p in batch if p.image is not None]
+        self.images.write_images(images)
+        self.image_writes.inc(len(images))
+        self.store.write_detections([p.metadata for p in batch])
+        self.writes.inc(len(batch))
+        for manifest in manifests:
+            self.store.write_manifest(manifest)
+
+    # drop what is waiting to be written to a session that is being deleted, once the batch
+    # being written is
+    async def discard(self, session):
+        async with self.lock:
+            for key in [key for key in self.dirty if key[0] == session]:
+                pending = self.dirty.pop(key)
+                if pending.image is not None:
+                    self.dirty_bytes -= len(pending.image)
+            self.manifests.pop(session, None)
+
+    def stats(self):
+        return {
+            "updates": self.updates.value,
+            "coalesced": self.coalesced.value,
+            "image_updates": self.image_updates.value,
+            "images_coalesced": self.images_coalesced.value,
+            "writes": self.writes.value,
+            "image_writes": self.image_writes.value,
+            "failures": self.failures.value,
+            "dropped": self.dropped.value
+        }
+
+    def __str__(self):
+        return (f"persist: {len(self.dirty)} dirty ({self.dirty_bytes} bytes), "
+                f"{self.writes.value:.0f}/{self.updates.value:.0f} metadata and "
+                f"{self.image_writes.value:.0f}/{self.image_updates.value:.0f} images written")
@@ -7,6 +7,7 @@ from dataclasses import dataclass
 from fsspec.utils import atomic_write
 from strong_typing.serialization import object_to_json, json_to_object
 
+from trap.executors.executors_service import EXECUTOR_IO
 from trap.websocket.protobuf_message import ProtobufMsg
 from trap.settings.proto import settings_pb2
 from trap.websocket.protocol_component import ProtocolComponent
@@ -38,12 +39,13 @@ class Settings :
 
 class SettingsDatabase(ProtocolComponent) :
 
-    def __init__(self, config, channels, websocket ):
+    def __init__(self, config, channels, websocket, executors):
         super().__init__(channels)
         self.logger = logging.getLogger(name=__name__)
 
         self.path = f"{config.settings_path}/settings.db"
         self.websocket = websocket
+        self.io = executors.get_executor(EXECUTOR_IO)
 
         self.on_changed = None
         self.settings = self.read_settings()
@@ -72,7 +74,7 @@ class SettingsDatabase(ProtocolComponent) :
 
         elif message.identifier == "settings.set":
             self.settings = Settings.from_proto(message.protobuf)
-            self.write_settings(self.settings)
+            await self.io.run(self.write_settings, self.settings)
             settings_proto = self.settings.to_proto()
             await self.protocol_out_channel.publish(ProtobufMsg("settings", settings_proto))
 
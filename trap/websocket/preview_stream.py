@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import time
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.metrics.trace import glass_to_client
+
+# Messages that carry preview frames and their overlays. Only the latest one of each
+# is ever sent
+PREVIEW_IDENTIFIERS = {"picam3.frame", "ahqcam.frame", "detection.overlay"}
+REPORT_INTERVAL = 10.0
+
+SEND_TIME = REGISTRY.histogram("trap_websocket_send_seconds", "Time to send a message to the app", {"kind": "preview"})
+SEND_BYTES = REGISTRY.counter("trap_websocket_sent_bytes_total", "Bytes sent to the app", {"kind": "preview"})
+DROPPED = REGISTRY.counter("trap_preview_dropped_frames_total", "Preview frames replaced before they were sent")
+
+
+# ==========================================================================================
+# PreviewStream
+# Delivers preview frames to one websocket client without ever blocking the producer.
+# offer() puts the frame into a single slot per message identifier, replacing (and
+# counting as dropped) any frame that has not been sent yet. A sender task sends the
+# slots and measures how long each send takes and how full the socket buffer is, and
+# from that adapts the interval between preview frames and their JPEG quality
+# ==========================================================================================
+class PreviewStream :
+    def __init__(self, websocket, min_interval=0.05, max_interval=2.0,
+                 min_quality=30, max_quality=80, buffer_limit=256 * 1024):
+        self.logger = logging.getLogger(name=__name__)
+        self.websocket = websocket
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.buffer_limit = buffer_limit
+
+        self.slots = {}
+        self.ready = asyncio.Event()
+        self.interval = min_interval
+        self.quality = max_quality
+        self.latency = 0.0
+        self.last_offer = 0.0
+        self.last_report = time.monotonic()
+
+        self.sent = 0
+        self.dropped = 0
+
+    # ------------------------------------------------------------------------------
+    # Whether the producer should make a new preview frame now
+    # ------------------------------------------------------------------------------
+    def due(self):
+        return time.monotonic() - self.last_offer >= self.interval
+
+    def offer(self, identifier, data, trace=None):
+        if identifier in self.slots:
+            self.dropped += 1
+            DROPPED.inc()
+        self.slots[identifier] = (data, trace)
+        self.last_offer = time.monotonic()
+        self.ready.set()
+
+    async def run(self):
+        while True:
+            await self.ready.wait()
+            self.ready.clear()
+            while self.slots:
+                identifier, (data, trace) = self.slots.popitem()
+                start = time.perf_counter()
+                try:
+                    await self.websocket.send(data)
+                except Exception as e:
+                    self.logger.error(f"Failed to send preview {identifier}: {e}")
+                    continue
+                self.sent += 1
+                self.adapt(time.perf_counter() - start)
+                SEND_TIME.observe_since(start)
+                SEND_BYTES.inc(len(data))
+                if trace is not None:
+                    trace.observe(glass_to_client(identifier))
+
+            if time.monotonic() - self.last_report > REPORT_INTERVAL:
+                self.last_report = time.monotonic()
+                self.logger.info(str(self))
+
+    def buffer_fill(self):
+        transport = getattr(self.websocket, "transport", None)
+        if transport is None:
+            return 0.0
+        return transport.get_write_buffer_size() / self.buffer_limit
+
+    # ------------------------------------------------------------------------------
+    # Back off (longer interval, lower quality) when the sends take longer than the
+    # interval or the socket buffer is filling, recover slowly when they keep up
+    # ------------------------------------------------------------------------------
+    def adapt(self, latency):
+        self.latency = 0.8 * self.latency + 0.2 * latency
+        congested = self.latency > self.interval or self.buffer_fill() > 0.5
+        if congested:
+            self.interval = min(self.max_interval, self.interval * 1.25)
+            self.quality = max(self.min_quality, self.quality - 5)
+        elif self.latency < self.interval / 2:
+            self.interval = max(self.min_interval, self.interval * 0.95)
+            self.quality = min(self.max_quality, self.quality + 1)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "latency_ms": 1000 * self.latency,
+            "interval_ms": 1000 * self.interval,
+            "quality": self.quality
+        }
+
+    def __str__(self):
+        return (f"preview: {self.sent} sent, {self.dropped} dropped, {1000 * self.latency:.0f} ms send, "
+                f"{1 / self.interval:.1f} fps max, quality {self.quality}")
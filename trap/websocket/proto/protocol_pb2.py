@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x14proto/protocol.proto\"7\n\x0fProtobufMessage\x12\x12\n\nidentifier\x18\x01 \x01(\t\x12\x10\n\x08protobuf\x18\x02 \x01(\x0c\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x14proto/protocol.proto\"[\n\x0fProtobufMessage\x12\x12\n\nidentifier\x18\x01 \x01(\t\x12\x10\n\x08protobuf\x18\x02 \x01(\x0c\x12\x10\n\x08sequence\x18\x03 \x01(\x04\x12\x10\n\x08\x63\x61ptured\x18\x04 \x01(\x03\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'proto.protocol_pb2', globals())
@@ -21,5 +21,5 @@ if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
   _PROTOBUFMESSAGE._serialized_start=24
-  _PROTOBUFMESSAGE._serialized_end=79
+  _PROTOBUFMESSAGE._serialized_end=115
 # @@protoc_insertion_point(module_scope)
@@ -2,9 +2,11 @@ from trap.websocket.proto import protocol_pb2
 
 
 class ProtobufMsg :
-    def __init__(self, identifier, protobuf) :
+    # trace is the TraceContext of the frame the message was made from, if any
+    def __init__(self, identifier, protobuf, trace=None) :
         self.identifier = identifier
         self.protobuf = protobuf
+        self.trace = trace
 
     def to_protobuf(self):
         prot_msg = protocol_pb2.ProtocolMessage()
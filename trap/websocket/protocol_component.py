@@ -12,7 +12,7 @@ class ProtocolComponent(ABC) :
         self.protocol_out_channel = channels.get_channel('publish_message')
 
 
-    async def publish_proto(self, identifier, msg):
+    async def publish_proto(self, identifier, msg, trace=None):
         logging.debug(f"publish_proto: {identifier}")
-        msg = ProtobufMsg(identifier, msg.SerializeToString())
+        msg = ProtobufMsg(identifier, msg.SerializeToString(), trace)
         await self.protocol_out_channel.publish(msg)
\ No newline at end of file
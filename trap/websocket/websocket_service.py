@@ -1,21 +1,31 @@
 import asyncio
 import logging
+import time
 from abc import ABC
 
 from websockets import ConnectionClosedOK
 from websockets.asyncio.server import serve
 
 from trap.channels.channel import Channel
+from trap.metrics.metrics_registry import REGISTRY
+from trap.metrics.trace import glass_to_client
 from trap.websocket.proto import protocol_pb2
+from trap.websocket.preview_stream import PreviewStream, PREVIEW_IDENTIFIERS
 from trap.websocket.protobuf_message import ProtobufMsg
 
+SEND_TIME = REGISTRY.histogram("trap_websocket_send_seconds", "Time to send a message to the app", {"kind": "message"})
+SEND_BYTES = REGISTRY.counter("trap_websocket_sent_bytes_total", "Bytes sent to the app", {"kind": "message"})
+
+
 class WebsocketServer :
     def __init__(self, config, channels ) :
+        # identifier : the channels of the components subscribed to it
         self.subscriptions = {}
         self.port = config.websocket_port
         self.channels = channels
         self.tasks = []
         self.websocket = None
+        self.preview_streams = []
         self.logger = logging.getLogger(__name__)
         self.connection_state = self.channels.get_channel("connection_state")
 
@@ -32,10 +42,34 @@ class WebsocketServer :
     async def handler(self, websocket):
         self.websocket = websocket
 
+        # preview frames are sent by their own task so a slow client never
+        # holds up the publishers
+        preview = PreviewStream(websocket)
+        self.preview_streams.append(preview)
+        preview_task = asyncio.create_task(preview.run())
+
         self.logger.debug(f"creating websocket incoming task")
         incom_task = asyncio.create_task(self.incoming_task())
         await incom_task  # exits when socket gone
-        self.websocket = None
+
+        preview_task.cancel()
+        self.preview_streams.remove(preview)
+        self.logger.info(f"Connection closed, {preview}")
+        if self.websocket is websocket:
+            self.websocket = None
+
+    # =====================================================================
+    # Preview flow control for the producer of the preview frames. A frame
+    # is due if any client is ready for one, the quality is that of the
+    # most constrained client
+    # =====================================================================
+    def preview_due(self):
+        return any(stream.due() for stream in self.preview_streams)
+
+    def preview_quality(self, default):
+        if not self.preview_streams:
+            return default
+        return min([default] + [stream.quality for stream in self.preview_streams])
 
     async def outgoing_task(self) :
         logging.debug("Starting websocket outgoing task....")
@@ -46,8 +80,23 @@ class WebsocketServer :
                 logging.debug(f"Sending message {pm.identifier}")
                 pm.identifier = m.identifier
                 pm.protobuf = m.protobuf
-                if self.websocket is not None:
-                    await self.websocket.send(pm.SerializeToString())
+                trace = getattr(m, "trace", None)
+                if trace is not None:
+                    pm.sequence = trace.sequence
+                    pm.captured = trace.captured_ms()
+                if m.identifier in PREVIEW_IDENTIFIERS:
+                    # latest frame wins, never wait for the client
+                    data = pm.SerializeToString()
+                    for stream in self.preview_streams:
+                        stream.offer(m.identifier, data, trace)
+                elif self.websocket is not None:
+                    data = pm.SerializeToString()
+                    start = time.perf_counter()
+                    await self.websocket.send(data)
+                    SEND_TIME.observe_since(start)
+                    SEND_BYTES.inc(len(data))
+                    if trace is not None:
+                        trace.observe(glass_to_client(m.identifier))
             except Exception as e :
                 self.logger.error(f"Failed to send message {pm.identifier}: {e}")
 
@@ -65,10 +114,11 @@ class WebsocketServer :
                 self.logger.debug(f"Received {pm.identifier}")
 
                 msg = ProtobufMsg(pm.identifier, pm.protobuf)
-                channel = self.subscriptions.get(msg.identifier)
-                if channel is not None:
+                channels = self.subscriptions.get(msg.identifier)
+                if channels:
                     self.logger.debug(f"Forwarding message {msg.identifier}")
-                    await channel.publish(msg)
+                    for channel in channels:
+                        await channel.publish(msg)
                 else :
                     self.logger.warn(f"No subscription for {pm.identifier}")
 
@@ -82,16 +132,14 @@ class WebsocketServer :
             await self.connection_state.publish(False)
             self.logger.warn(f"Error in incoming_task {e}")
 
+    # several components may subscribe to the same message, each gets it on its own channel
     def subscribe_one_message(self, identifier):
-        self.logger.debug(f"Subscribed to {identifier}")
-        channel = Channel()
-        self.subscriptions[identifier] = channel
-        return channel
+        return self.subscribe_many_messages(identifier)
 
     def subscribe_many_messages(self, *args):
         channel = Channel()
         for ident in args :
             self.logger.debug(f"Subscribed to {ident}")
-            self.subscriptions[ident] = channel
+            self.subscriptions.setdefault(ident, []).append(channel)
         return channel
 
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.workflow.detections import Detections
+
+
+# ==========================================================================================
+# BatchDetector
+# One detector shared by the workflows of several cameras. The lores frames submitted
+# by the workflows are gathered into a batch, waiting at most window seconds after the
+# first frame for up to max_batch frames, and the batch is run as a single call on the
+# inference executor : one batched model call with ultralytics, concurrent networks with
+# NCNN (see NcnnBatchDetector). The detections are then fanned back out to the
+# submitters. detect_batch takes a list of images and returns a list of Detections in the
+# same order
+# ==========================================================================================
+class BatchDetector :
+    def __init__(self, detect_batch, max_batch=2, window=0.02, size=None, executor=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.loop = asyncio.get_running_loop()
+        self.executor = executor
+        self.detect_batch = detect_batch
+        self.max_batch = max_batch
+        self.window = window
+        self.size = size
+        self.requests = asyncio.Queue()
+
+        self.batches = 0
+        self.frames = 0
+        self.latency = 0.0
+        self.completions = deque(maxlen=1024)
+        self.inference_time = REGISTRY.histogram(
+            "trap_inference_seconds", "Time to run the detector on a frame", {"mode": "batch"})
+        self.batch_size = REGISTRY.histogram(
+            "trap_inference_batch_frames", "Frames per batch of the shared detector", buckets=(1, 2, 3, 4, 6, 8))
+
+    async def detect(self, image) -> Detections:
+        future = self.loop.create_future()
+        await self.requests.put((image, future))
+        return await future
+
+    async def _gather(self):
+        batch = [await self.requests.get()]
+        deadline = self.loop.time() + self.window
+        while len(batch) < self.max_batch:
+            timeout = deadline - self.loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.requests.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run_task(self):
+        while True:
+            batch = await self._gather()
+            start = time.perf_counter()
+            try:
+                results = await self.loop.run_in_executor(
+                    self.executor, self.detect_batch, [image for image, _ in batch])
+            except Exception as e:
+                self.logger.error(f"Batch detection failed {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), detections in zip(batch, results):
+                if not future.done():
+                    future.set_result(detections)
+
+            self.latency = time.perf_counter() - start
+            self.inference_time.observe(self.latency)
+            self.batch_size.observe(len(batch))
+            self.batches += 1
+            self.frames += len(batch)
+            self.completions.extend([time.perf_counter()] * len(batch))
+
+    def fps(self, window=5.0):
+        horizon = time.perf_counter() - window
+        return sum(1 for t in self.completions if t >= horizon) / window
+
+    def __str__(self):
+        size = self.frames / self.batches if self.batches else 0
+        return (f"batch: {self.fps():.1f} fps, {size:.1f} frames per batch, "
+                f"{1000 * self.latency:.1f} ms per batch")
@@ -0,0 +1,37 @@
+# ==========================================================================================
+# BestShots
+# The best score seen so far for each track of the current session. A detection only
+# needs its crop encoded and stored when it beats the best score of its track, all
+# other sightings of the track are sent on as metadata-only updates. The best score is
+# only raised once the crop has been encoded, so that a crop that failed is tried again
+# ==========================================================================================
+class BestShots :
+    def __init__(self):
+        self.session = None
+        self.best = {}
+        self.improvements = 0
+        self.updates = 0
+
+    def reset(self, session):
+        self.session = session
+        self.best.clear()
+
+    def improved(self, session, track_id, score) -> bool:
+        if session != self.session:
+            self.reset(session)
+        best = self.best.get(track_id)
+        if best is None or score > best:
+            return True
+        self.updates += 1
+        return False
+
+    def commit(self, session, track_id, score):
+        if session != self.session:
+            return
+        best = self.best.get(track_id)
+        if best is None or score > best:
+            self.best[track_id] = score
+            self.improvements += 1
+
+    def __str__(self):
+        return f"best shots: {len(self.best)} tracks, {self.improvements} crops, {self.updates} metadata updates"
@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+
+
+# ==========================================================================================
+# BufferPool
+# A small pool of preallocated arrays that frames are copied into so that the camera
+# request can be returned to libcamera straight away. The arrays are allocated on first
+# use with the shape of the stream. When the pool is exhausted a temporary array is
+# allocated instead and counted as a miss, which indicates that the pool is too small
+# ==========================================================================================
+class BufferPool :
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.shape = None
+        self.dtype = None
+        self.free = []
+        self.in_use = 0
+        self.peak = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def _allocate(self, shape, dtype):
+        self.shape = shape
+        self.dtype = dtype
+        self.free = [np.empty(shape, dtype) for _ in range(self.size)]
+
+    def acquire(self, shape, dtype=np.uint8):
+        with self.lock:
+            if self.shape != shape or self.dtype != dtype:
+                self._allocate(shape, dtype)
+            self.in_use += 1
+            self.peak = max(self.peak, self.in_use)
+            if self.free:
+                return self.free.pop()
+            self.misses += 1
+            return np.empty(shape, dtype)
+
+    def release(self, buffer):
+        with self.lock:
+            self.in_use -= 1
+            if buffer.shape == self.shape and buffer.dtype == self.dtype and len(self.free) < self.size:
+                self.free.append(buffer)
+
+    def copy(self, array):
+        buffer = self.acquire(array.shape, array.dtype)
+        np.copyto(buffer, array)
+        return buffer
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "in_use": self.in_use,
+            "peak": self.peak,
+            "misses": self.misses
+        }
+
+    def __str__(self):
+        return f"{self.name} pool: {self.in_use}/{self.size} in use, peak {self.peak}, {self.misses} misses"
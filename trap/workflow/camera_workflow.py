@@ -1,40 +1,122 @@
 import logging
 import time
 import asyncio
+import dataclasses
 from queue import Queue
 
 import cv2
 import numpy as np
 
 from datetime import datetime
-import picamera2
-from picamera2 import CompletedRequest, Picamera2, MappedArray
-from ultralytics import YOLO
 
 from trap.cameras.camera_factory import CameraFactory
+from trap.cameras.sources.frame_source import CapturedFrame
+from trap.cameras.sources.frame_source_factory import FrameSourceFactory
+from trap.executors.executors_service import EXECUTOR_INFERENCE, EXECUTOR_ENCODE
+from trap.metrics.metrics_registry import REGISTRY
+from trap.metrics.trace import TraceContext, SequenceGaps
 from trap.sessions.detection_metadata import DetectionMetadata
 from trap.sessions.detection_metadata_with_image import DetectionMetaDataWithImage
 from trap.sessions.sessions_cache import SessionState
 from trap.websocket.protocol_component import ProtocolComponent
+from trap.workflow.batch_detector import BatchDetector
+from trap.workflow.best_shot import BestShots
+from trap.workflow.buffer_pool import BufferPool
+from trap.workflow.detections import Detections
+from trap.workflow.frame_context import FrameContext
+from trap.workflow.frame_gate import FrameGate
+from trap.workflow.inference_workers import InferenceWorkerPool, parse_affinity
+from trap.workflow.jpeg_encoder import JpegEncoder, EncodeProfile
+from trap.workflow.model_selector import ModelSelector, model_name
+from trap.workflow.ncnn_detector import NcnnDetector, NcnnBatchDetector
+from trap.workflow.pipeline import DropOldestQueue, Pipeline
+from trap.workflow.tiling import TiledDetector, TILING_OFF, TILING_GRID, merge
+from trap.workflow.tracker import Tracker
+from trap.workflow.yuv import Yuv420Image
 from trap.workflow.proto import control_pb2
 
 NCNN_MODEL = "./models/insects_320_ncnn_model"
+MODELS = [NCNN_MODEL, "./models/insects_640_ncnn_model"]
+
+# The inference engine, either the ultralytics predictor or the native NCNN detector
+DETECTOR_ULTRALYTICS = "ultralytics"
+DETECTOR_NCNN = "ncnn"
+
+# The tracker, either the one built into model.track() or the built-in Tracker. The
+# NCNN detector always uses the built-in tracker
+TRACKER_ULTRALYTICS = "ultralytics"
+TRACKER_BUILTIN = "builtin"
+
+# minimum detector score when tracking, the same as ultralytics uses for track()
+TRACK_MIN_SCORE = 0.1
+# frames a track is kept without being matched, at least two detect intervals
+TRACK_MAX_AGE = 30
+
+# How detections are shown in the preview, either as a separate detection.overlay
+# message that the app draws or burned into the preview JPEG
+OVERLAY_METADATA = "metadata"
+OVERLAY_BURNED = "burned"
+
+# How captured frames are held by the pipeline, see FrameContext
+BUFFER_MODE_MAPPED = "mapped"
+BUFFER_MODE_COPY = "copy"
 MAIN_SIZE = (2028, 1520)
 LORES_SIZE = (320, 320)
 
+# The format of the main stream. Only crops (and tiles) are ever read from it, as
+# YUV420 it is half the size of RGB888 and only the regions read are converted
+MAIN_FORMAT_RGB = "RGB888"
+MAIN_FORMAT_YUV = "YUV420"
+
+
+# =========================================================================
+# create_batch_detector()
+# the detector shared by the workflows of all the cameras, it needs the
+# built-in tracker as every camera keeps its own tracks. Tiling and model
+# selection are not supported with it
+# =========================================================================
+def create_batch_detector(configuration, executors) -> BatchDetector:
+    if configuration.tiling != TILING_OFF or configuration.model_selection:
+        logging.getLogger(name=__name__).warning(
+            "The batch detector does not support tiling or model selection")
+    max_batch = len(configuration.camera_numbers)
+    executor = executors.get_executor(EXECUTOR_INFERENCE)
+    if configuration.detector == DETECTOR_NCNN:
+        detector = NcnnBatchDetector(configuration.detector_model, max_batch, conf=TRACK_MIN_SCORE)
+        return BatchDetector(detector.detect_batch, max_batch, configuration.batch_window, detector.size, executor)
+
+    from ultralytics import YOLO
+    model = YOLO(configuration.detector_model, task="detect")
+
+    def detect_batch(images):
+        results = model.predict(images, conf=TRACK_MIN_SCORE, verbose=False)
+        return [Detections.from_ultralytics(result) for result in results]
+
+    return BatchDetector(detect_batch, max_batch, configuration.batch_window, LORES_SIZE[0], executor)
 
 
 class CameraWorkflow(ProtocolComponent):
     name = ""
 
-    def __init__(self, configuration, channels, settings, websocket):
+    def __init__(self, configuration, channels, settings, websocket, executors, camera_num=0, batch_detector=None):
         super().__init__(channels)
 
         self.logger = logging.getLogger(__name__)
 
+        # -----------------------------------------------------------------
+        # With several cameras the first one is the primary, it streams the
+        # preview and answers the app. The sessions of the others are named
+        # after the camera
+        # -----------------------------------------------------------------
+        self.camera_num = camera_num
+        self.primary = camera_num == configuration.camera_numbers[0]
+        self.session_suffix = "" if self.primary else f"-cam{camera_num}"
+
         self.configuration = configuration
         self.settings = settings
         self.websocket = websocket
+        self.executors = executors
+        self.inference_executor = executors.get_executor(EXECUTOR_INFERENCE)
         self.camera = CameraFactory().instantiate_camera(
                 name=configuration.camera_type,
                 channels=channels,
@@ -45,23 +127,190 @@ class CameraWorkflow(ProtocolComponent):
 
         self.command_queue = Queue()
 
-        self.model = YOLO(NCNN_MODEL, task="detect")
+        self.model = None
+        self.detector = None
+        self.selector = None
+        self.batch_detector = batch_detector
+        self.detect_latency = 0.0
+        if batch_detector is not None:
+            # the detector is shared with the other cameras
+            self.logger.debug(f"Camera {camera_num} uses the batch detector")
+        elif configuration.detector == DETECTOR_NCNN and configuration.model_selection:
+            # -----------------------------------------------------------------
+            # All the models are loaded (and warmed up) up front so that the
+            # selector can switch between them without any load time
+            # -----------------------------------------------------------------
+            self.selector = ModelSelector(
+                {model_name(path): NcnnDetector(path, conf=TRACK_MIN_SCORE) for path in configuration.models},
+                target_fps=configuration.target_fps,
+                max_temperature=configuration.max_temperature
+            )
+            self.detector = self.selector.detector
+        elif configuration.detector == DETECTOR_NCNN:
+            self.detector = NcnnDetector(configuration.detector_model, conf=TRACK_MIN_SCORE)
+        else:
+            # only pull in torch and the ultralytics stack when it is used
+            from ultralytics import YOLO
+            self.model = YOLO(configuration.detector_model, task="detect")
+
+        # ---------------------------------------------------------------------
+        # With the built-in tracker the detector is only run on every
+        # detect_interval frames and the tracks are propagated in between.
+        # A track outlives the frames between two detections
+        # ---------------------------------------------------------------------
+        self.detect_interval = max(1, configuration.detect_interval)
+        self.tracker = None
+        if self.model is None or configuration.tracker == TRACKER_BUILTIN:
+            self.tracker = Tracker(max_age=max(TRACK_MAX_AGE, 2 * self.detect_interval))
+        self.tracked_frames = 0
+        self.tracker_session = None
+        self.inference_session = None
+        self.last_detections = None
+
+        # ---------------------------------------------------------------------
+        # Tiled inference on the main stream, merged with the lores detections
+        # before tracking. It needs the NCNN engine and the built-in tracker
+        # ---------------------------------------------------------------------
+        self.tiling = configuration.tiling
+        self.tiler = None
+        if self.tiling != TILING_OFF and self.batch_detector is None:
+            if self.tracker is None or self.detector is None:
+                self.logger.warning("Tiled inference needs detector=ncnn and tracker=builtin")
+            else:
+                self.tiler = TiledDetector(
+                    configuration.tile_model or configuration.detector_model,
+                    conf=TRACK_MIN_SCORE,
+                    max_tiles=configuration.tile_max,
+                    workers=configuration.tile_workers
+                )
+
+        # ---------------------------------------------------------------------
+        # Inference in worker processes, each with its own NCNN detector on
+        # the lores frame, so that several frames can be in flight and the
+        # model does not compete for the GIL with the rest of the workflow
+        # ---------------------------------------------------------------------
+        self.workers = None
+        if configuration.inference_workers > 0:
+            if self.tracker is None or self.detector is None:
+                self.logger.warning("Inference workers need detector=ncnn and tracker=builtin")
+            elif self.tiler is not None or self.selector is not None:
+                self.logger.warning("Inference workers do not support tiling or model selection")
+            else:
+                self.workers = InferenceWorkerPool(
+                    configuration.detector_model,
+                    workers=configuration.inference_workers,
+                    conf=TRACK_MIN_SCORE,
+                    shape=(LORES_SIZE[1], LORES_SIZE[0], 3),
+                    affinity=parse_affinity(configuration.worker_cpus)
+                )
+
+        # ---------------------------------------------------------------------
+        # The gate skips inference on static, blurry and focusing frames
+        # ---------------------------------------------------------------------
+        self.gate = None
+        if configuration.gate:
+            self.gate = FrameGate(
+                motion_threshold=configuration.gate_motion_threshold,
+                min_sharpness=configuration.gate_min_sharpness,
+                max_skip=configuration.gate_max_skip
+            )
 
         self.current_session = None
         self.min_score = 0
 
-        self.picam2 = None
+        self.source = None
         self.loop = asyncio.get_running_loop()
         self.preview_state = False
         self.detection_state = False
 
-        self.picam2 = Picamera2()
+        self.best_shots = BestShots()
+
+        # JPEG encoding runs on the encode executor with separate profiles for
+        # the preview stream and the stored crops
+        self.encoder = JpegEncoder(executors.get_executor(EXECUTOR_ENCODE))
+        self.preview_profile = EncodeProfile(
+            "preview", configuration.preview_quality, configuration.preview_max_dimension)
+        self.archive_profile = EncodeProfile(
+            "archive", configuration.archive_quality, configuration.archive_max_dimension)
+
+        # ---------------------------------------------------------------------
+        # The workflow is a pipeline of stages connected by bounded queues so that
+        # the next frame is captured while the current one is being processed
+        #  capture -> inference -> tracking -> encode -> persist
+        # Frames are dropped oldest-first when a stage falls behind. Detections
+        # are never dropped, the persist queue applies backpressure instead.
+        # The tracking queue holds the frames whose inference is in flight and
+        # keeps them in order
+        # ---------------------------------------------------------------------
+        depth = configuration.pipeline_depth
+        self.sequence = 0
+        self.source_done = asyncio.Event()
+        self.pipeline = Pipeline(
+            ["capture", "inference", "tracking", "encode", "persist"],
+            name=f"camera {camera_num}" if len(configuration.camera_numbers) > 1 else None,
+            history=configuration.latency_history
+        )
+        self.inference_queue = DropOldestQueue("inference", depth, self.drop_frame)
+        self.tracking_queue = asyncio.Queue(maxsize=self.workers.workers if self.workers is not None else 1)
+        self.encode_queue = DropOldestQueue("encode", depth, self.drop_frame)
+        self.persist_queue = asyncio.Queue(maxsize=depth)
+
+        labels = {"camera": str(camera_num)}
+        self.capture_wait = REGISTRY.histogram(
+            "trap_capture_wait_seconds", "Time waiting for the next frame from the source", labels)
+        self.inference_time = REGISTRY.histogram(
+            "trap_inference_seconds", "Time to run the detector on a frame", {"mode": "thread"})
+        self.tracking_time = REGISTRY.histogram(
+            "trap_tracking_seconds", "Time to update the tracker with the detections of a frame", labels)
+        for name, queue in (("inference", self.inference_queue), ("tracking", self.tracking_queue),
+                            ("encode", self.encode_queue), ("persist", self.persist_queue)):
+            REGISTRY.gauge("trap_queue_depth", "Frames waiting in front of a pipeline stage",
+                           dict(labels, queue=name), function=queue.qsize)
+
+        # frames skipped by the sensor before capture, and frames dropped by the
+        # pipeline before the encode stage
+        self.sensor_gaps = SequenceGaps("sensor", labels)
+        self.pipeline_gaps = SequenceGaps("pipeline", labels)
+
+        # ---------------------------------------------------------------------
+        # In copy mode the lores stream (and the main stream while detecting, for
+        # the crops) is copied into pooled buffers and the request released before
+        # inference. In mapped mode every frame held by the pipeline pins a camera
+        # buffer so more of them are needed
+        # ---------------------------------------------------------------------
+        self.buffer_mode = configuration.buffer_mode
+        if self.buffer_mode == BUFFER_MODE_COPY:
+            self.lores_pool = BufferPool("lores", configuration.buffer_pool_size)
+            self.main_pool = BufferPool("main", configuration.buffer_pool_size)
+            self.pipeline.add_reporter(self.lores_pool)
+            self.pipeline.add_reporter(self.main_pool)
+            buffer_count = 4
+        else:
+            buffer_count = 2 * depth + 3 + self.tracking_queue.maxsize
 
-        camera_config = self.picam2.create_preview_configuration(
-            main={'format': 'RGB888', 'size': MAIN_SIZE},
-            lores={'format': 'RGB888', 'size': LORES_SIZE}
+        # the camera sensor, or recorded or generated frames when running headless
+        self.yuv_size = MAIN_SIZE if configuration.main_format == MAIN_FORMAT_YUV else None
+        self.source = FrameSourceFactory.instantiate_source(
+            configuration, self.camera, camera_num, MAIN_SIZE, LORES_SIZE,
+            self.yuv_size is not None, buffer_count
         )
-        self.camera.setup(self.picam2, camera_config)
+
+        if self.gate is not None:
+            self.pipeline.add_reporter(self.gate)
+        if self.tiler is not None:
+            self.pipeline.add_reporter(self.tiler)
+        if self.selector is not None:
+            self.pipeline.add_reporter(self.selector)
+        if self.workers is not None:
+            self.pipeline.add_reporter(self.workers)
+        if self.batch_detector is not None and self.primary:
+            self.pipeline.add_reporter(self.batch_detector)
+        self.pipeline.add_reporter(self.best_shots)
+        self.pipeline.add_reporter(self.encoder)
+        if self.primary:
+            self.pipeline.add_reporter(self.executors)
+        self.pipeline.add_reporter(self.sensor_gaps)
+        self.pipeline.add_reporter(self.pipeline_gaps)
 
     async def run_workflow_task(self) :
         self.logger.debug("Starting workflow task....")
@@ -73,13 +322,18 @@ class CameraWorkflow(ProtocolComponent):
         )
 
     async def websocket_listener_task(self):
-        in_channel = self.websocket.subscribe_many_messages(
-            "camera.get",
-            "detection.state.get",
-            "detection.state.set",
-            "preview.state.get",
-            "preview.state.set"
-        )
+        if not self.primary:
+            # the other cameras only follow the detection state
+            in_channel = self.websocket.subscribe_many_messages("detection.state.set")
+        else:
+            in_channel = self.websocket.subscribe_many_messages(
+                "camera.get",
+                "model.get",
+                "detection.state.get",
+                "detection.state.set",
+                "preview.state.get",
+                "preview.state.set"
+            )
         await in_channel.subscribe(self.handle_message)
 
     async def connection_state_listener_task(self):
@@ -101,6 +355,9 @@ class CameraWorkflow(ProtocolComponent):
             except Exception as ex :
                 x=1;
 
+        elif message.identifier == "model.get":
+            await self.publish_proto("model", self.model_to_proto())
+
         elif message.identifier == "detection.state.get":
 
             state_msg = control_pb2.StateWithSession()
@@ -115,20 +372,22 @@ class CameraWorkflow(ProtocolComponent):
             msg.ParseFromString(message.protobuf)
             if msg.state:
                 now = datetime.now()
-                self.current_session = now.strftime("%Y%m%d%H%M%S")
+                self.current_session = now.strftime("%Y%m%d%H%M%S") + self.session_suffix
                 await self.channels.get_channel("session_channel").publish(
-                    SessionState(state=True, session=self.current_session))
+                    SessionState(state=True, session=self.current_session, camera=self.camera_num))
                 state_msg = control_pb2.StateWithSession()
                 state_msg.state =True
                 state_msg.session = self.current_session
-                await self.publish_proto("detection.state", state_msg)
+                if self.primary:
+                    await self.publish_proto("detection.state", state_msg)
                 self.detection_state = True
             else :
                 self.detection_state = False
                 self.current_session = None
                 state_msg = control_pb2.StateWithSession()
                 state_msg.state = False
-                await self.publish_proto("detection.state", state_msg)
+                if self.primary:
+                    await self.publish_proto("detection.state", state_msg)
 
 
         elif message.identifier == "preview.state.get":
@@ -144,136 +403,468 @@ class CameraWorkflow(ProtocolComponent):
 
 
 
-    def do_track(self, array):
+    def model_to_proto(self):
+        msg = control_pb2.Model()
+        if self.selector is not None:
+            msg.name = self.selector.current
+            msg.reason = self.selector.reason
+            msg.automatic = True
+        else:
+            msg.name = model_name(self.configuration.detector_model)
+            msg.reason = "fixed"
+        if self.detector is not None:
+            msg.size = self.detector.size
+        elif self.batch_detector is not None:
+            msg.size = self.batch_detector.size
+            self.detect_latency = self.batch_detector.latency
+        msg.latency = 1000 * self.detect_latency
+        return msg
+
+    def do_track(self, frame) -> Detections:
         start_model = time.perf_counter()
-        #results = self.model.track(array, persist=True, conf=0.1, tracker='bytetrack.yaml')
-        results = self.model.track(array)
-        end_model = time.perf_counter()
-        print("model = ", (end_model - start_model) * 1000)
-        return results
-
-    async def get_image(self) -> CompletedRequest:
-        logging.debug("Get image")
-        future = self.loop.create_future()
-
-        def job_done_callback(job: "picamera2.job.Job"):
-            try:
-                result = job.get_result()
-            except Exception as e:
-                self.loop.call_soon_threadsafe(future.set_exception, e)
-            else:
-                self.loop.call_soon_threadsafe(future.set_result, result)
+        array = frame.lores
+        if self.tracker is None:
+            #results = self.model.track(array, persist=True, conf=0.1, tracker='bytetrack.yaml')
+            results = self.model.track(array)
+            detections = Detections.from_ultralytics(results[0])
+        else:
+            # the tracks are updated by the tracking stage
+            detections = self.do_detect(frame)
+            if self.tiler is not None:
+                detections = self.detect_tiles(frame, detections)
+        self.inference_time.observe_since(start_model)
+        return detections
+
+    def do_detect(self, frame) -> Detections:
+        start = time.perf_counter()
+        if self.model is not None:
+            results = self.model.predict(frame.lores, conf=TRACK_MIN_SCORE, verbose=False)
+            detections = Detections.from_ultralytics(results[0])
+        else:
+            detections = self.detect_scaled(self.detector, frame)
+        self.detect_latency = time.perf_counter() - start
+        return detections
+
+    # =====================================================================
+    # detect_scaled()
+    # models with a larger input than the lores stream are fed from the
+    # main stream, resized with the same aspect ratio as the lores stream,
+    # and their boxes are mapped back to lores coordinates
+    # =====================================================================
+    def detect_scaled(self, detector, frame) -> Detections:
+        lores_h, lores_w = frame.lores.shape[:2]
+        if detector.size <= max(lores_w, lores_h) or frame.main is None:
+            return detector.detect(frame.lores)
+
+        factor = detector.size / max(lores_w, lores_h)
+        size = (int(lores_w * factor), int(lores_h * factor))
+        if isinstance(frame.main, Yuv420Image):
+            image = frame.main.resize(size)
+        else:
+            image = cv2.resize(frame.main, size, interpolation=cv2.INTER_AREA)
+        detections = detector.detect(image)
+        detections.boxes /= factor
+        return detections
+
+    # =====================================================================
+    # detect_tiles()
+    # run the detector over tiles of the main stream, either a grid or
+    # tiles centred on the lores detections and on motion, and merge the
+    # results (in lores coordinates) with the lores detections. Without a
+    # main stream there is nothing to tile
+    # =====================================================================
+    def detect_tiles(self, frame, detections) -> Detections:
+        if frame.main is None:
+            return detections
+        main_h, main_w = frame.main.shape[:2]
+        lores_h, lores_w = frame.lores.shape[:2]
+        scale = np.array([main_w / lores_w, main_h / lores_h] * 2, np.float32)
+
+        if self.tiling == TILING_GRID:
+            centres = None
+        else:
+            boxes = detections.boxes
+            centres = [(boxes[:, 0:2] + boxes[:, 2:4]) / 2]
+            if self.gate is not None:
+                centres.append(self.gate.motion_centres())
+            centres = np.concatenate(centres) * scale[:2]
+            if len(centres) == 0:
+                return detections
+
+        tiled = self.tiler.detect(frame.main, centres)
+        tiled.boxes /= scale
+        return merge([detections, tiled], self.tiler.iou)
+
+    # =====================================================================
+    # infer()
+    # start the detector on the frame. Returns None if the frame is gated
+    # out or is not a detector frame and the tracks are only propagated.
+    # With inference workers the detection is returned as a future so that
+    # the next frame can be submitted while this one is in flight
+    # =====================================================================
+    async def infer(self, frame):
+        if frame.session != self.inference_session:
+            self.inference_session = frame.session
+            self.tracked_frames = 0
+
+        if self.gate is not None and not self.gate.check(frame.lores, frame.metadata):
+            frame.gated = True
+            return None
 
-        self.camera.picam2.capture_request(signal_function=job_done_callback)
-        return await future
+        if self.tracker is not None:
+            self.tracked_frames += 1
+            if (self.tracked_frames - 1) % self.detect_interval != 0:
+                return None
+
+        if self.workers is not None:
+            return asyncio.ensure_future(self.workers.detect(frame.lores))
+        if self.batch_detector is not None:
+            return asyncio.ensure_future(self.batch_detector.detect(frame.lores))
+
+        # run the detection on the inference executor
+        return await self.loop.run_in_executor(self.inference_executor, self.do_track, frame)
+
+    # =====================================================================
+    # track()
+    # update the tracker with the detections of the frame, or only
+    # propagate the tracks if the detector was not run on it
+    # =====================================================================
+    async def track(self, frame, job) -> Detections:
+        if self.tracker is not None and frame.session != self.tracker_session:
+            self.tracker.reset()
+            self.tracker_session = frame.session
+            self.last_detections = None
+
+        if job is None:
+            return self.propagate(age=not frame.gated)
+
+        detections = await job if asyncio.isfuture(job) else job
+        if self.tracker is not None:
+            start = time.perf_counter()
+            detections = self.tracker.update(detections)
+            self.tracking_time.observe_since(start)
+        self.last_detections = detections
+        if self.selector is not None:
+            await self.select_model(self.last_detections)
+        return self.last_detections
+
+    async def select_model(self, detections):
+        self.selector.observe(self.detect_latency, len(detections) > 0)
+        if self.selector.decide() is not None:
+            self.detector = self.selector.detector
+            await self.publish_proto("model.switched", self.model_to_proto())
+
+    def propagate(self, age=True):
+        if self.tracker is not None:
+            return self.tracker.predict(age)
+        if self.last_detections is not None:
+            return dataclasses.replace(self.last_detections, predicted=True)
+        return None
+
+    async def get_image(self) -> CapturedFrame:
+        return await self.source.capture()
 
     async def close_camera(self):
-        self.picam2.stop()
-        self.picam2.close()
+        self.source.close()
 
     async def workflow_task(self):
         logging.debug("Starting cameras workflow task...")
+        try:
+            await asyncio.gather(
+                self.capture_task(),
+                self.inference_task(),
+                self.tracking_task(),
+                self.encode_task(),
+                self.persist_task(),
+                self.pipeline.report_task()
+            )
+        finally:
+            self.close()
+
+    # =====================================================================
+    # close()
+    # when the workflow stops, stop the inference worker processes, which
+    # frees their shared frame ring, and close the frame source
+    # =====================================================================
+    def close(self):
+        try:
+            if self.workers is not None:
+                self.workers.close()
+                self.workers = None
+        finally:
+            if self.source is not None:
+                self.source.close()
+                self.source = None
+
+    def drop_frame(self, frame):
+        logging.debug(f"Dropping frame {frame.sequence}")
+        frame.release()
+
+    # =====================================================================
+    # capture stage
+    # apply camera controls and wait for the next frame from the sensor
+    # =====================================================================
+    async def capture_task(self):
+        stats = self.pipeline.stage("capture")
         while True:
-          await self.process_image()
-
-    async def process_image(self):
-
-        await self.camera.control_camera()
-
-        request = await self.get_image()
-        metadata = request.get_metadata()
-
-        with MappedArray(request, 'lores') as l:
-            with MappedArray(request, 'main') as m:
-
-                min_score = self.settings.settings.min_score
-
+            start = time.perf_counter()
+            await self.camera.control_camera()
+
+            wait = time.perf_counter()
+            request = await self.get_image()
+            self.capture_wait.observe_since(wait)
+            if request is None:
+                self.logger.info(f"End of frames after {self.sequence} frames")
+                self.source_done.set()
+                return
+            self.sequence += 1
+            metadata = request.get_metadata()
+            self.sensor_gaps.observe_metadata(metadata)
+            trace = TraceContext.from_metadata(metadata, self.sequence)
+            frame = FrameContext(request, metadata, self.sequence, self.yuv_size, trace)
+            if self.buffer_mode == BUFFER_MODE_COPY:
+                frame.copy(self.lores_pool, self.main_pool if self.detection_state else None)
+            else:
+                frame.map()
+
+            stats.record(start)
+            self.inference_queue.put(frame)
+            stats.dropped = self.inference_queue.dropped
+
+    # =====================================================================
+    # inference stage
+    # run the model on the lores frame while detection is enabled
+    # =====================================================================
+    async def inference_task(self):
+        stats = self.pipeline.stage("inference")
+        while True:
+            frame = await self.inference_queue.get()
+            start = time.perf_counter()
+            job = None
+            try:
                 if self.detection_state:
-
-                    # run the tracking in a thread
-                    results = await self.loop.run_in_executor(None, self.do_track, l.array)
-
-                    try :
-                        if results[0].boxes is not None :
-                            img = results[0].orig_img
-
-                            boxes = results[0].boxes.xyxy.cpu().numpy().astype(np.int32)
-                            track_ids = [tid.item() for tid in results[0].boxes.id.int().cpu().numpy()]
-                            scores = [s.item() for s in results[0].boxes.conf.numpy()]
-                            classes = [c.item() for c in results[0].boxes.cls.numpy().astype(np.int32)]
-                            detections = list(zip(boxes, track_ids, scores, classes))
-
-                            if self.preview_state :
-                                for box, track_id, score, clazz in detections :
-                                    x1, y1, x2, y2 = map(int, box)  # Convert coordinates to integers
-                                    if score > min_score :
-                                        cv2.rectangle(img, (x1, y1), (x2, y2),  (24, 130, 24), 2)  # high score
-                                        cv2.putText(img, f"{track_id}/{score:.2f}", (x1, y1 -5),
-                                                         cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1)
-                                    else :
-                                        cv2.rectangle(img, (x1, y1), (x2, y2),  (84, 84, 84), 1)  # low score
-                                        cv2.putText(img, f"{track_id}/{score:.2f}", (x1, y1 - 5),
-                                                        cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1)
-                                jpeg = self.to_jpeg(img)
-                                logging.debug("STREAMING FRAME WITH BOXES")
-                                await self.camera.process_frame(metadata, jpeg)
-
-                            await self.save_detections(m, detections, min_score)
-                    except Exception as e :
-                        logging.warn(f"Discarding results on error {e}")
+                    frame.session = self.current_session
+                    job = await self.infer(frame)
 
                 else :
                     # close the open session
                     if self.current_session is not None:
                         await self.channels.get_channel("session_channel").publish(
-                            SessionState(state=False, session=self.current_session))
+                            SessionState(state=False, session=self.current_session, camera=self.camera_num))
                         self.current_session = None
 
-                    if self.preview_state:
-                        jpeg = self.to_jpeg(l.array)
-                        logging.debug("STREAMING FRAME")
-                        await self.camera.process_frame(metadata, jpeg)
+            except Exception as e :
+                logging.warn(f"Discarding results on error {e}")
+                frame.session = None
 
-        logging.debug("RELEASE REQUEST")
-        request.release()
+            stats.record(start)
+            await self.tracking_queue.put((frame, job))
 
+    # =====================================================================
+    # tracking stage
+    # wait for the detections of each frame, in capture order, and update
+    # the tracks with them
+    # =====================================================================
+    async def tracking_task(self):
+        stats = self.pipeline.stage("tracking")
+        while True:
+            frame, job = await self.tracking_queue.get()
+            start = time.perf_counter()
+            try:
+                if frame.session is not None:
+                    frame.detections = await self.track(frame, job)
+            except Exception as e :
+                logging.warn(f"Discarding results on error {e}")
+                frame.detections = None
+
+            stats.record(start)
+            self.encode_queue.put(frame)
+            stats.dropped = self.encode_queue.dropped
+
+    # =====================================================================
+    # encode stage
+    # draw and stream the preview and encode the crops of the detections.
+    # The preview and the crops are encoded in parallel by the encoder.
+    # This is the last stage that needs the camera buffers
+    # =====================================================================
+    async def encode_task(self):
+        stats = self.pipeline.stage("encode")
+        while True:
+            frame = await self.encode_queue.get()
+            start = time.perf_counter()
+            self.pipeline_gaps.observe(frame.sequence)
+            try:
+                min_score = self.settings.settings.min_score
+                detections = frame.detections
+
+                # the preview is only made when a client is ready for it, at the
+                # quality its connection can sustain
+                preview = None
+                if self.preview_state and self.websocket.preview_due():
+                    self.preview_profile.quality = self.websocket.preview_quality(
+                        self.configuration.preview_quality)
+                    burn = self.configuration.overlay == OVERLAY_BURNED
+                    if burn and detections is not None and len(detections) > 0:
+                        img = frame.lores.copy()
+                        self.draw_detections(img, detections, min_score)
+                        preview = self.encoder.encode(img, self.preview_profile)
+                        logging.debug("STREAMING FRAME WITH BOXES")
+                    else :
+                        preview = self.encoder.encode(frame.lores, self.preview_profile)
+                        logging.debug("STREAMING FRAME")
+                    if not burn and frame.session is not None:
+                        await self.publish_proto(
+                            "detection.overlay", self.overlay_to_proto(frame, min_score), frame.trace)
+
+                # untracked detections have no identity to store them under and
+                # propagated ones have no new image content
+                crops = None
+                if (detections is not None and detections.track_ids is not None
+                        and not detections.predicted and frame.session is not None):
+                    crops = self.save_detections(frame, detections, min_score)
+
+                # both must complete before the frame buffers are released
+                preview, crops = await asyncio.gather(
+                    preview or self.nothing(), crops or self.nothing(), return_exceptions=True)
+                frame.release()
+
+                if isinstance(preview, Exception):
+                    logging.warn(f"Failed to encode preview {preview}")
+                elif preview is not None:
+                    await self.camera.process_frame(frame.metadata, preview, frame.sequence, frame.trace)
+                if isinstance(crops, Exception):
+                    logging.error(f"Failed to encode detections {crops}")
+                elif crops:
+                    await self.persist_queue.put(crops)
+
+            except Exception as e :
+                logging.warn(f"Discarding frame on error {e}")
+            finally:
+                frame.release()
+
+            stats.record(start)
+
+    # =====================================================================
+    # overlay_to_proto()
+    # the detections of the frame packed into little-endian arrays, with
+    # the boxes normalised to 0..65535 of the frame size so that they can
+    # be drawn on a preview of any resolution
+    # =====================================================================
+    def overlay_to_proto(self, frame, min_score):
+        msg = control_pb2.DetectionOverlay()
+        height, width = frame.lores.shape[:2]
+        msg.sequence = frame.sequence
+        msg.width = width
+        msg.height = height
+        msg.min_score = min_score
+
+        detections = frame.detections
+        if detections is None or len(detections) == 0:
+            return msg
+
+        scale = np.array([65535 / width, 65535 / height] * 2, np.float32)
+        msg.count = len(detections)
+        msg.boxes = np.clip(detections.boxes * scale, 0, 65535).astype("<u2").tobytes()
+        if detections.track_ids is not None:
+            msg.track_ids = detections.track_ids.astype("<i4").tobytes()
+        msg.scores = detections.scores.astype("<f4").tobytes()
+        msg.classes = detections.classes.astype("u1").tobytes()
+        msg.predicted = detections.predicted
+        return msg
+
+    async def nothing(self):
+        return None
+
+    def draw_detections(self, img, detections, min_score):
+        for box, track_id, score, clazz in detections.rows() :
+            x1, y1, x2, y2 = map(int, box)  # Convert coordinates to integers
+            if score > min_score :
+                cv2.rectangle(img, (x1, y1), (x2, y2),  (24, 130, 24), 2)  # high score
+                cv2.putText(img, f"{track_id}/{score:.2f}", (x1, y1 -5),
+                                 cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1)
+            else :
+                cv2.rectangle(img, (x1, y1), (x2, y2),  (84, 84, 84), 1)  # low score
+                cv2.putText(img, f"{track_id}/{score:.2f}", (x1, y1 - 5),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1)
+
+    # =====================================================================
+    # persist stage
+    # hand the encoded detections to the sessions cache
+    # =====================================================================
+    async def persist_task(self):
+        stats = self.pipeline.stage("persist")
+        channel = self.channels.get_channel("detection_channel")
+        while True:
+            crops = await self.persist_queue.get()
+            start = time.perf_counter()
+            for detection in crops:
+                try:
+                    await channel.publish(detection)
+                except Exception as e:
+                    logging.error(f"Failed to save detection {e}")
+            stats.record(start)
+
+    # =====================================================================
+    # save_detections()
+    # only detections that beat the best score of their track are cropped
+    # and encoded, the others are sent as metadata-only updates so that
+    # the updated time of the detection is kept current. The boxes are
+    # clamped to the frame and the empty ones skipped, a crop that fails
+    # to encode is sent as a metadata-only update
+    # =====================================================================
     async def save_detections(self, frame, detections, min_score):
-        try :
-            #if self.current_session is None:
-            #    now = datetime.now()
-            #    self.current_session = now.strftime("%Y%m%d%H%M%S")
-            #    await self.channels.get_channel("session_channel").publish(SessionState(state=True, session=self.current_session))
-
-            for box, track_id, score, clazz in detections:
-                logging.debug(f"score = {score} min-score = {min_score}")
-
-                if score >= min_score:
-                    scaled_box = self.scale(box)
+        crops = []
+        for box, track_id, score, clazz in detections.select(detections.scores >= min_score).rows():
+            logging.debug(f"score = {score} min-score = {min_score}")
+            try :
+                scaled_box = self.clamp(self.scale(box), frame)
+                x0, y0, x1, y1 = scaled_box
+                if x1 <= x0 or y1 <= y0:
+                    logging.debug(f"Skipping empty box {scaled_box} of track {track_id}")
+                    continue
+                img_width = x1 - x0
+                img_height = y1 - y0
+
+                current_datetime = datetime.now()
+                current_timestamp_ms = int(current_datetime.timestamp() * 1000)
+
+                metadata = DetectionMetadata(
+                    session=frame.session,
+                    detection=track_id,
+                    created=current_timestamp_ms,
+                    updated=current_timestamp_ms,
+                    score=score,
+                    clazz=clazz,
+                    width=img_width,
+                    height=img_height
+                )
+
+                if frame.main is not None and self.best_shots.improved(frame.session, track_id, score):
                     logging.debug(f"scaled-box {scaled_box}")
-                    x0, y0, x1, y1 = scaled_box
-                    img_width = x1 - x0
-                    img_height = y1 - y0
-
-                    current_datetime = datetime.now()
-                    current_timestamp_ms = int(current_datetime.timestamp() * 1000)
-
-                    metadata = DetectionMetadata(
-                        session=self.current_session,
-                        detection=track_id,
-                        created=current_timestamp_ms,
-                        updated=current_timestamp_ms,
-                        score=score,
-                        clazz=clazz,
-                        width=img_width,
-                        height=img_height
-                    )
-
-                    image = self.to_jpeg(frame.array[y0:y1, x0:x1])
-
-                    await self.channels.get_channel("detection_channel").publish(DetectionMetaDataWithImage(metadata, image))
-            x=0
-        except Exception as e:
-            logging.error(f"Failed to save detections {e}")
+                    if isinstance(frame.main, Yuv420Image):
+                        image = self.encoder.submit_planes(frame.main.planes(x0, y0, x1, y1), self.archive_profile)
+                    else:
+                        image = self.encoder.submit(frame.main[y0:y1, x0:x1], self.archive_profile)
+                    crops.append((metadata, image))
+                else:
+                    crops.append((metadata, None))
+            except Exception as e:
+                logging.error(f"Failed to save detection {track_id} {e}")
+
+        # wait for the batch of crops to be encoded
+        encoded = [image for _, image in crops if image is not None]
+        images = iter(await asyncio.gather(*encoded, return_exceptions=True))
+        saved = []
+        for metadata, image in crops:
+            if image is not None:
+                image = next(images)
+                if isinstance(image, BaseException):
+                    logging.error(f"Failed to encode detection {metadata.detection} {image}")
+                    image = None
+                elif image is not None:
+                    self.best_shots.commit(metadata.session, metadata.detection, metadata.score)
+            saved.append(DetectionMetaDataWithImage(metadata, image, frame.trace))
+        return saved
 
     def scale(self, rect):
         s_w, s_h = LORES_SIZE
@@ -283,10 +874,7 @@ class CameraWorkflow(ProtocolComponent):
         y_scale = d_h / s_h
         return int(x0 * x_scale), int(y0 * y_scale), int(x1 * x_scale), int(y1 * y_scale)
 
-    def to_jpeg(self, img):
-        is_success, im_buf = cv2.imencode(".jpg", img)
-        if is_success:
-            return im_buf.tobytes()
-        else:
-            logging.error("Failed to convert image to jpeg")
-            return None
+    def clamp(self, rect, frame):
+        height, width = frame.main.shape[:2] if frame.main is not None else MAIN_SIZE[::-1]
+        x0, y0, x1, y1 = rect
+        return max(0, x0), max(0, y0), min(x1, width), min(y1, height)
@@ -0,0 +1,81 @@
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+# ==========================================================================================
+# Detections
+# The result of running a detector on one frame, held as a struct of arrays :
+#  - boxes     : (N, 4) float32 x0, y0, x1, y1 in the coordinates of the lores frame
+#  - scores    : (N,) float32
+#  - classes   : (N,) int32
+#  - track_ids : (N,) int32, or None if the detections have not been tracked
+#  - predicted : the boxes were propagated by the tracker, the detector was not run
+# ==========================================================================================
+@dataclass
+class Detections :
+    boxes : np.ndarray
+    scores : np.ndarray
+    classes : np.ndarray
+    track_ids : Optional[np.ndarray] = None
+    predicted : bool = False
+
+    @staticmethod
+    def empty():
+        return Detections(
+            np.zeros((0, 4), np.float32),
+            np.zeros((0,), np.float32),
+            np.zeros((0,), np.int32)
+        )
+
+    @staticmethod
+    def from_ultralytics(result):
+        boxes = result.boxes
+        if boxes is None:
+            return Detections.empty()
+        track_ids = None
+        if boxes.id is not None:
+            track_ids = boxes.id.cpu().numpy().astype(np.int32)
+        return Detections(
+            boxes.xyxy.cpu().numpy().astype(np.float32),
+            boxes.conf.cpu().numpy().astype(np.float32),
+            boxes.cls.cpu().numpy().astype(np.int32),
+            track_ids
+        )
+
+    @staticmethod
+    def concatenate(detections):
+        detections = [d for d in detections if d is not None]
+        if not detections:
+            return Detections.empty()
+        return Detections(
+            np.concatenate([d.boxes for d in detections]),
+            np.concatenate([d.scores for d in detections]),
+            np.concatenate([d.classes for d in detections])
+        )
+
+    def __len__(self):
+        return len(self.scores)
+
+    def select(self, mask):
+        return Detections(
+            self.boxes[mask],
+            self.scores[mask],
+            self.classes[mask],
+            None if self.track_ids is None else self.track_ids[mask],
+            self.predicted
+        )
+
+    # ------------------------------------------------------------------------------
+    # Iterate over the detections as (box, track_id, score, clazz) tuples of Python
+    # values. Only use this for the (few) detections that are drawn or saved
+    # ------------------------------------------------------------------------------
+    def rows(self):
+        track_ids = self.track_ids if self.track_ids is not None else np.full(len(self), -1, np.int32)
+        return zip(
+            self.boxes.tolist(),
+            track_ids.tolist(),
+            self.scores.tolist(),
+            self.classes.tolist()
+        )
@@ -0,0 +1,81 @@
+import logging
+
+from trap.workflow.yuv import Yuv420Image
+
+
+# ==========================================================================================
+# FrameContext
+# A captured frame (see trap.cameras.sources) travelling through the workflow pipeline.
+# There are two ways the image data can be held :
+#  - map()  : the camera request stays mapped (and so owned by the workflow) until
+#             release() is called by the last stage that needs the image data, or by
+#             the queue that drops the frame
+#  - copy() : the streams that are needed are copied into pooled buffers and the
+#             request is released immediately. release() returns the buffers
+# When the main stream is YUV420 yuv_size is its (width, height) and main is a
+# Yuv420Image over the buffer, so only the regions that are used are converted.
+# trace is the TraceContext passed on to the detections and messages made from the frame,
+# gated is set when the frame gate skipped inference on it
+# ==========================================================================================
+class FrameContext :
+    def __init__(self, request, metadata, sequence, yuv_size=None, trace=None):
+        self.request = request
+        self.metadata = metadata
+        self.sequence = sequence
+        self.yuv_size = yuv_size
+        self.trace = trace
+
+        self.session = None
+        self.gated = False
+        self.detections = None
+        self.lores = None
+        self.main = None
+
+        self._mapped = []
+        self._pooled = []
+
+    def map(self):
+        for stream in ("lores", "main"):
+            mapped = self.request.map(stream)
+            self._mapped.append(mapped.__enter__())
+        self.lores = self._mapped[0].array
+        self.main = self._wrap(self._mapped[1].array)
+        return self
+
+    def copy(self, lores_pool, main_pool=None):
+        try:
+            with self.request.map("lores") as lores:
+                self.lores = lores_pool.copy(lores.array)
+                self._pooled.append((lores_pool, self.lores))
+            if main_pool is not None:
+                with self.request.map("main") as main:
+                    buffer = main_pool.copy(main.array)
+                    self._pooled.append((main_pool, buffer))
+                    self.main = self._wrap(buffer)
+        finally:
+            self.request.release()
+            self.request = None
+        return self
+
+    def _wrap(self, array):
+        if self.yuv_size is None:
+            return array
+        return Yuv420Image(array, *self.yuv_size)
+
+    def release(self):
+        self.lores = None
+        self.main = None
+        for pool, buffer in self._pooled:
+            pool.release(buffer)
+        self._pooled.clear()
+
+        if self.request is None:
+            return
+        try:
+            for mapped in reversed(self._mapped):
+                mapped.__exit__(None, None, None)
+        finally:
+            self._mapped.clear()
+            logging.debug("RELEASE REQUEST")
+            self.request.release()
+            self.request = None
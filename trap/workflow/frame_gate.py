@@ -0,0 +1,131 @@
+import cv2
+import numpy as np
+
+# libcamera controls.AfStateEnum.Scanning
+AF_STATE_SCANNING = 1
+
+# Gate decisions
+GATE_PASS = "pass"
+GATE_STATIC = "static"
+GATE_BLURRY = "blurry"
+GATE_FOCUSING = "focusing"
+
+
+# ==========================================================================================
+# FrameGate
+# A cheap check, run before the model, of whether a lores frame is worth running
+# inference on. Frames are skipped when :
+#  - focusing : the autofocus is scanning or the lens has moved since the last frame
+#  - blurry   : the variance of the Laplacian is below min_sharpness
+#  - static   : less than motion_threshold percent of the pixels of a downsampled frame
+#               differ from a running background model
+# A frame is always passed after max_skip consecutive static frames so that the
+# detections are refreshed periodically
+# ==========================================================================================
+class FrameGate :
+    def __init__(self, motion_threshold=0.5, min_sharpness=15.0, max_skip=30,
+                 pixel_threshold=12, lens_tolerance=0.05, learning_rate=0.05, downsample=4):
+        self.motion_threshold = motion_threshold
+        self.min_sharpness = min_sharpness
+        self.max_skip = max_skip
+        self.pixel_threshold = pixel_threshold
+        self.lens_tolerance = lens_tolerance
+        self.learning_rate = learning_rate
+        self.downsample = downsample
+
+        self.gray = None
+        self.small = None
+        self.background = None
+        self.difference = None
+        # whether difference is the motion of the last frame checked
+        self.motion = False
+        self.lens_position = None
+        self.static_frames = 0
+
+        self.counts = {GATE_PASS: 0, GATE_STATIC: 0, GATE_BLURRY: 0, GATE_FOCUSING: 0}
+
+    def _allocate(self, shape):
+        h, w = shape[:2]
+        small = (h // self.downsample, w // self.downsample)
+        self.gray = np.empty((h, w), np.uint8)
+        self.small = np.empty(small, np.uint8)
+        self.difference = np.empty(small, np.float32)
+        self.background = None
+
+    def check(self, lores, metadata) -> bool:
+        decision = self.decide(lores, metadata)
+        self.counts[decision] += 1
+        return decision == GATE_PASS
+
+    def decide(self, lores, metadata):
+        self.motion = False
+
+        # focus
+        af_state = metadata.get("AfState")
+        lens_position = metadata.get("LensPosition")
+        moved = (lens_position is not None and self.lens_position is not None
+                 and abs(lens_position - self.lens_position) > self.lens_tolerance)
+        self.lens_position = lens_position
+        if af_state == AF_STATE_SCANNING or moved:
+            return GATE_FOCUSING
+
+        if self.gray is None or self.gray.shape != lores.shape[:2]:
+            self._allocate(lores.shape)
+        cv2.cvtColor(lores, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        # sharpness
+        if self.min_sharpness > 0:
+            _, stddev = cv2.meanStdDev(cv2.Laplacian(self.gray, cv2.CV_16S))
+            if stddev[0, 0] ** 2 < self.min_sharpness:
+                return GATE_BLURRY
+
+        # motion against the background model
+        cv2.resize(self.gray, self.small.shape[::-1], dst=self.small, interpolation=cv2.INTER_AREA)
+        if self.background is None:
+            self.background = self.small.astype(np.float32)
+            return self._pass()
+
+        np.subtract(self.small, self.background, out=self.difference)
+        np.abs(self.difference, out=self.difference)
+        self.motion = True
+        cv2.accumulateWeighted(self.small, self.background, self.learning_rate)
+        changed = 100.0 * cv2.countNonZero(cv2.compare(
+            self.difference, self.pixel_threshold, cv2.CMP_GT)) / self.difference.size
+
+        if changed < self.motion_threshold and self.static_frames < self.max_skip:
+            self.static_frames += 1
+            return GATE_STATIC
+        return self._pass()
+
+    # ------------------------------------------------------------------------------
+    # Centres, in lores pixels, of the largest regions that differed from the background
+    # in the last frame checked, none if it was not checked for motion (focusing, blurry
+    # or the first frame)
+    # ------------------------------------------------------------------------------
+    def motion_centres(self, max_count=8):
+        if not self.motion:
+            return np.zeros((0, 2), np.float32)
+        mask = cv2.compare(self.difference, self.pixel_threshold, cv2.CMP_GT)
+        count, _, stats, centroids = cv2.connectedComponentsWithStats(mask)
+        if count <= 1:
+            return np.zeros((0, 2), np.float32)
+        # label 0 is the background
+        order = np.argsort(-stats[1:, cv2.CC_STAT_AREA])[:max_count] + 1
+        return (centroids[order] * self.downsample).astype(np.float32)
+
+    def _pass(self):
+        self.static_frames = 0
+        return GATE_PASS
+
+    def skip_rate(self):
+        total = sum(self.counts.values())
+        if total == 0:
+            return 0.0
+        return 1.0 - self.counts[GATE_PASS] / total
+
+    def stats(self):
+        return dict(self.counts, skip_rate=self.skip_rate())
+
+    def __str__(self):
+        return (f"gate: {100 * self.skip_rate():.0f}% skipped, " +
+                ", ".join(f"{k} {v}" for k, v in self.counts.items()))
@@ -0,0 +1,239 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import struct
+import time
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.workflow.detections import Detections
+
+# request : request id, slot, height, width
+# result  : request id, inference seconds, followed by (N, 6) float32 rows of
+#           x0, y0, x1, y1, score, class
+RESULT_HEADER = struct.Struct("<Qd")
+
+
+# ==========================================================================================
+# SharedFrameRing
+# Fixed size frame slots in shared memory. A frame is copied into a slot by the main
+# process and read in place by a worker, so no image data is pickled
+# ==========================================================================================
+class SharedFrameRing :
+    def __init__(self, slots, shape, dtype=np.uint8, name=None):
+        self.slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        size = slots * int(np.prod(self.shape)) * self.dtype.itemsize
+        self.owner = name is None
+        self.memory = SharedMemory(name=name, create=self.owner, size=size if self.owner else 0)
+        self.frames = np.ndarray((slots,) + self.shape, self.dtype, buffer=self.memory.buf)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def write(self, slot, image):
+        h, w = image.shape[:2]
+        np.copyto(self.frames[slot, :h, :w], image)
+        return h, w
+
+    def read(self, slot, h, w):
+        return self.frames[slot, :h, :w]
+
+    def close(self):
+        self.frames = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+# ==========================================================================================
+# worker_main()
+# Entry point of an inference worker process. Loads its own detector, optionally pins
+# itself to a set of cores and serves detection requests until it receives None
+# ==========================================================================================
+def worker_main(ring_name, slots, shape, model_path, conf, cpus, connection):
+    from trap.workflow.ncnn_detector import NcnnDetector
+
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            logging.getLogger(name=__name__).warning(f"Failed to pin inference worker to cpus {cpus}: {e}")
+    ring = SharedFrameRing(slots, shape, name=ring_name)
+    detector = NcnnDetector(model_path, conf=conf, num_threads=max(1, len(cpus) if cpus else 1))
+    try:
+        while True:
+            request = connection.recv()
+            if request is None:
+                break
+            request_id, slot, h, w = request
+            start = time.perf_counter()
+            detections = detector.detect(ring.read(slot, h, w))
+            rows = np.empty((len(detections), 6), np.float32)
+            rows[:, 0:4] = detections.boxes
+            rows[:, 4] = detections.scores
+            rows[:, 5] = detections.classes
+            connection.send_bytes(RESULT_HEADER.pack(request_id, time.perf_counter() - start) + rows.tobytes())
+    finally:
+        ring.close()
+
+
+# ==========================================================================================
+# WorkerStats
+# ==========================================================================================
+class WorkerStats :
+    def __init__(self, index, cpus):
+        self.index = index
+        self.cpus = cpus
+        self.frames = 0
+        self.busy = 0.0
+        self.started = time.monotonic()
+
+    def fps(self):
+        elapsed = time.monotonic() - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+
+    def utilisation(self):
+        elapsed = time.monotonic() - self.started
+        return self.busy / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        cpus = ",".join(str(c) for c in self.cpus) if self.cpus else "any"
+        return f"worker {self.index} (cpus {cpus}): {self.fps():.1f} fps, {100 * self.utilisation():.0f}% busy"
+
+
+# ==========================================================================================
+# InferenceWorkerPool
+# Runs the NCNN detector in dedicated processes so that inference does not compete for
+# the GIL with the rest of the workflow. Each worker owns one slot of the shared frame
+# ring, frames are handed over through the slot and the requests and results travel
+# over a pipe per worker whose results are read by the event loop. detect() may be
+# called concurrently, up to one frame per worker is in flight. A worker is idle again
+# only once the result of its request has arrived, even if detect() was cancelled
+# ==========================================================================================
+class InferenceWorkerPool :
+    def __init__(self, model_path, workers=2, conf=0.1, shape=(320, 320, 3), affinity=None):
+        self.logger = logging.getLogger(name=__name__)
+        self.loop = asyncio.get_running_loop()
+        self.workers = workers
+        self.ring = SharedFrameRing(workers, shape)
+        self.idle = asyncio.Queue()
+        # worker : (request id, future) of the request it is working on
+        self.pending = {}
+        self.next_request = 0
+        self.connections = []
+        self.processes = []
+        self.alive = []
+        self.stats = []
+        self.inference_time = REGISTRY.histogram(
+            "trap_inference_seconds", "Time to run the detector on a frame", {"mode": "worker"})
+
+        context = multiprocessing.get_context("spawn")
+        for index in range(workers):
+            cpus = affinity[index % len(affinity)] if affinity else None
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=worker_main,
+                args=(self.ring.name, workers, shape, model_path, conf, cpus, child),
+                name=f"inference-{index}",
+                daemon=True
+            )
+            process.start()
+            self.loop.add_reader(parent.fileno(), self._on_result, index)
+            self.connections.append(parent)
+            self.processes.append(process)
+            self.alive.append(True)
+            self.stats.append(WorkerStats(index, cpus))
+            self.idle.put_nowait(index)
+
+    async def detect(self, image) -> Detections:
+        worker = await self.idle.get()
+        try:
+            if not self.alive[worker]:
+                raise RuntimeError(f"Inference worker {worker} exited")
+            h, w = self.ring.write(worker, image)
+            self.next_request += 1
+            future = self.loop.create_future()
+            self.connections[worker].send((self.next_request, worker, h, w))
+            self.pending[worker] = (self.next_request, future)
+        except BaseException:
+            self.idle.put_nowait(worker)
+            raise
+        # the worker goes back to idle when its result arrives
+        return await future
+
+    def _on_result(self, worker):
+        request_id, future = self.pending.get(worker, (None, None))
+        try:
+            data = self.connections[worker].recv_bytes()
+        except (EOFError, OSError) as e:
+            self.loop.remove_reader(self.connections[worker].fileno())
+            self.alive[worker] = False
+            self.logger.error(f"Inference worker {worker} exited: {e}")
+            if future is not None:
+                del self.pending[worker]
+                if not future.done():
+                    future.set_exception(RuntimeError(f"Inference worker {worker} exited"))
+                self.idle.put_nowait(worker)
+            return
+
+        result_id, elapsed = RESULT_HEADER.unpack_from(data)
+        if result_id != request_id:
+            self.logger.warning(f"Ignoring result {result_id} of inference worker {worker}, "
+                                f"expected {request_id}")
+            return
+        del self.pending[worker]
+        self.idle.put_nowait(worker)
+
+        rows = np.frombuffer(data, np.float32, offset=RESULT_HEADER.size).reshape(-1, 6)
+        stats = self.stats[worker]
+        stats.frames += 1
+        stats.busy += elapsed
+        self.inference_time.observe(elapsed)
+
+        if not future.done():
+            future.set_result(Detections(
+                rows[:, 0:4].copy(),
+                rows[:, 4].copy(),
+                rows[:, 5].astype(np.int32)
+            ))
+
+    # stop the workers, those that do not stop are terminated, and unlink the frame ring
+    def close(self):
+        for connection in self.connections:
+            self.loop.remove_reader(connection.fileno())
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                self.logger.warning(f"Terminating inference worker {process.name}")
+                process.terminate()
+                process.join(timeout=2)
+        for connection in self.connections:
+            connection.close()
+        for _, future in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+        self.ring.close()
+
+    def __str__(self):
+        return " | ".join(str(s) for s in self.stats)
+
+
+# ==========================================================================================
+# parse_affinity()
+# "0,1;2,3" -> [{0, 1}, {2, 3}], one set of cores per worker
+# ==========================================================================================
+def parse_affinity(value):
+    if not value:
+        return None
+    return [{int(c) for c in group.split(",") if c.strip()} for group in value.split(";") if group.strip()]
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from trap.metrics.metrics_registry import REGISTRY
+from trap.workflow.yuv import planes_to_bgr
+
+# simplejpeg (a picamera2 dependency) encodes straight from YUV planes, without it the
+# planes are converted to BGR first
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+
+# ==========================================================================================
+# EncodeProfile
+# JPEG quality and an optional limit on the longest side of the image, larger images are
+# scaled down before they are encoded
+# ==========================================================================================
+@dataclass
+class EncodeProfile :
+    name : str
+    quality : int
+    max_dimension : Optional[int] = None
+
+
+# ==========================================================================================
+# JpegEncoder
+# Encodes images to JPEG on the encode executor (cv2.imencode releases the GIL) so that
+# encoding never runs on the event loop. Images are submitted singly or as a batch and
+# the results returned as futures. The number of images waiting or being encoded and
+# the throughput are tracked
+# ==========================================================================================
+class JpegEncoder :
+    def __init__(self, executor, window=5.0):
+        self.logger = logging.getLogger(name=__name__)
+        self.executor = executor
+        self.workers = executor.workers
+        self.window = window
+
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.encoded = 0
+        self.bytes = 0
+        self.completions = deque(maxlen=1024)
+        self.timers = {}
+
+    def timer(self, profile):
+        timer = self.timers.get(profile.name)
+        if timer is None:
+            timer = REGISTRY.histogram("trap_jpeg_encode_seconds", "Time to encode a JPEG", {"profile": profile.name})
+            self.timers[profile.name] = timer
+        return timer
+
+    def encode_sync(self, img, profile) -> Optional[bytes]:
+        start = time.perf_counter()
+        try:
+            if profile.max_dimension is not None:
+                h, w = img.shape[:2]
+                longest = max(h, w)
+                if longest > profile.max_dimension:
+                    scale = profile.max_dimension / longest
+                    img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                     interpolation=cv2.INTER_AREA)
+
+            is_success, im_buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, profile.quality])
+            if is_success:
+                return im_buf.tobytes()
+            self.logger.error("Failed to convert image to jpeg")
+            return None
+        except Exception as e:
+            self.logger.error(f"Failed to convert image to jpeg {e}")
+            return None
+        finally:
+            self.timer(profile).observe_since(start)
+            with self.lock:
+                self.pending -= 1
+                self.encoded += 1
+                self.completions.append(time.perf_counter())
+
+    # ------------------------------------------------------------------------------
+    # Encode the Y, U and V planes of a YUV420 image
+    # ------------------------------------------------------------------------------
+    def encode_planes_sync(self, planes, profile) -> Optional[bytes]:
+        if simplejpeg is None:
+            return self.encode_sync(planes_to_bgr(*planes), profile)
+
+        start = time.perf_counter()
+        try:
+            y, u, v = planes
+            if profile.max_dimension is not None:
+                h, w = y.shape
+                longest = max(h, w)
+                if longest > profile.max_dimension:
+                    scale = profile.max_dimension / longest
+                    size = (max(2, int(w * scale)) & ~1, max(2, int(h * scale)) & ~1)
+                    half = (size[0] // 2, size[1] // 2)
+                    y = cv2.resize(y, size, interpolation=cv2.INTER_AREA)
+                    u = cv2.resize(u, half, interpolation=cv2.INTER_AREA)
+                    v = cv2.resize(v, half, interpolation=cv2.INTER_AREA)
+            return simplejpeg.encode_jpeg_yuv_planes(
+                np.ascontiguousarray(y), np.ascontiguousarray(u), np.ascontiguousarray(v),
+                quality=profile.quality)
+        except Exception as e:
+            self.logger.error(f"Failed to convert planes to jpeg {e}")
+            return None
+        finally:
+            self.timer(profile).observe_since(start)
+            with self.lock:
+                self.pending -= 1
+                self.encoded += 1
+                self.completions.append(time.perf_counter())
+
+    def submit(self, img, profile) -> asyncio.Future:
+        return self._submit(self.encode_sync, img, profile)
+
+    def submit_planes(self, planes, profile) -> asyncio.Future:
+        return self._submit(self.encode_planes_sync, planes, profile)
+
+    def _submit(self, encode, img, profile) -> asyncio.Future:
+        with self.lock:
+            self.pending += 1
+        future = asyncio.wrap_future(self.executor.submit(encode, img, profile))
+        future.add_done_callback(self._count_bytes)
+        return future
+
+    def _count_bytes(self, future):
+        if not future.cancelled() and future.exception() is None and future.result() is not None:
+            self.bytes += len(future.result())
+
+    async def encode(self, img, profile) -> Optional[bytes]:
+        return await self.submit(img, profile)
+
+    def encode_batch(self, images, profile) -> list:
+        return [self.submit(img, profile) for img in images]
+
+    def throughput(self):
+        horizon = time.perf_counter() - self.window
+        with self.lock:
+            return sum(1 for t in self.completions if t >= horizon) / self.window
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "encoded": self.encoded,
+            "bytes": self.bytes,
+            "throughput": self.throughput()
+        }
+
+    def __str__(self):
+        return (f"jpeg: {self.throughput():.1f} images/s, {self.pending} pending, "
+                f"{self.encoded} encoded, {self.bytes // 1024} KiB")
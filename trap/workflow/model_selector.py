@@ -0,0 +1,135 @@
+import logging
+import os
+import time
+
+import numpy as np
+
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+THROTTLED = "/sys/devices/platform/soc/soc:firmware/get_throttled"
+
+# get_throttled bits : frequency capped, currently throttled, soft temperature limit
+THROTTLED_NOW = 0x2 | 0x4 | 0x8
+
+# Reasons for a model switch
+REASON_INITIAL = "initial"
+REASON_LATENCY = "latency"
+REASON_THERMAL = "thermal"
+REASON_IDLE = "idle"
+REASON_ACTIVE = "active"
+
+
+def read_temperature():
+    try:
+        with open(THERMAL_ZONE) as f:
+            return int(f.read().strip()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttled():
+    try:
+        with open(THROTTLED) as f:
+            return (int(f.read().strip(), 16) & THROTTLED_NOW) != 0
+    except (OSError, ValueError):
+        return False
+
+
+# ==========================================================================================
+# ModelSelector
+# Chooses between preloaded detectors of different input sizes at runtime. The larger
+# model is used while insects are being detected, the frame rate target can be met and
+# the CPU is neither hot nor throttled. Otherwise the smallest model is used. Latencies
+# are tracked per model (seeded by a warm-up run when the models are loaded) and a
+# model is kept for at least min_dwell seconds to avoid flapping
+# ==========================================================================================
+class ModelSelector :
+    def __init__(self, detectors, target_fps=5.0, max_temperature=75.0, min_dwell=30.0,
+                 check_interval=2.0, active_threshold=0.05):
+        self.logger = logging.getLogger(name=__name__)
+
+        # smallest model first
+        self.detectors = dict(sorted(detectors.items(), key=lambda d: d[1].size))
+        self.names = list(self.detectors.keys())
+        self.budget = 1.0 / target_fps
+        self.max_temperature = max_temperature
+        self.min_dwell = min_dwell
+        self.check_interval = check_interval
+        self.active_threshold = active_threshold
+
+        self.latency = {name: None for name in self.names}
+        self.activity = 0.0
+        self.current = self.names[0]
+        self.reason = REASON_INITIAL
+        self.switched_at = time.monotonic()
+        self.checked_at = self.switched_at
+        self.switches = 0
+
+        self.warm_up()
+
+    @property
+    def detector(self):
+        return self.detectors[self.current]
+
+    def warm_up(self):
+        for name, detector in self.detectors.items():
+            image = np.zeros((detector.size, detector.size, 3), np.uint8)
+            detector.detect(image)
+            start = time.perf_counter()
+            detector.detect(image)
+            self.latency[name] = time.perf_counter() - start
+            self.logger.debug(f"Model {name} warm-up latency {1000 * self.latency[name]:.1f} ms")
+
+    # ------------------------------------------------------------------------------
+    # Record the latency of an inference and whether anything was detected
+    # ------------------------------------------------------------------------------
+    def observe(self, latency, detected):
+        previous = self.latency[self.current]
+        self.latency[self.current] = latency if previous is None else 0.9 * previous + 0.1 * latency
+        self.activity = 0.95 * self.activity + 0.05 * (1.0 if detected else 0.0)
+
+    # ------------------------------------------------------------------------------
+    # Returns the name of the model to switch to, or None to keep the current one
+    # ------------------------------------------------------------------------------
+    def decide(self):
+        now = time.monotonic()
+        if now - self.checked_at < self.check_interval or len(self.names) < 2:
+            return None
+        self.checked_at = now
+
+        temperature = read_temperature()
+        hot = read_throttled() or (temperature is not None and temperature > self.max_temperature)
+        active = self.activity >= self.active_threshold
+        index = self.names.index(self.current)
+
+        if hot and index > 0:
+            return self._switch(self.names[0], REASON_THERMAL, now)
+        if self.latency[self.current] > self.budget and index > 0:
+            return self._switch(self.names[index - 1], REASON_LATENCY, now)
+        if now - self.switched_at < self.min_dwell:
+            return None
+        if not active and index > 0:
+            return self._switch(self.names[0], REASON_IDLE, now)
+
+        # move up to the largest model that fits the budget with some headroom
+        if active and not hot:
+            for name in reversed(self.names[index + 1:]):
+                if self.latency[name] is not None and self.latency[name] < 0.8 * self.budget:
+                    return self._switch(name, REASON_ACTIVE, now)
+        return None
+
+    def _switch(self, name, reason, now):
+        self.logger.info(f"Switching model {self.current} -> {name} ({reason})")
+        self.current = name
+        self.reason = reason
+        self.switched_at = now
+        self.switches += 1
+        return name
+
+    def __str__(self):
+        latency = self.latency[self.current] or 0
+        return (f"model: {self.current} ({self.reason}), {1000 * latency:.1f} ms, "
+                f"activity {self.activity:.2f}, {self.switches} switches")
+
+
+def model_name(path):
+    return os.path.basename(os.path.normpath(path))
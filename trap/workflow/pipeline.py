@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from trap.metrics.metrics_registry import REGISTRY
+
+# number of recent stage latencies kept for percentile reporting
+LATENCY_WINDOW = 512
+
+
+# ==========================================================================================
+# StageStats
+# Throughput and latency of one pipeline stage. The fps is measured over a sliding
+# window of completion times so that it reflects the current rate of the stage
+# ==========================================================================================
+class StageStats :
+    def __init__(self, name, window=5.0, history=LATENCY_WINDOW, labels=None):
+        self.name = name
+        self.window = window
+        self.frames = 0
+        self.dropped = 0
+        self.completions = deque()
+        self.latencies = deque(maxlen=history)
+
+        labels = dict(labels or {}, stage=name)
+        self.histogram = REGISTRY.histogram("trap_stage_seconds", "Time a frame spends in a pipeline stage", labels)
+        REGISTRY.gauge("trap_stage_dropped_frames", "Frames dropped in front of a pipeline stage", labels,
+                       function=lambda: self.dropped)
+
+    def record(self, started, finished=None):
+        if finished is None:
+            finished = time.perf_counter()
+        self.frames += 1
+        self.latencies.append(finished - started)
+        self.histogram.observe(finished - started)
+        self.completions.append(finished)
+        if len(self.completions) > LATENCY_WINDOW:
+            self.completions.popleft()
+
+    def drop(self):
+        self.dropped += 1
+
+    def fps(self):
+        horizon = time.perf_counter() - self.window
+        while self.completions and self.completions[0] < horizon:
+            self.completions.popleft()
+        return len(self.completions) / self.window
+
+    def latency_ms(self):
+        if not self.latencies:
+            return 0.0
+        return 1000 * sum(self.latencies) / len(self.latencies)
+
+    def percentile_ms(self, percent):
+        if not self.latencies:
+            return 0.0
+        latencies = sorted(self.latencies)
+        index = min(len(latencies) - 1, int(round(percent / 100 * (len(latencies) - 1))))
+        return 1000 * latencies[index]
+
+    def __str__(self):
+        return (f"{self.name}: {self.fps():.1f} fps, {self.latency_ms():.1f} ms, "
+                f"{self.frames} frames, {self.dropped} dropped")
+
+
+# ==========================================================================================
+# DropOldestQueue
+# Bounded queue between two pipeline stages. The producer never waits: when the queue
+# is full the oldest item is discarded (and handed to on_drop so that any camera
+# buffers it holds can be released) to make room for the newest one
+# ==========================================================================================
+class DropOldestQueue :
+    def __init__(self, name, depth, on_drop=None):
+        self.name = name
+        self.queue = asyncio.Queue(maxsize=max(1, depth))
+        self.on_drop = on_drop
+        self.dropped = 0
+
+    def put(self, item):
+        if self.queue.full():
+            oldest = self.queue.get_nowait()
+            self.dropped += 1
+            if self.on_drop is not None:
+                self.on_drop(oldest)
+        self.queue.put_nowait(item)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+# ==========================================================================================
+# Pipeline
+# Holds the statistics for each stage of the workflow and logs them periodically
+# ==========================================================================================
+class Pipeline :
+    def __init__(self, stages, report_interval=10.0, name=None, history=LATENCY_WINDOW):
+        self.logger = logging.getLogger(name=__name__)
+        self.name = name
+        labels = {"pipeline": name} if name else None
+        self.stages = {stage: StageStats(stage, history=history, labels=labels) for stage in stages}
+        self.report_interval = report_interval
+        self.reporters = []
+
+    # other components (e.g. buffer pools) whose state is logged with the stages
+    def add_reporter(self, reporter):
+        self.reporters.append(reporter)
+
+    def stage(self, name) -> StageStats:
+        return self.stages[name]
+
+    def stats(self):
+        return {
+            name: {
+                "fps": s.fps(),
+                "latency_ms": s.latency_ms(),
+                "p50_ms": s.percentile_ms(50),
+                "p95_ms": s.percentile_ms(95),
+                "p99_ms": s.percentile_ms(99),
+                "frames": s.frames,
+                "dropped": s.dropped
+            }
+            for name, s in self.stages.items()
+        }
+
+    async def report_task(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            prefix = f"{self.name}: " if self.name else ""
+            self.logger.info(prefix + " | ".join(str(s) for s in self.stages.values()))
+            for reporter in self.reporters:
+                self.logger.info(str(reporter))
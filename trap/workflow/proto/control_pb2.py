@@ -13,7 +13,7 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x13proto/control.proto\"\x16\n\x05State\x12\r\n\x05state\x18\x01 \x01(\x08\"2\n\x10StateWithSession\x12\r\n\x05state\x18\x01 \x01(\x08\x12\x0f\n\x07session\x18\x02 \x01(\t\"\x1a\n\nCameraType\x12\x0c\n\x04type\x18\x01 \x01(\tb\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x13proto/control.proto\"\x16\n\x05State\x12\r\n\x05state\x18\x01 \x01(\x08\"2\n\x10StateWithSession\x12\r\n\x05state\x18\x01 \x01(\x08\x12\x0f\n\x07session\x18\x02 \x01(\t\"\x1a\n\nCameraType\x12\x0c\n\x04type\x18\x01 \x01(\t\"W\n\x05Model\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x0c\n\x04size\x18\x02 \x01(\x05\x12\x0e\n\x06reason\x18\x03 \x01(\t\x12\x0f\n\x07latency\x18\x04 \x01(\x02\x12\x11\n\tautomatic\x18\x05 \x01(\x08\"\xbb\x01\n\x10\x44\x65tectionOverlay\x12\x10\n\x08sequence\x18\x01 \x01(\r\x12\r\n\x05width\x18\x02 \x01(\x05\x12\x0e\n\x06height\x18\x03 \x01(\x05\x12\r\n\x05\x63ount\x18\x04 \x01(\r\x12\r\n\x05\x62oxes\x18\x05 \x01(\x0c\x12\x11\n\ttrack_ids\x18\x06 \x01(\x0c\x12\x0e\n\x06scores\x18\x07 \x01(\x0c\x12\x0f\n\x07\x63lasses\x18\x08 \x01(\x0c\x12\x11\n\tmin_score\x18\t \x01(\x02\x12\x11\n\tpredicted\x18\n \x01(\x08\x62\x06proto3')
 
 _builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
 _builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'proto.control_pb2', globals())
@@ -26,4 +26,8 @@ if _descriptor._USE_C_DESCRIPTORS == False:
   _STATEWITHSESSION._serialized_end=97
   _CAMERATYPE._serialized_start=99
   _CAMERATYPE._serialized_end=125
+  _MODEL._serialized_start=127
+  _MODEL._serialized_end=214
+  _DETECTIONOVERLAY._serialized_start=217
+  _DETECTIONOVERLAY._serialized_end=404
 # @@protoc_insertion_point(module_scope)
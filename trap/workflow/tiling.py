@@ -0,0 +1,137 @@
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+
+import numpy as np
+
+from trap.workflow.detections import Detections
+from trap.workflow.ncnn_detector import NcnnDetector, nms, MAX_WH
+
+# Tiling modes
+TILING_OFF = "off"
+TILING_ROI = "roi"
+TILING_GRID = "grid"
+
+
+# ==========================================================================================
+# TiledDetector
+# Runs the detector at full resolution over square tiles of the main stream so that
+# small insects, which are lost when the frame is scaled down to the lores size, can be
+# detected. The tiles are either a grid covering the whole frame or are centred on
+# points of interest (coarse detections and motion). Either way at most max_tiles are
+# run per frame, which bounds the extra latency : a larger grid is covered over several
+# frames, max_tiles at a time. Each worker thread has its own detector instance and the
+# tiles of a frame are submitted together. The results are merged with cross-tile NMS
+# ==========================================================================================
+class TiledDetector :
+    def __init__(self, model_path, conf=0.1, iou=0.5, overlap=0.25, max_tiles=6, workers=2):
+        self.logger = logging.getLogger(name=__name__)
+        self.iou = iou
+        self.overlap = overlap
+        self.max_tiles = max(1, max_tiles)
+        # the first grid tile of the next frame
+        self.next_tile = 0
+
+        threads = max(1, (os.cpu_count() or 4) // workers)
+        self.detectors = Queue()
+        for _ in range(workers):
+            self.detectors.put(NcnnDetector(model_path, conf=conf, num_threads=threads))
+        self.tile_size = self.detectors.queue[0].size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tiles")
+
+        self.frames = 0
+        self.tiles = 0
+        self.latencies = deque(maxlen=256)
+
+    # ------------------------------------------------------------------------------
+    # Tile origins
+    # ------------------------------------------------------------------------------
+    def _origins(self, length):
+        size = self.tile_size
+        if length <= size:
+            return [0]
+        step = int(size * (1 - self.overlap))
+        origins = list(range(0, length - size, step))
+        origins.append(length - size)
+        return origins
+
+    def grid(self, width, height):
+        return [(x, y) for y in self._origins(height) for x in self._origins(width)]
+
+    # the next max_tiles tiles of the grid, in turn
+    def rotate(self, width, height):
+        tiles = self.grid(width, height)
+        if len(tiles) <= self.max_tiles:
+            return tiles
+        start = self.next_tile % len(tiles)
+        self.next_tile = start + self.max_tiles
+        return [tiles[(start + i) % len(tiles)] for i in range(self.max_tiles)]
+
+    def select(self, width, height, centres):
+        size = self.tile_size
+        margin = size * self.overlap / 2
+        tiles = []
+        for cx, cy in centres:
+            # skip points that are already well inside a selected tile
+            if any(x + margin <= cx <= x + size - margin and y + margin <= cy <= y + size - margin
+                   for x, y in tiles):
+                continue
+            x = int(min(max(cx - size / 2, 0), max(width - size, 0)))
+            y = int(min(max(cy - size / 2, 0), max(height - size, 0)))
+            tiles.append((x, y))
+            if len(tiles) >= self.max_tiles:
+                break
+        return tiles
+
+    def _detect_tile(self, image, x, y):
+        detector = self.detectors.get()
+        try:
+            detections = detector.detect(image[y:y + self.tile_size, x:x + self.tile_size])
+        finally:
+            self.detectors.put(detector)
+        detections.boxes += np.array([x, y, x, y], np.float32)
+        return detections
+
+    # ------------------------------------------------------------------------------
+    # Detect on the tiles of the image. If centres is None the image is covered by a
+    # grid, in turn, otherwise the tiles are centred on the given (x, y) points
+    # ------------------------------------------------------------------------------
+    def detect(self, image, centres=None) -> Detections:
+        start = time.perf_counter()
+        height, width = image.shape[:2]
+        tiles = self.rotate(width, height) if centres is None else self.select(width, height, centres)
+        if not tiles:
+            return Detections.empty()
+
+        futures = [self.executor.submit(self._detect_tile, image, x, y) for x, y in tiles]
+        detections = merge([f.result() for f in futures], self.iou)
+
+        self.frames += 1
+        self.tiles += len(tiles)
+        self.latencies.append(time.perf_counter() - start)
+        return detections
+
+    def latency_ms(self):
+        if not self.latencies:
+            return 0.0
+        return 1000 * sum(self.latencies) / len(self.latencies)
+
+    def __str__(self):
+        tiles = self.tiles / self.frames if self.frames else 0
+        return f"tiles: {tiles:.1f} per frame, {self.latency_ms():.1f} ms"
+
+
+# ==========================================================================================
+# merge()
+# Combine detections from overlapping tiles (or from the lores frame and the tiles) and
+# suppress the duplicates
+# ==========================================================================================
+def merge(detections, iou):
+    merged = Detections.concatenate(detections)
+    if len(merged) == 0:
+        return merged
+    keep = nms(merged.boxes + (merged.classes[:, None] * MAX_WH), merged.scores, iou)
+    return merged.select(keep)
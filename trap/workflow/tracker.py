@@ -0,0 +1,147 @@
+import lap
+import numpy as np
+
+from trap.workflow.detections import Detections
+
+
+# ==========================================================================================
+# iou_matrix()
+# Intersection over union of every box in a (N, 4) against every box in b (M, 4)
+# ==========================================================================================
+def iou_matrix(a, b):
+    if len(a) == 0 or len(b) == 0:
+        return np.zeros((len(a), len(b)), np.float32)
+    x0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x1 - x0, 0, None) * np.clip(y1 - y0, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+# ==========================================================================================
+# match()
+# Optimal assignment of rows to columns on 1 - iou, rejecting pairs below min_iou.
+# Returns the matched row and column indices
+# ==========================================================================================
+def match(iou, min_iou):
+    if iou.size == 0:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    _, x, _ = lap.lapjv(1.0 - iou, extend_cost=True, cost_limit=1.0 - min_iou)
+    rows = np.flatnonzero(x >= 0)
+    return rows, x[rows]
+
+
+# ==========================================================================================
+# Tracker
+# A ByteTrack style multi-object tracker. The state of all tracks is held in arrays :
+# the last measured box, a per-frame velocity and the number of frames since the track
+# was last measured. update() associates the detections with the tracks, first the high
+# score detections and then the low score ones against the tracks that are left over.
+# predict() advances the tracks with the constant velocity motion model on frames where
+# the detector is not run. On frames that were not worth running it on (see FrameGate)
+# the tracks are returned without being aged, so that a static insect keeps its track
+# however long the gate skips the detector
+# ==========================================================================================
+class Tracker :
+    def __init__(self, high_score=0.25, low_score=0.1, min_iou=0.3, max_age=30, smoothing=0.5):
+        self.high_score = high_score
+        self.low_score = low_score
+        self.min_iou = min_iou
+        self.max_age = max_age
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        self.next_id = 1
+        self.ids = np.zeros(0, np.int32)
+        self.boxes = np.zeros((0, 4), np.float32)
+        self.velocity = np.zeros((0, 4), np.float32)
+        self.scores = np.zeros(0, np.float32)
+        self.classes = np.zeros(0, np.int32)
+        self.since = np.zeros(0, np.int32)
+        self.active = np.zeros(0, bool)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _estimate(self):
+        return self.boxes + self.velocity * self.since[:, None]
+
+    def _tracks(self, mask, predicted):
+        return Detections(
+            self._estimate()[mask].astype(np.float32),
+            self.scores[mask],
+            self.classes[mask],
+            self.ids[mask],
+            predicted=predicted
+        )
+
+    # ------------------------------------------------------------------------------
+    # Propagate the tracks that were matched by the last update to the next frame
+    # without a detection, or only return them if age is False
+    # ------------------------------------------------------------------------------
+    def predict(self, age=True) -> Detections:
+        if age:
+            self.since += 1
+            self._expire()
+        return self._tracks(self.active, predicted=True)
+
+    def update(self, detections) -> Detections:
+        self.since += 1
+        estimate = self._estimate()
+
+        high = np.flatnonzero(detections.scores >= self.high_score)
+        low = np.flatnonzero((detections.scores >= self.low_score) & (detections.scores < self.high_score))
+
+        # first association : high score detections against all the tracks
+        rows, cols = match(iou_matrix(estimate, detections.boxes[high]), self.min_iou)
+        matched_tracks = rows
+        matched_detections = high[cols]
+
+        # second association : low score detections against the remaining tracks
+        remaining = np.setdiff1d(np.arange(len(self)), rows)
+        rows, cols = match(iou_matrix(estimate[remaining], detections.boxes[low]), self.min_iou)
+        matched_tracks = np.concatenate([matched_tracks, remaining[rows]])
+        matched_detections = np.concatenate([matched_detections, low[cols]])
+
+        if matched_tracks.size > 0:
+            measured = detections.boxes[matched_detections]
+            since = self.since[matched_tracks, None]
+            velocity = (measured - self.boxes[matched_tracks]) / since
+            self.velocity[matched_tracks] = (
+                self.smoothing * velocity + (1 - self.smoothing) * self.velocity[matched_tracks])
+            self.boxes[matched_tracks] = measured
+            self.scores[matched_tracks] = detections.scores[matched_detections]
+            self.classes[matched_tracks] = detections.classes[matched_detections]
+            self.since[matched_tracks] = 0
+        self.active = self.since == 0
+
+        # unmatched high score detections start new tracks
+        new = np.setdiff1d(high, matched_detections)
+        if new.size > 0:
+            ids = np.arange(self.next_id, self.next_id + new.size, dtype=np.int32)
+            self.next_id += new.size
+            self.ids = np.concatenate([self.ids, ids])
+            self.boxes = np.concatenate([self.boxes, detections.boxes[new]])
+            self.velocity = np.concatenate([self.velocity, np.zeros((new.size, 4), np.float32)])
+            self.scores = np.concatenate([self.scores, detections.scores[new]])
+            self.classes = np.concatenate([self.classes, detections.classes[new]])
+            self.since = np.concatenate([self.since, np.zeros(new.size, np.int32)])
+            self.active = np.concatenate([self.active, np.ones(new.size, bool)])
+
+        self._expire()
+        return self._tracks(self.since == 0, predicted=False)
+
+    def _expire(self):
+        alive = self.since <= self.max_age
+        if not alive.all():
+            self.ids = self.ids[alive]
+            self.boxes = self.boxes[alive]
+            self.velocity = self.velocity[alive]
+            self.scores = self.scores[alive]
+            self.classes = self.classes[alive]
+            self.since = self.since[alive]
+            self.active = self.active[alive]
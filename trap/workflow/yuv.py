@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+
+
+# ==========================================================================================
+# Yuv420Image
+# A view of a planar YUV420 (I420) frame as the camera delivers it : the full resolution
+# Y plane followed by the U and V planes at half resolution, each row padded to the
+# stride of the buffer. Nothing is converted up front. Slicing the image, as with an
+# RGB array, converts only the slice to BGR and planes() returns the (cropped) planes
+# without any conversion so that they can be JPEG encoded directly
+# ==========================================================================================
+class Yuv420Image :
+    def __init__(self, array, width, height):
+        self.array = array
+        self.width = width
+        self.height = height
+
+        stride = array.shape[1]
+        quarter = height // 4
+        self.y = array[:height, :width]
+        self.u = array[height:height + quarter].reshape(height // 2, stride // 2)[:, :width // 2]
+        self.v = array[height + quarter:height + 2 * quarter].reshape(height // 2, stride // 2)[:, :width // 2]
+
+    @property
+    def shape(self):
+        return self.height, self.width, 3
+
+    # ------------------------------------------------------------------------------
+    # The planes of a region, with the corners rounded to even pixels so that the
+    # chroma samples line up
+    # ------------------------------------------------------------------------------
+    def planes(self, x0=0, y0=0, x1=None, y1=None):
+        x0, y0 = x0 & ~1, y0 & ~1
+        x1 = min(self.width if x1 is None else x1 + (x1 & 1), self.width)
+        y1 = min(self.height if y1 is None else y1 + (y1 & 1), self.height)
+        return (
+            self.y[y0:y1, x0:x1],
+            self.u[y0 // 2:y1 // 2, x0 // 2:x1 // 2],
+            self.v[y0 // 2:y1 // 2, x0 // 2:x1 // 2]
+        )
+
+    def to_bgr(self, x0=0, y0=0, x1=None, y1=None):
+        return planes_to_bgr(*self.planes(x0, y0, x1, y1))
+
+    # ------------------------------------------------------------------------------
+    # Scale the planes before converting so that only the output size is converted
+    # ------------------------------------------------------------------------------
+    def resize(self, size):
+        width, height = size[0] & ~1, size[1] & ~1
+        half = (width // 2, height // 2)
+        return planes_to_bgr(
+            cv2.resize(self.y, (width, height), interpolation=cv2.INTER_AREA),
+            cv2.resize(self.u, half, interpolation=cv2.INTER_AREA),
+            cv2.resize(self.v, half, interpolation=cv2.INTER_AREA)
+        )
+
+    def __getitem__(self, key):
+        rows, cols = key
+        return self.to_bgr(cols.start or 0, rows.start or 0, cols.stop, rows.stop)
+
+
+# ==========================================================================================
+# planes_to_bgr()
+# Pack the planes into a contiguous I420 buffer and convert it to BGR
+# ==========================================================================================
+def planes_to_bgr(y, u, v):
+    h, w = y.shape
+    if h == 0 or w == 0:
+        return np.empty((h, w, 3), np.uint8)
+    buffer = np.empty((h * 3 // 2, w), np.uint8)
+    flat = buffer.reshape(-1)
+    n = h * w
+    flat[:n].reshape(h, w)[...] = y
+    flat[n:n + n // 4].reshape(u.shape)[...] = u
+    flat[n + n // 4:].reshape(v.shape)[...] = v
+    return cv2.cvtColor(buffer, cv2.COLOR_YUV2BGR_I420)